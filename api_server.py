@@ -0,0 +1,362 @@
+#!/usr/bin/env python
+"""
+Headless HTTP API for meal planning, grocery lists and image analysis.
+
+An ASGI (Starlette) service over the same core modules the Streamlit app uses, so mobile and
+batch clients get JSON instead of a UI. One process serves many concurrent clients: blocking
+work runs in the thread pool, and calls that hit an upstream LLM are limited to
+API_MAX_CONCURRENCY at a time (requests wait up to API_QUEUE_TIMEOUT_SECONDS for a slot, then
+get 503). Identical requests share the in-flight coalescing and the shared cache.
+
+    uvicorn api_server:app --host 0.0.0.0 --port 8000
+    python api_server.py --port 8000
+
+Endpoints:
+    GET  /health
+    POST /v1/meal-plans          {"calorie_target" | "profile", "preferences", "language", "planner"}
+    POST /v1/meal-plans/stream   same body; NDJSON events: accepted, progress, day, done | error
+    POST /v1/grocery-lists       {"meal_plan", "language"}
+    POST /v1/image-analysis      raw image body (Content-Type image/*), ?language=
+
+An X-User-Id header attributes a request's LLM usage to that user in the usage ledger
+(usage_ledger.py) and applies the per-user hourly token budget; requests without one share the
+budget of usage_ledger.ANONYMOUS_USER. The header is not authenticated, so the deployment-wide
+LLM_HOURLY_TOKEN_BUDGET is what bounds a client that rotates it.
+"""
+
+import json
+import time
+import asyncio
+import logging
+import argparse
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.middleware import Middleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+import meal_utils as utils
+import meal_solver
+import meal_templates
+import groq_api
+import usage_ledger
+from constants import (
+    GROQ_API_KEY, GEMINI_API_KEY, RESTRICTION_KEYWORDS, MACRO_SPLITS,
+    API_MAX_CONCURRENCY, API_QUEUE_TIMEOUT_SECONDS, API_MAX_IMAGE_BYTES,
+)
+from meal_plan_schema import normalize_meal_plan
+from errors import (
+    MealPlannerError, InvalidRequestError, ConfigurationError, UpstreamAPIError, RateLimitError, ResponseFormatError,
+    BudgetExceededError,
+)
+
+log = logging.getLogger(__name__)
+
+PLANNERS = ("auto", "instant", "ai")
+ACTIVITY_LEVELS = ("Sedentary", "Light", "Moderate", "Active", "Very Active")
+CALORIE_RANGE = (800, 6000)
+# Seconds between progress events on streaming endpoints
+PROGRESS_INTERVAL_SECONDS = 2.0
+
+_upstream_slots = asyncio.Semaphore(API_MAX_CONCURRENCY)
+
+# HTTP status for core errors; the first matching class wins, so subclasses come before their bases
+ERROR_STATUS = [
+    (InvalidRequestError, 422),
+    (RateLimitError, 429),
+    (BudgetExceededError, 429),
+    (ConfigurationError, 503),
+    (UpstreamAPIError, 502),
+    (ResponseFormatError, 502),
+    (MealPlannerError, 500),
+]
+
+
+class UsageUserMiddleware:
+    """
+    Binds the X-User-Id header (or ANONYMOUS_USER without one) to usage_ledger.current_user for the
+    request; thread pool calls inherit it.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        user_id = Headers(scope=scope).get("x-user-id", "").strip()[:128] or usage_ledger.ANONYMOUS_USER
+        with usage_ledger.acting_user(user_id):
+            await self.app(scope, receive, send)
+
+
+class ValidationError(Exception):
+    """Invalid request body; details is a list of {"field", "message"}."""
+
+    def __init__(self, details: list):
+        super().__init__("Invalid request")
+        self.details = details
+
+
+# --- Request validation ---
+
+def _food_list(value, field: str, errors: list) -> str:
+    """Accepts a comma-separated string or a list of strings; returns the comma-separated form."""
+    if value is None:
+        return ""
+    if isinstance(value, list) and all(isinstance(v, str) for v in value):
+        return ", ".join(v.strip() for v in value if v.strip())
+    if isinstance(value, str):
+        return value
+    errors.append({"field": field, "message": "must be a string or a list of strings"})
+    return ""
+
+
+def _validate_preferences(raw, errors: list) -> dict:
+    if raw is None:
+        raw = {}
+    if not isinstance(raw, dict):
+        errors.append({"field": "preferences", "message": "must be an object"})
+        return {}
+    goal = raw.get("goal", "Maintain Weight")
+    if goal not in MACRO_SPLITS:
+        errors.append({"field": "preferences.goal", "message": f"must be one of {list(MACRO_SPLITS)}"})
+    restrictions = raw.get("restrictions") or []
+    if not isinstance(restrictions, list) or any(r not in RESTRICTION_KEYWORDS for r in restrictions):
+        errors.append({"field": "preferences.restrictions", "message": f"must be a list drawn from {list(RESTRICTION_KEYWORDS)}"})
+        restrictions = []
+    return {
+        "goal": goal,
+        "restrictions": restrictions,
+        "favorites": _food_list(raw.get("favorites"), "preferences.favorites", errors),
+        "dislikes": _food_list(raw.get("dislikes"), "preferences.dislikes", errors),
+    }
+
+
+def _number(raw: dict, field: str, low: float, high: float, errors: list, prefix: str = ""):
+    value = raw.get(field)
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not low <= value <= high:
+        errors.append({"field": f"{prefix}{field}", "message": f"must be a number between {low} and {high}"})
+        return None
+    return value
+
+
+def _validate_meal_plan_request(body) -> dict:
+    """Validates a meal plan request body into {"calorie_target", "preferences", "language", "planner"}."""
+    errors = []
+    if not isinstance(body, dict):
+        raise ValidationError([{"field": "", "message": "body must be a JSON object"}])
+    preferences = _validate_preferences(body.get("preferences"), errors)
+
+    calorie_target = None
+    if "calorie_target" in body:
+        calorie_target = _number(body, "calorie_target", *CALORIE_RANGE, errors)
+    elif isinstance(body.get("profile"), dict):
+        profile = body["profile"]
+        age = _number(profile, "age", 18, 100, errors, "profile.")  # calculate_calories covers adults only
+        weight = _number(profile, "weight", 30, 300, errors, "profile.")
+        height = _number(profile, "height", 100, 250, errors, "profile.")
+        gender = profile.get("gender")
+        if gender not in ("Male", "Female"):
+            errors.append({"field": "profile.gender", "message": "must be 'Male' or 'Female'"})
+        activity = profile.get("activity", "Moderate")
+        if activity not in ACTIVITY_LEVELS:
+            errors.append({"field": "profile.activity", "message": f"must be one of {list(ACTIVITY_LEVELS)}"})
+        if not errors:
+            calorie_target = utils.calculate_calories(age, weight, height, gender, activity, preferences["goal"])
+            if calorie_target is None:
+                errors.append({"field": "profile", "message": "could not calculate a calorie target from this profile"})
+    else:
+        errors.append({"field": "calorie_target", "message": "either calorie_target or profile is required"})
+
+    planner = body.get("planner", "auto")
+    if planner not in PLANNERS:
+        errors.append({"field": "planner", "message": f"must be one of {list(PLANNERS)}"})
+    language = body.get("language", "English")
+    if not isinstance(language, str) or not language.strip():
+        errors.append({"field": "language", "message": "must be a non-empty string"})
+    if errors:
+        raise ValidationError(errors)
+    return {"calorie_target": int(calorie_target), "preferences": preferences, "language": language, "planner": planner}
+
+
+async def _json_body(request: Request):
+    try:
+        return await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise ValidationError([{"field": "", "message": "body is not valid JSON"}])
+
+
+# --- Execution ---
+
+async def _run_upstream(fn, *args):
+    """Runs a blocking upstream-bound call in the thread pool within the concurrency limit."""
+    acquired = False
+    try:
+        try:
+            # Unlike wait_for, a timeout racing a successful acquire() gives the slot back before raising
+            async with asyncio.timeout(API_QUEUE_TIMEOUT_SECONDS):
+                acquired = await _upstream_slots.acquire()
+        except TimeoutError:
+            raise HTTPException(503, "Server busy, retry later.", headers={"Retry-After": "5"})
+        return await run_in_threadpool(fn, *args)
+    finally:
+        if acquired:
+            _upstream_slots.release()
+
+
+async def _plan_meals(params: dict):
+    """Returns (plan, source): the instant solver if requested, else (auto) the template library, then the LLM, as in the app."""
+    calorie_target, preferences = params["calorie_target"], params["preferences"]
+    if params["planner"] == "instant":
+        plan = await run_in_threadpool(meal_solver.generate_meal_plan_locally, calorie_target, preferences)
+        return plan, "instant"
+    if params["planner"] == "auto":
+        plan = await run_in_threadpool(meal_templates.find_template_plan, calorie_target, preferences)
+        if plan:
+            return plan, "template"
+    plan = await _run_upstream(
+        groq_api.generate_meal_plan_with_rest, GROQ_API_KEY, calorie_target, preferences, params["language"]
+    )
+    return plan, "ai"
+
+
+# --- Endpoints ---
+
+async def health(request: Request):
+    return JSONResponse({"status": "ok", "groq_configured": bool(GROQ_API_KEY), "gemini_configured": bool(GEMINI_API_KEY)})
+
+
+async def create_meal_plan(request: Request):
+    params = _validate_meal_plan_request(await _json_body(request))
+    plan, source = await _plan_meals(params)
+    if not plan:
+        raise HTTPException(502, "Could not generate a meal plan. Please try again.")
+    return JSONResponse({"calorie_target": params["calorie_target"], "source": source, "plan": plan})
+
+
+async def stream_meal_plan(request: Request):
+    params = _validate_meal_plan_request(await _json_body(request))
+
+    async def events():
+        started = time.monotonic()
+        yield _ndjson({"event": "accepted", "calorie_target": params["calorie_target"]})
+        task = asyncio.ensure_future(_plan_meals(params))
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=PROGRESS_INTERVAL_SECONDS)
+            if done:
+                break
+            yield _ndjson({"event": "progress", "elapsed_seconds": round(time.monotonic() - started, 1)})
+        try:
+            plan, source = task.result()
+        except HTTPException as e:
+            yield _ndjson({"event": "error", "status": e.status_code, "message": e.detail})
+            return
+        except MealPlannerError as e:
+            yield _ndjson({"event": "error", "status": _error_status(e), "message": e.describe()})
+            return
+        except Exception as e:
+            log.error(f"Streaming meal plan failed: {e}", exc_info=True)
+            yield _ndjson({"event": "error", "status": 500, "message": "Internal error."})
+            return
+        if not plan:
+            yield _ndjson({"event": "error", "status": 502, "message": "Could not generate a meal plan."})
+            return
+        for day in normalize_meal_plan(plan).days:
+            yield _ndjson({"event": "day", "day_key": day.day_key, "meals": plan.get(day.day_key), "totals": day.totals()})
+        yield _ndjson({"event": "done", "source": source, "elapsed_seconds": round(time.monotonic() - started, 1)})
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
+async def create_grocery_list(request: Request):
+    body = await _json_body(request)
+    errors = []
+    if not isinstance(body, dict) or not isinstance(body.get("meal_plan"), dict) or not body["meal_plan"]:
+        errors.append({"field": "meal_plan", "message": "must be a non-empty meal plan object"})
+    language = body.get("language", "English") if isinstance(body, dict) else "English"
+    if not isinstance(language, str) or not language.strip():
+        errors.append({"field": "language", "message": "must be a non-empty string"})
+    if errors:
+        raise ValidationError(errors)
+
+    grocery = await _run_upstream(groq_api.generate_grocery_data_with_rest, GROQ_API_KEY, body["meal_plan"], language)
+    if not grocery:
+        raise HTTPException(502, "Could not generate a grocery list. Please try again.")
+    return JSONResponse(grocery)
+
+
+async def analyze_image(request: Request):
+    if not GEMINI_API_KEY:
+        raise HTTPException(501, "Image analysis is not configured (GOOGLE_API_KEY missing).")
+    content_type = request.headers.get("content-type", "")
+    if not content_type.startswith("image/"):
+        raise ValidationError([{"field": "body", "message": "Content-Type must be image/*"}])
+    image_bytes = await request.body()
+    if not image_bytes or len(image_bytes) > API_MAX_IMAGE_BYTES:
+        raise ValidationError([{"field": "body", "message": f"image must be 1 to {API_MAX_IMAGE_BYTES} bytes"}])
+    language = request.query_params.get("language", "English")
+
+    import gemini_api  # deferred: only this endpoint needs the Gemini client
+
+    analysis = await _run_upstream(gemini_api.analyze_image_with_rest, GEMINI_API_KEY, image_bytes, language)
+    if not analysis:
+        raise HTTPException(502, "Could not analyze the image. Please try again.")
+    return JSONResponse(analysis)
+
+
+def _ndjson(event: dict) -> bytes:
+    return (json.dumps(event, separators=(",", ":"), ensure_ascii=False) + "\n").encode("utf-8")
+
+
+async def _validation_error(request: Request, exc: ValidationError):
+    return JSONResponse({"error": "invalid_request", "details": exc.details}, status_code=422)
+
+
+def _error_status(exc: MealPlannerError) -> int:
+    return next(status for cls, status in ERROR_STATUS if isinstance(exc, cls))
+
+
+async def _planner_error(request: Request, exc: MealPlannerError):
+    status = _error_status(exc)
+    log.warning(f"{request.url.path} failed with {status}: {exc.describe()}")
+    body = {"error": exc.message, "type": type(exc).__name__}
+    if exc.hint:
+        body["hint"] = exc.hint
+    headers = {"Retry-After": "30"} if status == 429 else None
+    return JSONResponse(body, status_code=status, headers=headers)
+
+
+async def _http_error(request: Request, exc: HTTPException):
+    return JSONResponse({"error": exc.detail}, status_code=exc.status_code, headers=exc.headers)
+
+
+app = Starlette(
+    routes=[
+        Route("/health", health, methods=["GET"]),
+        Route("/v1/meal-plans", create_meal_plan, methods=["POST"]),
+        Route("/v1/meal-plans/stream", stream_meal_plan, methods=["POST"]),
+        Route("/v1/grocery-lists", create_grocery_list, methods=["POST"]),
+        Route("/v1/image-analysis", analyze_image, methods=["POST"]),
+    ],
+    middleware=[Middleware(UsageUserMiddleware)],
+    exception_handlers={ValidationError: _validation_error, HTTPException: _http_error, MealPlannerError: _planner_error},
+)
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Run the meal planner HTTP API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,23 @@
 # app.py - Modern Meal Planner with Day Tabs - v2.0
 
 import os
-import re
+import time
+import uuid
 import logging
 import hashlib
-import pandas as pd
 import streamlit as st
 
 # Custom modules
 import meal_utils as utils
 import groq_api
-
-import plotly.graph_objects as go
+import job_queue
+import meal_templates
+import meal_solver
+import plan_codec
+import plan_history
+import plan_views
+import usage_ledger
+from streamlit_adapter import show_error
 
 # --- Page Config ---
 st.set_page_config(
@@ -97,7 +103,7 @@ with st.form("user_profile_form"):
 
     col1, col2 = st.columns(2)
     with col1:
-        age = st.number_input("Age", min_value=10, max_value=100, value=30, step=1)
+        age = st.number_input("Age", min_value=18, max_value=100, value=30, step=1)
         weight = st.number_input("Weight (kg)", min_value=30.0, value=70.0, step=0.5)
         height = st.number_input("Height (cm)", min_value=100.0, value=170.0, step=0.5)
     with col2:
@@ -109,104 +115,175 @@ with st.form("user_profile_form"):
     restrictions = st.multiselect("Dietary Restrictions / Preferences:", ["Vegetarian", "Vegan", "Gluten-Free", "Dairy-Free", "Nut-Free","Low Carb"])
     favorites = st.text_input("Favorite Foods (comma-separated, optional):", placeholder="e.g., Salmon, Avocado, Berries")
     dislikes = st.text_input("Disliked Foods (comma-separated, optional):", placeholder="e.g., Mushrooms, Olives")
+    planner_mode = st.radio(
+        "Planner:", ["AI chef", "Instant (exact calories, no AI)"], index=0, horizontal=True,
+        help="Instant plans are assembled from the nutrition database in under a second and hit your calorie target exactly."
+    )
+    reuse_previous = st.checkbox("Reuse my last plan for this profile if I have one", value=True)
 
     submitted = st.form_submit_button("Generate 7-Day Plan")
 
+# Anonymous user id kept in the URL, so a bookmarked page finds its plan history again
+if "uid" not in st.query_params:
+    st.query_params["uid"] = uuid.uuid4().hex
+user_id = st.query_params["uid"]
+
+
+# --- Background Jobs ---
+def _generate_and_record_plan(calorie_target, preferences, user_id):
+    """Meal plan job: generates with the LLM and records the result in the user's plan history."""
+    with usage_ledger.acting_user(user_id):
+        plan = groq_api.generate_meal_plan_with_rest(GROQ_API_KEY, calorie_target, preferences)
+    if plan:
+        plan_history.save_plan(user_id, plan, calorie_target, preferences, source="ai")
+    return plan
+
+
+def _generate_grocery_list(meal_plan_dict, user_id=None):
+    """Grocery list job; LLM usage is attributed to the requesting user."""
+    with usage_ledger.acting_user(user_id):
+        return groq_api.generate_grocery_data_with_rest(GROQ_API_KEY, meal_plan_dict)
+
+
+job_queue.register_job_handler("meal_plan", _generate_and_record_plan)
+job_queue.register_job_handler("grocery_list", _generate_grocery_list)
+
+# Resume a job after a browser refresh (the job id survives in the URL)
+if "job" in st.query_params and "meal_plan_job" not in st.session_state:
+    st.session_state["meal_plan_job"] = st.query_params["job"]
+
+
+@st.fragment(run_every=2)
+def _poll_job(job_state_key: str, result_state_key: str, label: str, encode=None):
+    """
+    Polls a background job and moves its result into session state once it finishes.
+    encode, if given, converts the result before it is stored (e.g. plan_codec.encode_plan).
+    """
+    job = job_queue.get_job(st.session_state.get(job_state_key))
+    if job is None:
+        st.session_state.pop(job_state_key, None)
+        return
+
+    if job["status"] in (job_queue.JOB_PENDING, job_queue.JOB_RUNNING):
+        elapsed = int(time.time() - job["created_at"])
+        st.info(f"⏳ {label}... ({elapsed}s elapsed). You can keep using the page.")
+        return
+
+    st.session_state.pop(job_state_key, None)
+    if job_state_key == "meal_plan_job":
+        st.query_params.pop("job", None)
+    if job["status"] == job_queue.JOB_DONE:
+        st.session_state[result_state_key] = encode(job["result"]) if encode else job["result"]
+    else:
+        log.error(f"Job {job['job_id']} failed: {job['error']}")
+        st.session_state[f"{job_state_key}_error"] = job["error"]
+    st.rerun()
+
+
 # --- Generate Meal Plan ---
 if submitted:
     calculated_calories = utils.calculate_calories(age, weight, height, gender, activity, goal)
     if calculated_calories:
         st.info(f"Targeting approximately **{calculated_calories} kcal/day**. Generating plan...")
         user_prefs = {"goal": goal, "restrictions": restrictions, "favorites": favorites, "dislikes": dislikes}
+        st.session_state.pop("grocery_list", None)
 
-        with st.spinner("Creating your meal plan..."):
-            meal_plan_dict_result = groq_api.generate_meal_plan_with_rest(GROQ_API_KEY, calculated_calories, user_prefs)
-
-        if meal_plan_dict_result and isinstance(meal_plan_dict_result, dict):
-            st.session_state['meal_plan_data'] = meal_plan_dict_result
-            st.success("✅ Meal plan generated successfully!")
+        previous = plan_history.find_latest(user_id, calculated_calories, user_prefs) if reuse_previous else None
+        if previous:
+            local_plan, plan_source = previous["plan"], None
+        elif planner_mode.startswith("Instant"):
+            local_plan, plan_source = meal_solver.generate_meal_plan_locally(calculated_calories, user_prefs), "instant"
+        else:
+            # Common profiles are served from the precomputed template library; the LLM is the fallback
+            local_plan, plan_source = meal_templates.find_template_plan(calculated_calories, user_prefs), "template"
+
+        if local_plan:
+            if plan_source:
+                plan_history.save_plan(user_id, local_plan, calculated_calories, user_prefs, source=plan_source)
+            st.session_state["meal_plan_blob"] = plan_codec.encode_plan(local_plan)
+            if previous:
+                st.success("✅ Loaded your previous plan for this profile.")
+            else:
+                st.success("✅ Meal plan generated successfully!")
+        elif planner_mode.startswith("Instant"):
+            st.error("Could not build an instant plan for these preferences. Try the AI chef instead.")
         else:
-            st.error("Could not generate meal plan. Please try again.")
+            job_id = job_queue.submit_job(
+                "meal_plan", {"calorie_target": calculated_calories, "preferences": user_prefs, "user_id": user_id}
+            )
+            st.session_state["meal_plan_job"] = job_id
+            st.query_params["job"] = job_id
+
+if "meal_plan_job" in st.session_state:
+    _poll_job("meal_plan_job", "meal_plan_blob", "Creating your meal plan", encode=plan_codec.encode_plan)
+if "meal_plan_job_error" in st.session_state:
+    show_error(st.session_state.pop("meal_plan_job_error"), fallback="Could not generate meal plan. Please try again.")
+
+# --- Plan History ---
+recent_plans, _ = plan_history.list_plans(user_id, limit=10)
+if recent_plans:
+    with st.expander("🗂️ Your previous plans"):
+        labels = {
+            p["plan_id"]: f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(p['created_at']))} · "
+                          f"{p['calorie_target']} kcal · {', '.join(p['restrictions']) or 'no restrictions'} · {p['source']}"
+            for p in recent_plans
+        }
+        chosen_plan_id = st.selectbox("Plan:", list(labels), format_func=labels.get)
+        if st.button("Load this plan"):
+            record = plan_history.get_plan(chosen_plan_id, user_id)
+            if record:
+                st.session_state["meal_plan_blob"] = plan_codec.encode_plan(record["plan"])
+                st.session_state.pop("grocery_list", None)
 
 # --- Display Meal Plan with Tabs ---
-if 'meal_plan_data' in st.session_state and st.session_state['meal_plan_data']:
-    meal_plan_data = st.session_state['meal_plan_data']
+# The plan is kept in session state as a compact plan_codec blob; its rendered view is cached per blob
+if st.session_state.get("meal_plan_blob"):
+    plan_view = plan_views.build_plan_view(st.session_state["meal_plan_blob"])
     st.header("📅 7-Day Meal Plan")
-
-    weekly_summary = {"Day": [], "Calories": [], "Protein": [], "Carbs": [], "Fat": []}
+    if plan_view["issues"]:
+        log.warning(f"Meal plan issues: {plan_view['issues'][:10]}")
 
     day_names = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
-    sorted_items = sorted(
-        meal_plan_data.items(),
-        key=lambda item: int(re.search(r'\d+', item[0]).group()) if re.search(r'\d+', item[0]) else 0
-    )
-
     tabs = st.tabs(day_names)
 
-    for tab, (day_key, day_content) in zip(tabs, sorted_items):
+    for tab, day in zip(tabs, plan_view["days"]):
+        totals = day["totals"]
         with tab:
-            st.subheader(day_key)
-            meal_rows, daily_calories, daily_protein, daily_carbs, daily_fat = utils.process_day_content(day_content)
-            
-            if meal_rows:
-                df = pd.DataFrame(meal_rows)
-                st.dataframe(df, hide_index=True, width="stretch")
+            st.subheader(day["day_key"])
+            if day["rows"]:
+                st.dataframe(day["rows"], hide_index=True, width="stretch")
 
             # Macro pie chart
-            fig_macros = go.Figure(
-                data=[go.Pie(
-                    labels=["Protein", "Carbs", "Fat"],
-                    values=[daily_protein*4, daily_carbs*4, daily_fat*9],
-                    hole=0.4,
-                    marker=dict(colors=['#FF6361', '#58508D', '#FFA600'])
-                )]
-            )
-            fig_macros.update_layout(
-                title_text="Macros Breakdown", 
-                title_x=0.5
-            )
-            st.plotly_chart(fig_macros, use_container_width=True, config={"displayModeBar": False})
+            st.plotly_chart(day["pie"], use_container_width=True, config={"displayModeBar": False})
 
             # Daily totals
             c1, c2, c3, c4 = st.columns(4)
-            c1.metric("Calories", f"{utils.format_number(daily_calories)} kcal")
-            c2.metric("Protein", f"{utils.format_number(daily_protein)} g")
-            c3.metric("Carbs", f"{utils.format_number(daily_carbs)} g")
-            c4.metric("Fat", f"{utils.format_number(daily_fat)} g")
-
-            # Add to weekly summary
-            weekly_summary["Day"].append(day_key)
-            weekly_summary["Calories"].append(daily_calories)
-            weekly_summary["Protein"].append(daily_protein)
-            weekly_summary["Carbs"].append(daily_carbs)
-            weekly_summary["Fat"].append(daily_fat)
+            c1.metric("Calories", f"{utils.format_number(totals['calories'])} kcal")
+            c2.metric("Protein", f"{utils.format_number(totals['protein'])} g")
+            c3.metric("Carbs", f"{utils.format_number(totals['carbs'])} g")
+            c4.metric("Fat", f"{utils.format_number(totals['fat'])} g")
 
     # Weekly trends chart
     st.markdown("---")
     st.subheader("📈 Weekly Nutrient Trends")
-    weekly_df = pd.DataFrame(weekly_summary)
-    fig_weekly = go.Figure()
-    fig_weekly.add_trace(go.Bar(name="Calories", x=weekly_df["Day"], y=weekly_df["Calories"], marker_color="#4CAF50"))
-    fig_weekly.add_trace(go.Bar(name="Protein", x=weekly_df["Day"], y=weekly_df["Protein"], marker_color="#FF6361"))
-    fig_weekly.add_trace(go.Bar(name="Carbs", x=weekly_df["Day"], y=weekly_df["Carbs"], marker_color="#58508D"))
-    fig_weekly.add_trace(go.Bar(name="Fat", x=weekly_df["Day"], y=weekly_df["Fat"], marker_color="#FFA600"))
-    fig_weekly.update_layout(
-        barmode='group', 
-        xaxis_title="Day", 
-        yaxis_title="Amount", 
-        title="Weekly Nutrition Overview"
-    )
-    st.plotly_chart(fig_weekly, use_container_width=True, config={"displayModeBar": False})
+    st.plotly_chart(plan_view["weekly"], use_container_width=True, config={"displayModeBar": False})
 
 # --- Grocery List ---
 st.markdown("---")
 if st.button("Generate Weekly Grocery List"):
-    current_meal_plan_data = st.session_state.get('meal_plan_data')
-    if current_meal_plan_data:
-        with st.spinner("Creating grocery list..."):
-            grocery_list_md = groq_api.generate_grocery_list_with_rest(GROQ_API_KEY, current_meal_plan_data)
-
-        if grocery_list_md:
-            st.subheader("🛒 Weekly Grocery List")
-            st.markdown(grocery_list_md)
-            st.caption("Note: This is an automatically generated estimate.")
+    if st.session_state.get("meal_plan_blob"):
+        current_meal_plan_data = plan_codec.decode_plan(st.session_state["meal_plan_blob"])
+        st.session_state.pop("grocery_list", None)
+        st.session_state["grocery_list_job"] = job_queue.submit_job(
+            "grocery_list", {"meal_plan_dict": current_meal_plan_data, "user_id": user_id}
+        )
+
+if "grocery_list_job" in st.session_state:
+    _poll_job("grocery_list_job", "grocery_list", "Creating grocery list")
+if "grocery_list_job_error" in st.session_state:
+    show_error(st.session_state.pop("grocery_list_job_error"), fallback="Could not generate grocery list. Please try again.")
+
+if st.session_state.get("grocery_list"):
+    st.subheader("🛒 Weekly Grocery List")
+    st.markdown(st.session_state["grocery_list"]["markdown"])
+    st.caption("Note: Quantities are estimated from typical recipes for the portions in your plan.")
@@ -0,0 +1,90 @@
+"""
+Circuit breaker for calls to an external service.
+
+After failure_threshold consecutive failures the breaker opens and calls fail immediately with
+CircuitOpenError instead of waiting on a service that is down. Once reset_seconds have passed it
+lets a single probe call through (half-open): success closes it again, failure reopens it for
+another reset_seconds. State is per process.
+"""
+
+import time
+import logging
+import threading
+
+from errors import CircuitOpenError
+
+log = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Thread-safe; failures are exceptions of the failure_exceptions types, anything else passes through."""
+
+    def __init__(self, name: str, failure_threshold: int = 3, reset_seconds: float = 60,
+                 failure_exceptions: tuple = (Exception,)):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failure_exceptions = failure_exceptions
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_seconds:
+                return HALF_OPEN
+            return self._state
+
+    def _admit(self) -> None:
+        with self._lock:
+            if self._state == CLOSED:
+                return
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_seconds:
+                self._state = HALF_OPEN
+            if self._state == HALF_OPEN and not self._probing:
+                self._probing = True
+                log.info(f"{self.name} circuit half-open, probing")
+                return
+            retry_in = max(0.0, self.reset_seconds - (time.monotonic() - self._opened_at))
+            raise CircuitOpenError(
+                f"{self.name} is temporarily unavailable.",
+                hint=f"Retrying in about {max(1, round(retry_in))} seconds.",
+            )
+
+    def _record(self, failed: bool) -> None:
+        with self._lock:
+            probe = self._probing
+            self._probing = False
+            if not failed:
+                if self._state != CLOSED:
+                    log.info(f"{self.name} circuit closed")
+                self._state = CLOSED
+                self._failures = 0
+                return
+            self._failures += 1
+            if probe or self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    log.warning(f"{self.name} circuit open after {self._failures} consecutive failures")
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+
+    def call(self, fn, *args, **kwargs):
+        """Runs fn through the breaker; raises CircuitOpenError without calling fn while open."""
+        self._admit()
+        try:
+            result = fn(*args, **kwargs)
+        except self.failure_exceptions:
+            self._record(failed=True)
+            raise
+        except BaseException:
+            self._record(failed=False)
+            raise
+        self._record(failed=False)
+        return result
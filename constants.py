@@ -1,5 +1,6 @@
-import streamlit as st
 import os
+import sys
+from functools import lru_cache
 from dotenv import load_dotenv
 
 # Load environment variables for local development
@@ -14,61 +15,61 @@ def _clean_secret(value):
   return value or None
 
 
-GROQ_API_KEY_SOURCE = "missing"
-USDA_API_KEY_SOURCE = "missing"
+@lru_cache(maxsize=1)
+def _secrets_file():
+  """Contents of the first Streamlit secrets.toml found (project, then home directory), or {}."""
+  import tomllib
+
+  for path in (os.path.join(os.getcwd(), ".streamlit", "secrets.toml"),
+               os.path.join(os.path.expanduser("~"), ".streamlit", "secrets.toml")):
+    if os.path.isfile(path):
+      with open(path, "rb") as f:
+        return tomllib.load(f)
+  return {}
+
+
+def _streamlit_secret(name):
+  """
+  Reads a Streamlit secret. Inside the Streamlit app this is st.secrets; headless processes
+  (API server, job workers, batch scripts) never import Streamlit here and read secrets.toml directly.
+  """
+  st = sys.modules.get("streamlit")
+  try:
+    if st is not None:
+      return _clean_secret(st.secrets.get(name))
+    return _clean_secret(_secrets_file().get(name))
+  except Exception:
+    # No or unreadable secrets.toml
+    return None
+
+
+def _resolve_key(name):
+  """Returns (value, source) for an API key; Streamlit secrets win over env vars, lower-case names over upper-case."""
+  for label, read in (("streamlit", _streamlit_secret), ("env", lambda n: _clean_secret(os.getenv(n)))):
+    for candidate in (name.lower(), name.upper()):
+      value = read(candidate)
+      if value:
+        return value, f"{label}:{candidate}"
+  return None, "missing"
+
 
 # API Keys - prioritize Streamlit secrets for deployment, fall back to env vars for local
-GROQ_API_KEY = None
-USDA_API_KEY = None
-
-try:
-  groq_secret_lc = _clean_secret(st.secrets.get("groq_api_key"))
-  groq_secret_uc = _clean_secret(st.secrets.get("GROQ_API_KEY"))
-  groq_env_lc = _clean_secret(os.getenv("groq_api_key"))
-  groq_env_uc = _clean_secret(os.getenv("GROQ_API_KEY"))
-
-  usda_secret_lc = _clean_secret(st.secrets.get("usda_api_key"))
-  usda_secret_uc = _clean_secret(st.secrets.get("USDA_API_KEY"))
-  usda_env_lc = _clean_secret(os.getenv("usda_api_key"))
-  usda_env_uc = _clean_secret(os.getenv("USDA_API_KEY"))
-
-  if groq_secret_lc:
-    GROQ_API_KEY = groq_secret_lc
-    GROQ_API_KEY_SOURCE = "streamlit:groq_api_key"
-  elif groq_secret_uc:
-    GROQ_API_KEY = groq_secret_uc
-    GROQ_API_KEY_SOURCE = "streamlit:GROQ_API_KEY"
-  elif groq_env_lc:
-    GROQ_API_KEY = groq_env_lc
-    GROQ_API_KEY_SOURCE = "env:groq_api_key"
-  else:
-    GROQ_API_KEY = groq_env_uc
-    if GROQ_API_KEY:
-      GROQ_API_KEY_SOURCE = "env:GROQ_API_KEY"
-
-  if usda_secret_lc:
-    USDA_API_KEY = usda_secret_lc
-    USDA_API_KEY_SOURCE = "streamlit:usda_api_key"
-  elif usda_secret_uc:
-    USDA_API_KEY = usda_secret_uc
-    USDA_API_KEY_SOURCE = "streamlit:USDA_API_KEY"
-  elif usda_env_lc:
-    USDA_API_KEY = usda_env_lc
-    USDA_API_KEY_SOURCE = "env:usda_api_key"
-  else:
-    USDA_API_KEY = usda_env_uc
-    if USDA_API_KEY:
-      USDA_API_KEY_SOURCE = "env:USDA_API_KEY"
-except:
-    # Fallback for local development when streamlit secrets are not available
-  GROQ_API_KEY = _clean_secret(os.getenv("groq_api_key")) or _clean_secret(os.getenv("GROQ_API_KEY"))
-  USDA_API_KEY = _clean_secret(os.getenv("usda_api_key")) or _clean_secret(os.getenv("USDA_API_KEY"))
-  if GROQ_API_KEY:
-    GROQ_API_KEY_SOURCE = "env:fallback"
-  if USDA_API_KEY:
-    USDA_API_KEY_SOURCE = "env:fallback"
+GROQ_API_KEY, GROQ_API_KEY_SOURCE = _resolve_key("groq_api_key")
+USDA_API_KEY, USDA_API_KEY_SOURCE = _resolve_key("usda_api_key")
 
 USDA_BASE_URL = "https://api.nal.usda.gov/fdc/v1/foods/search"
+USDA_FOODS_URL = "https://api.nal.usda.gov/fdc/v1/foods"  # multi-id lookup
+USDA_FOODS_BATCH_SIZE = 20  # most ids /foods accepts per request
+# Nutrients taken from USDA records: name -> (FDC nutrient ids in order of preference, unit to convert to)
+USDA_NUTRIENTS = {
+  "calories": ((1008, 2047, 2048, 1062), "kcal"),  # Energy; Atwater general / specific factors; kJ
+  "protein": ((1003,), "g"),
+  "carbs": ((1005,), "g"),
+  "fat": ((1004,), "g"),
+}
+# USDA circuit breaker: consecutive failed lookups before failing fast, and seconds until the next probe
+USDA_BREAKER_FAILURE_THRESHOLD = 3
+USDA_BREAKER_RESET_SECONDS = 60
 
 EXAMPLE_MEAL_STRUCTURE = '''{
   "meal_plan": {
@@ -86,4 +87,121 @@ EXAMPLE_MEAL_STRUCTURE = '''{
       }
     }
   }
-}'''
\ No newline at end of file
+}'''
+
+# Compact row format the Groq planner asks for (meal_plan_schema.COMPACT_COLUMNS); expanded locally
+COMPACT_MEAL_STRUCTURE = '''{
+  "days": {
+    "day1": [
+      ["breakfast", "Example Dish", 150, 300, 20, 35, 10],
+      ["lunch", "Example Dish", 300, 550, 35, 60, 18],
+      ["snack", "Example Dish", 100, 200, 8, 20, 9],
+      ["dinner", "Example Dish", 350, 650, 40, 65, 22]
+    ]
+  }
+}'''
+
+# Follow-up requests that resend only the invalid part of a structured LLM reply, per reply
+STRUCTURED_OUTPUT_REPAIR_ATTEMPTS = 1
+
+# Output token budgets (token_budget.py): priors per requested unit, adjusted from observed usage
+MEAL_PLAN_TOKENS_PER_DAY = 180
+DECOMPOSITION_TOKENS_PER_DISH = 180
+LLM_MAX_OUTPUT_TOKENS = 8000
+LLM_REQUEST_TIMEOUT_SECONDS = 180  # per upstream chat request
+# Follow-up requests that resume a reply cut off at max_tokens, per reply
+CONTINUATION_MAX_REQUESTS = 2
+
+# LLM usage ledger (usage_ledger.py) and the budgets it enforces; a budget of 0 disables it
+LLM_USAGE_RETENTION_DAYS = 90
+LLM_MAX_CALLS_PER_OPERATION = 12  # upstream calls one meal plan / grocery list may make, fallbacks and repairs included
+LLM_USER_HOURLY_TOKEN_BUDGET = int(os.getenv("MEAL_PLANNER_USER_HOURLY_TOKENS", "200000"))
+LLM_HOURLY_TOKEN_BUDGET = int(os.getenv("MEAL_PLANNER_HOURLY_TOKENS", "2000000"))  # all users together; caps clients that rotate user ids
+# Estimated USD per million (prompt, completion) tokens; models not listed are recorded at 0
+LLM_PRICES_PER_MILLION = {
+  "llama-3.3-70b-versatile": (0.59, 0.79),
+  "llama-3.1-8b-instant": (0.05, 0.08),
+  "openai/gpt-oss-120b": (0.15, 0.75),
+  "openai/gpt-oss-20b": (0.10, 0.50),
+  "gemini-2.0-flash": (0.10, 0.40),
+}
+
+# Client-side rate limiting of LLM calls (rate_limiter.py), shared by all processes through DB_PATH
+RATE_LIMIT_BATCH_RESERVE = 0.25  # fraction of each rate limit bucket only interactive calls may use
+RATE_LIMIT_MAX_WAIT_SECONDS = {"interactive": 20, "batch": 900}  # longest wait for capacity before giving up
+RATE_LIMIT_DEFAULT_RETRY_SECONDS = 30  # assumed backoff after a 429 without Retry-After
+
+# Local SQLite database shared by the job queue and the other on-disk stores.
+# Point every worker at the same file to share state between processes.
+DB_PATH = os.getenv("MEAL_PLANNER_DB", "meal_planner.db")
+
+# Background job worker pool
+JOB_WORKERS = int(os.getenv("MEAL_PLANNER_JOB_WORKERS", "4"))
+# Each process refreshes its unfinished jobs' updated_at this often; a job not refreshed for
+# JOB_STALE_SECONDS (its worker process died) is reported as failed
+JOB_HEARTBEAT_SECONDS = 10
+JOB_STALE_SECONDS = 6 * JOB_HEARTBEAT_SECONDS
+
+# Single-flight coalescing of identical in-flight generation requests.
+# Cross-process coalescing uses a lease row in DB_PATH and is off by default.
+COALESCE_ACROSS_PROCESSES = os.getenv("MEAL_PLANNER_COALESCE_ACROSS_PROCESSES", "0").lower() in ("1", "true", "yes")
+COALESCE_LEASE_SECONDS = 60  # renewed while the leader runs; a dead leader's lease lapses after this
+
+# Keywords that break a dietary restriction when they appear in a dish name (matched on word boundaries).
+# A restriction's RESTRICTION_ALLOWED_PHRASES are removed first, so "almond milk" is not a dairy violation.
+_MEAT_AND_FISH = [
+  "chicken", "beef", "pork", "lamb", "mutton", "turkey", "duck", "bacon", "ham", "sausage", "steak",
+  "salmon", "tuna", "cod", "tilapia", "shrimp", "prawn", "fish", "crab", "lobster", "anchovy", "sardine",
+  "meatball", "pepperoni", "salami", "prosciutto", "gelatin",
+]
+_DAIRY = ["milk", "cheese", "yogurt", "yoghurt", "butter", "cream", "paneer", "whey", "ghee", "feta", "parmesan", "mozzarella", "ricotta", "kefir", "curd"]
+RESTRICTION_KEYWORDS = {
+  "Vegetarian": _MEAT_AND_FISH,
+  "Vegan": _MEAT_AND_FISH + _DAIRY + ["egg", "eggs", "omelette", "omelet", "honey", "mayonnaise"],
+  "Gluten-Free": ["wheat", "bread", "toast", "pasta", "spaghetti", "noodle", "noodles", "couscous", "barley", "rye", "bagel", "cracker", "crackers", "seitan", "pita", "naan", "croissant", "muffin", "pancake", "pancakes", "waffle", "tortilla", "wrap", "sandwich", "burger", "pizza"],
+  "Dairy-Free": _DAIRY,
+  "Nut-Free": ["nut", "nuts", "almond", "almonds", "walnut", "walnuts", "cashew", "cashews", "peanut", "peanuts", "pecan", "pecans", "pistachio", "pistachios", "hazelnut", "hazelnuts", "macadamia", "praline", "pesto"],
+  "Low Carb": ["rice", "pasta", "spaghetti", "bread", "toast", "potato", "potatoes", "noodle", "noodles", "oats", "oatmeal", "granola", "quinoa", "bagel", "tortilla", "tortillas", "buckwheat", "pancake", "pancakes", "waffle", "couscous", "banana", "juice"],
+}
+_DAIRY_ALTERNATIVES = [
+  "almond milk", "soy milk", "oat milk", "rice milk", "coconut milk", "cashew milk", "coconut yogurt", "soy yogurt",
+  "vegan cheese", "vegan butter", "cocoa butter", "peanut butter", "almond butter", "cashew butter", "coconut cream",
+]
+RESTRICTION_ALLOWED_PHRASES = {
+  "Vegan": _DAIRY_ALTERNATIVES,
+  "Dairy-Free": _DAIRY_ALTERNATIVES + ["dairy-free"],
+  "Gluten-Free": ["gluten-free bread", "gluten-free pasta", "gluten-free oats", "gluten-free wrap", "corn tortilla", "corn tortillas", "rice noodle", "rice noodles", "lettuce wrap"],
+  "Nut-Free": ["nut-free", "butternut", "nutmeg", "coconut"],
+  "Low Carb": ["cauliflower rice", "lettuce wrap", "zucchini noodles"],
+}
+
+# Calorie fraction from protein / carbs / fat per goal (Low Carb restriction overrides the goal)
+MACRO_SPLITS = {
+  "Lose Weight": (0.30, 0.40, 0.30),
+  "Maintain Weight": (0.25, 0.50, 0.25),
+  "Gain Muscle": (0.30, 0.45, 0.25),
+}
+LOW_CARB_MACRO_SPLIT = (0.35, 0.20, 0.45)
+
+# Precomputed meal plan template library (built offline by meal_templates.py)
+TEMPLATE_LIBRARY_PATH = os.getenv("MEAL_PLANNER_TEMPLATES", "data/meal_templates.json.gz")
+TEMPLATE_MAX_CALORIE_GAP = 0.2  # fraction of the target a template may be rescaled by
+
+# Post-generation calorie calibration: per-meal portion multipliers stay within these bounds
+CALIBRATION_BOUNDS = (0.6, 1.6)
+
+# Cache shared by all app processes (see shared_cache.py). Empty: SQLite table in DB_PATH;
+# "redis://host:6379/0": a Redis server (needs the redis package); "memory://": per-process stand-in.
+SHARED_CACHE_URL = os.getenv("MEAL_PLANNER_SHARED_CACHE_URL", "")
+SHARED_CACHE_MAX_ENTRIES = 20000       # per namespace, oldest evicted first
+SHARED_CACHE_MAX_VALUE_BYTES = 1_000_000
+USDA_CACHE_TTL_SECONDS = 30 * 24 * 3600
+USDA_NEGATIVE_CACHE_TTL_SECONDS = 3 * 24 * 3600  # dishes USDA has no good match for
+USDA_FOOD_CACHE_TTL_SECONDS = 180 * 24 * 3600  # nutrients per FDC id; USDA records rarely change
+PLAN_VIEW_CACHE_TTL_SECONDS = 7 * 24 * 3600
+
+# Headless HTTP API (api_server.py)
+API_MAX_CONCURRENCY = int(os.getenv("MEAL_PLANNER_API_MAX_CONCURRENCY", "8"))  # upstream-bound requests in flight
+API_QUEUE_TIMEOUT_SECONDS = 30  # wait for a free slot before answering 503
+API_MAX_IMAGE_BYTES = 8 * 1024 * 1024
+GEMINI_API_KEY, GEMINI_API_KEY_SOURCE = _resolve_key("google_api_key")
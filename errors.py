@@ -0,0 +1,61 @@
+"""
+Exceptions raised by the planner's core modules.
+
+Core modules (groq_api, gemini_api, usda_client, ...) never talk to a UI. They raise these
+exceptions with a short message that is safe to show to an end user, and each front end decides
+how to present it: the Streamlit app through streamlit_adapter.show_error, the HTTP API as a
+JSON error with a matching status code, batch jobs by logging it.
+"""
+
+
+class MealPlannerError(Exception):
+    """
+    Base class for expected planner failures. str(error) is the user-facing message;
+    hint is an optional suggestion for what to do next and detail the raw upstream text, if any.
+    """
+
+    def __init__(self, message: str, hint: str = None, detail: str = None):
+        super().__init__(message)
+        self.message = message
+        self.hint = hint
+        self.detail = detail
+
+    def describe(self) -> str:
+        """Message and hint in one line, e.g. for storing with a failed job."""
+        return f"{self.message} {self.hint}" if self.hint else self.message
+
+
+class ConfigurationError(MealPlannerError):
+    """The deployment is missing something the call needs, e.g. an API key."""
+
+
+class InvalidRequestError(MealPlannerError):
+    """The caller's input cannot be planned for (missing calorie target, empty meal plan, ...)."""
+
+
+class UpstreamAPIError(MealPlannerError):
+    """An external API (Groq, Gemini, USDA) failed or could not be reached; status_code is None for network errors."""
+
+    def __init__(self, message: str, status_code: int = None, hint: str = None, detail: str = None):
+        super().__init__(message, hint=hint, detail=detail)
+        self.status_code = status_code
+
+
+class RateLimitError(UpstreamAPIError):
+    """The upstream API rejected the call with a rate limit (HTTP 429)."""
+
+
+class AuthenticationError(UpstreamAPIError):
+    """The upstream API rejected the API key (HTTP 401/403)."""
+
+
+class CircuitOpenError(UpstreamAPIError):
+    """Calls to an upstream API are suspended after repeated failures (see circuit_breaker)."""
+
+
+class ResponseFormatError(MealPlannerError):
+    """The model answered, but not with data the planner can use."""
+
+
+class BudgetExceededError(MealPlannerError):
+    """An LLM usage budget (calls per operation, tokens per hour) is used up; see usage_ledger."""
@@ -1,11 +1,18 @@
 # evaluate_outputs.py
 import json
 import os
+import argparse
 from dotenv import load_dotenv
 import requests
 import logging
 from datetime import datetime
-import streamlit as st
+
+from constants import GEMINI_API_KEY
+from meal_plan_schema import normalize_meal_plan
+import plan_scoring
+from gemini_api import post_generate_content
+from errors import MealPlannerError
+import rate_limiter
 
 # Configure logging to both console and file
 log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
@@ -23,7 +30,7 @@ file_handler.setFormatter(log_formatter)
 log.addHandler(file_handler)
 
 # Load environment variables
-GOOGLE_API_KEY = st.secrets.get("google_api_key")
+GOOGLE_API_KEY = GEMINI_API_KEY
 
 
 if not GOOGLE_API_KEY:
@@ -33,23 +40,50 @@ if not GOOGLE_API_KEY:
 # Define API endpoint
 EVALUATION_API_URL = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={GOOGLE_API_KEY}"
 
+# Judge wording of each meal plan criterion (plan_scoring.SCORE_KEYS)
+MEAL_PLAN_CRITERIA = {
+    "adherence_to_restrictions": "**Adherence to Restrictions:** Does the meal plan strictly adhere to the user's dietary restrictions (e.g., Vegetarian, Dairy-Free)?",
+    "inclusion_of_favorites": "**Inclusion of Favorites:** Does the meal plan include the user's favorite foods, possibly under another name or as an ingredient?",
+    "exclusion_of_dislikes": "**Exclusion of Dislikes:** Does the meal plan exclude the user's disliked foods?",
+    "calorie_distribution_reasonableness": "**Reasonableness of Calorie Distribution:** Is the distribution of calories across breakfast, lunch, dinner, and snacks reasonable for each day?",
+    "meal_variety": "**Variety of Meals:** Does the meal plan offer a reasonable variety of different dishes across the week?",
+    "daily_calories_alignment": "**Estimated Daily Calories:** Are the 'daily_nutrition' calorie counts reasonably close to the user's calorie target?",
+}
+
+ANALYZE_IMAGE_CRITERIA = {
+    "json_valid": "**JSON Validity:** Is the raw response a valid JSON format?",
+    "food_item_reasonableness": "**Reasonableness of Food Item:** Does the identified food item seem plausible given the potential context of an image analysis? Provide a brief justification.",
+    "calorie_reasonableness": "**Reasonableness of Calorie Estimate:** Is the estimated calorie count reasonable for the identified food item? Provide a brief justification.",
+    "macros_complete": "**Completeness of Macros:** Does the 'macros' section include protein, carbs, and fat?",
+    "macros_reasonableness": "**Reasonableness of Macros:** Are the provided macro values (protein, carbs, fat) reasonable in relation to the estimated calories for the identified food item? Provide a brief justification.",
+}
+GROCERY_LIST_CRITERIA = {
+    "comprehensiveness": "**Comprehensiveness:** Does the grocery list seem to include a reasonable range of ingredients that would likely be needed for a typical 7-day meal plan (assuming a diverse set of meals)?",
+    "organization": "**Organization:** Is the grocery list well-organized into logical categories (e.g., Produce, Pantry Staples)?",
+    "clarity": "**Clarity:** Are the items in the list generally clear and easy to understand?",
+    "absence_of_redundancy": "**Absence of Redundancy:** Does the list avoid excessive repetition of similar items?",
+}
+
+# Log entries of the same function judged in one Gemini request; a reply that fails validation is split and retried
+JUDGE_BATCH_SIZE = 8
+
 def call_gemini_api(prompt):
     """Calls the Gemini API with the given prompt."""
-    headers = {
-        'Content-Type': 'application/json',
-    }
     data = {
         'contents': [{
             'parts': [{'text': prompt}]
         }]
     }
     try:
-        response = requests.post(EVALUATION_API_URL, headers=headers, json=data)
+        response = post_generate_content(EVALUATION_API_URL, data, timeout=120, feature="evaluation")
         response.raise_for_status()  # Raise an exception for bad status codes
         return response.json()
     except requests.exceptions.RequestException as e:
         log.error(f"Error calling Gemini API: {e}")
         return None
+    except MealPlannerError as e:  # usage budget or rate limit wait exhausted
+        log.error(f"Skipping evaluation: {e}")
+        return None
 
 def parse_gemini_response(response_json):
     """Extracts and cleans the evaluation text from Gemini's response."""
@@ -60,125 +94,251 @@ def parse_gemini_response(response_json):
         return evaluation_text
     return None
 
-def evaluate_analyze_image(log_entry):
-    """Evaluates the output of the analyze_image function."""
+def _analyze_image_entry(log_entry, local_evaluation=None):
     input_context = log_entry.get("input_context", {})
-    raw_response_text = log_entry.get("raw_response_text", "")
-
-    prompt = f"""You are an expert AI evaluator. Given the following context and the raw response from an AI model, please evaluate the response.
-
-Context:
+    return f"""Context:
 Language: {input_context.get("language")}
 Image Size: {input_context.get("image_size")}
 
 Raw Response:
-{raw_response_text}
-
-Evaluate the raw response based on the following criteria:
-1. **JSON Validity:** Is the raw response a valid JSON format?
-2. **Reasonableness of Food Item:** Does the identified food item seem plausible given the potential context of an image analysis? Provide a brief justification.
-3. **Reasonableness of Calorie Estimate:** Is the estimated calorie count reasonable for the identified food item? Provide a brief justification.
-4. **Completeness of Macros:** Does the 'macros' section include protein, carbs, and fat?
-5. **Reasonableness of Macros:** Are the provided macro values (protein, carbs, fat) reasonable in relation to the estimated calories for the identified food item? Provide a brief justification.
-
-Provide your evaluation in a JSON format with the following keys: 'json_valid', 'food_item_reasonableness', 'calorie_reasonableness', 'macros_complete', 'macros_reasonableness', 'justification'. Assign a score from 1 to 5 (1=Very Poor, 5=Excellent) for each criterion (except 'json_valid' which should be a boolean)."""
-
-    evaluation_response_json = call_gemini_api(prompt)
-    evaluation_text = parse_gemini_response(evaluation_response_json)
+{log_entry.get("raw_response_text", "")}""", list(ANALYZE_IMAGE_CRITERIA)
 
-    if evaluation_text:
-        try:
-            evaluation = json.loads(evaluation_text)
-            return evaluation
-        except json.JSONDecodeError:
-            log.error(f"Failed to decode JSON from evaluation response for analyze_image: {evaluation_text}")
-            return {"error": "Failed to decode evaluation JSON"}
-    else:
-        return {"error": "No valid evaluation response received from Gemini API"}
+def _grocery_list_entry(log_entry, local_evaluation=None):
+    return f"""Grocery List:
+{log_entry.get("raw_response_text", "")}""", list(GROCERY_LIST_CRITERIA)
 
-def evaluate_generate_meal_plan(log_entry):
-    """Evaluates the output of the generate_meal_plan function for the first day."""
+def _meal_plan_entry(log_entry, local_evaluation):
     input_context = log_entry.get("input_context", {})
-    raw_response_text = log_entry.get("raw_response_text", "")
-
-    try:
-        meal_plan_data = json.loads(raw_response_text.strip('```json\n').strip('```'))
-        day1_plan = meal_plan_data.get("meal_plan", {}).get("day1", {})
-        preferences = input_context.get("preferences", {})
-        calorie_target = input_context.get("calorie_target")
-
-        prompt = f"""You are an expert AI evaluator. Given the following user preferences, calorie target, and the generated meal plan for day 1, please evaluate the meal plan.
-
-User Preferences:
+    preferences = input_context.get("preferences", {})
+    plan = normalize_meal_plan(_parse_logged_plan(log_entry))
+    week = {
+        day.day_key: {
+            "meals": {meal.meal_key: f"{meal.dish_name} ({round(meal.calories)} kcal)" for meal in day.meals},
+            "daily_nutrition": {k: round(v) for k, v in day.totals().items()},
+        }
+        for day in plan.days
+    }
+    return f"""User Preferences:
 Goal: {preferences.get("goal")}
 Restrictions: {preferences.get("restrictions")}
 Favorites: {preferences.get("favorites")}
 Dislikes: {preferences.get("dislikes")}
 
-Calorie Target: {calorie_target}
-
-Meal Plan for Day 1:
-{json.dumps(day1_plan, indent=2)}
-
-Evaluate the meal plan based on the following criteria:
-1. **Adherence to Restrictions:** Does the meal plan for day 1 strictly adhere to the user's dietary restrictions (e.g., Vegetarian, Dairy-Free)?
-2. **Inclusion of Favorites:** Does the meal plan for day 1 include any of the user's favorite foods?
-3. **Exclusion of Dislikes:** Does the meal plan for day 1 exclude the user's disliked foods?
-4. **Reasonableness of Calorie Distribution:** Is the distribution of calories across breakfast, lunch, dinner, and snacks reasonable for a full day?
-5. **Variety of Meals:** Does the meal plan for day 1 offer a reasonable variety of different dishes?
-6. **Estimated Daily Calories:** Is the 'daily_nutrition' calorie count for day 1 reasonably close to the user's calorie target?
-
-Provide your evaluation in a JSON format with the following keys: 'adherence_to_restrictions', 'inclusion_of_favorites', 'exclusion_of_dislikes', 'calorie_distribution_reasonableness', 'meal_variety', 'daily_calories_alignment', 'justification'. Assign a score from 1 to 5 (1=Very Poor, 5=Excellent) for each criterion."""
+Calorie Target: {input_context.get("calorie_target")}
+
+Automated checks found: {local_evaluation["justification"]}
+
+Meal Plan:
+{json.dumps(week, indent=1)}""", list(local_evaluation["needs_review"])
+
+# Judge rubric per logged function: what is evaluated, the criteria (stated once per request),
+# boolean criteria (all others are 1-5 scores) and how to render one entry with the keys to return
+JUDGE_RUBRICS = {
+    "analyze_image": {
+        "task": "Given the context and the raw response from an AI model for each entry, please evaluate the response.",
+        "criteria": ANALYZE_IMAGE_CRITERIA,
+        "boolean_keys": {"json_valid"},
+        "render": _analyze_image_entry,
+    },
+    "generate_meal_plan": {
+        "task": "Given the user preferences, calorie target, and the generated 7-day meal plan for each entry, please evaluate the meal plan.",
+        "criteria": MEAL_PLAN_CRITERIA,
+        "boolean_keys": set(),
+        "render": _meal_plan_entry,
+    },
+    "generate_grocery_list": {
+        "task": "Given the generated grocery list for each entry, please evaluate its quality.",
+        "criteria": GROCERY_LIST_CRITERIA,
+        "boolean_keys": set(),
+        "render": _grocery_list_entry,
+    },
+}
+
+def _judge_prompt(rubric, items):
+    """One request for several entries: the rubric once, then each entry with the keys to return for it."""
+    used = {key for _, _, keys in items for key in keys}
+    criteria = [key for key in rubric["criteria"] if key in used]
+    criteria_text = "\n".join(f"{n}. {rubric['criteria'][key]}" for n, key in enumerate(criteria, start=1))
+    entries_text = "\n\n".join(
+        f"### Entry {entry_id}\n{text}\n\nKeys to return: {', '.join(repr(key) for key in keys)}"
+        for entry_id, text, keys in items
+    )
+    boolean_keys = [key for key in criteria if key in rubric["boolean_keys"]]
+    scale = "Assign a score from 1 to 5 (1=Very Poor, 5=Excellent) for each criterion"
+    if boolean_keys:
+        scale += f" (except {', '.join(repr(key) for key in boolean_keys)}, which should be a boolean)"
+
+    return f"""You are an expert AI evaluator. {rubric["task"]} Evaluate each entry below independently.
+
+Evaluate the entries based on the following criteria:
+{criteria_text}
+
+{entries_text}
+
+Provide your evaluation as a JSON array with one object per entry. Each object has the key 'entry_id' (the entry's id as a string), the keys listed for that entry, and 'justification'. {scale}."""
+
+def _valid_score(rubric, key, value):
+    if key in rubric["boolean_keys"]:
+        return isinstance(value, bool)
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and 1 <= value <= 5
+
+def _parse_batch_evaluations(rubric, items, evaluation_text):
+    """{entry_id: evaluation} for the entries the reply evaluates completely and with valid scores."""
+    try:
+        reply = json.loads(evaluation_text or "")
+    except json.JSONDecodeError:
+        return {}
+    if isinstance(reply, dict):
+        reply = [reply]
+    if not isinstance(reply, list):
+        return {}
+
+    expected = {entry_id: keys for entry_id, _, keys in items}
+    evaluations = {}
+    for evaluation in reply:
+        if not isinstance(evaluation, dict):
+            continue
+        entry_id = str(evaluation.get("entry_id"))
+        keys = expected.get(entry_id)
+        if keys is None or not all(key in evaluation and _valid_score(rubric, key, evaluation[key]) for key in keys):
+            continue
+        evaluations[entry_id] = {key: evaluation[key] for key in keys}
+        evaluations[entry_id]["justification"] = evaluation.get("justification", "")
+    return evaluations
+
+def judge_batch(function_called, items):
+    """
+    Evaluates [(entry_id, entry text, keys)] of one function in a single Gemini request: {entry_id: evaluation}.
+    Entries the reply leaves out or scores invalidly are retried in two halves until each is judged alone.
+    """
+    rubric = JUDGE_RUBRICS[function_called]
+    evaluation_response_json = call_gemini_api(_judge_prompt(rubric, items))
+    if evaluation_response_json is None:  # request failed; splitting would only repeat it
+        return {entry_id: {"error": "No valid evaluation response received from Gemini API"} for entry_id, _, _ in items}
 
-        evaluation_response_json = call_gemini_api(prompt)
-        evaluation_text = parse_gemini_response(evaluation_response_json)
+    evaluation_text = parse_gemini_response(evaluation_response_json)
+    evaluations = _parse_batch_evaluations(rubric, items, evaluation_text)
+    missing = [item for item in items if item[0] not in evaluations]
+    if not missing:
+        return evaluations
+    if len(items) == 1:
+        log.error(f"Failed to decode JSON from evaluation response for {function_called}: {evaluation_text}")
+        return {items[0][0]: {"error": "Failed to decode evaluation JSON"}}
+
+    log.warning(f"{len(missing)} of {len(items)} {function_called} evaluations missing or invalid, retrying them in smaller batches")
+    half = (len(missing) + 1) // 2
+    for part in (missing[:half], missing[half:]):
+        if part:
+            evaluations.update(judge_batch(function_called, part))
+    return evaluations
+
+def judge_entries(function_called, log_entries, local_evaluations=None, batch_size=JUDGE_BATCH_SIZE):
+    """Judge evaluations for log entries of one function, batch_size entries per request, in entry order."""
+    render = JUDGE_RUBRICS[function_called]["render"]
+    local_evaluations = local_evaluations or [None] * len(log_entries)
+    items = [
+        (str(n), *render(entry, local_evaluation))
+        for n, (entry, local_evaluation) in enumerate(zip(log_entries, local_evaluations), start=1)
+    ]
+    evaluations = {}
+    for start in range(0, len(items), max(1, batch_size)):
+        evaluations.update(judge_batch(function_called, items[start:start + batch_size]))
+    return [evaluations[entry_id] for entry_id, _, _ in items]
+
+def _merge_judged(local_evaluation, judged):
+    """Local scores with the judge's scores for the criteria it was asked about."""
+    if "error" in judged:
+        return {**local_evaluation, "scored_by": "rules", "error": judged["error"]}
+    evaluation = {**local_evaluation, **{key: judged[key] for key in local_evaluation["needs_review"] if key in judged}}
+    evaluation["justification"] = f"{local_evaluation['justification']} Judge: {judged.get('justification', '')}"
+    evaluation["scored_by"] = "rules+judge"
+    return evaluation
 
-        if evaluation_text:
-            try:
-                evaluation = json.loads(evaluation_text)
-                return evaluation
-            except json.JSONDecodeError:
-                log.error(f"Failed to decode JSON from evaluation response for generate_meal_plan: {evaluation_text}")
-                return {"error": "Failed to decode evaluation JSON"}
-        else:
-            return {"error": "No valid evaluation response received from Gemini API"}
+def evaluate_analyze_image(log_entry):
+    """Evaluates the output of the analyze_image function."""
+    return judge_entries("analyze_image", [log_entry])[0]
 
+def _parse_logged_plan(log_entry):
+    """The logged meal plan as a dict, or None if the raw response is not valid JSON."""
+    raw_response_text = log_entry.get("raw_response_text", "")
+    try:
+        return json.loads(raw_response_text.strip('```json\n').strip('```'))
     except json.JSONDecodeError:
         log.error(f"Failed to decode JSON from raw response for generate_meal_plan: {raw_response_text}")
-        return {"error": "Failed to decode raw response JSON"}
-
-def evaluate_generate_grocery_list(log_entry):
-    """Evaluates the output of the generate_grocery_list function."""
-    raw_response_text = log_entry.get("raw_response_text", "")
-
-    prompt = f"""You are an expert AI evaluator. Given the following generated grocery list, please evaluate its quality.
-
-Grocery List:
-{raw_response_text}
+        return None
 
-Evaluate the grocery list based on the following criteria:
-1. **Comprehensiveness:** Does the grocery list seem to include a reasonable range of ingredients that would likely be needed for a typical 7-day meal plan (assuming a diverse set of meals)?
-2. **Organization:** Is the grocery list well-organized into logical categories (e.g., Produce, Pantry Staples)?
-3. **Clarity:** Are the items in the list generally clear and easy to understand?
-4. **Absence of Redundancy:** Does the list avoid excessive repetition of similar items?
+def score_meal_plans_locally(log_entries):
+    """Rule-based evaluations (plan_scoring) for generate_meal_plan log entries, all scored in one pass; None for unparseable plans."""
+    plans = [_parse_logged_plan(entry) for entry in log_entries]
+    parsed = [(plan, entry.get("input_context", {})) for plan, entry in zip(plans, log_entries) if plan is not None]
+    scores = iter(plan_scoring.score_plans(
+        [(plan, context.get("calorie_target"), context.get("preferences", {})) for plan, context in parsed]
+    ))
+    return [next(scores) if plan is not None else None for plan in plans]
+
+def evaluate_meal_plans(log_entries, batch_size=JUDGE_BATCH_SIZE):
+    """
+    Evaluates generate_meal_plan log entries over all days. Mechanical criteria come from the
+    rule-based scorer; the Gemini judge is asked only about the criteria it lists in needs_review,
+    in batches, and its scores replace the local ones for those.
+    """
+    local_evaluations = score_meal_plans_locally(log_entries)
+    evaluations = [None] * len(log_entries)
+    to_judge = []
+    for n, local_evaluation in enumerate(local_evaluations):
+        if local_evaluation is None:
+            evaluations[n] = {"error": "Failed to decode raw response JSON"}
+        elif not local_evaluation["needs_review"]:
+            evaluations[n] = {**local_evaluation, "scored_by": "rules"}
+        else:
+            to_judge.append(n)
+    log.info(f"Scored {len(log_entries)} meal plans locally, {len(to_judge)} need the judge")
 
-Provide your evaluation in a JSON format with the following keys: 'comprehensiveness', 'organization', 'clarity', 'absence_of_redundancy', 'justification'. Assign a score from 1 to 5 (1=Very Poor, 5=Excellent) for each criterion."""
+    judged = judge_entries(
+        "generate_meal_plan", [log_entries[n] for n in to_judge], [local_evaluations[n] for n in to_judge], batch_size,
+    )
+    for n, judged_evaluation in zip(to_judge, judged):
+        evaluations[n] = _merge_judged(local_evaluations[n], judged_evaluation)
+    return evaluations
 
-    evaluation_response_json = call_gemini_api(prompt)
-    evaluation_text = parse_gemini_response(evaluation_response_json)
+def evaluate_generate_meal_plan(log_entry):
+    """Evaluates the output of the generate_meal_plan function over all days."""
+    return evaluate_meal_plans([log_entry])[0]
 
-    if evaluation_text:
-        try:
-            evaluation = json.loads(evaluation_text)
-            return evaluation
-        except json.JSONDecodeError:
-            log.error(f"Failed to decode JSON from evaluation response for generate_grocery_list: {evaluation_text}")
-            return {"error": "Failed to decode evaluation JSON"}
-    else:
-        return {"error": "No valid evaluation response received from Gemini API"}
+def evaluate_generate_grocery_list(log_entry):
+    """Evaluates the output of the generate_grocery_list function."""
+    return judge_entries("generate_grocery_list", [log_entry])[0]
+
+def evaluate_entries(log_entries, batch_size=JUDGE_BATCH_SIZE):
+    """Evaluations for log entries in entry order, judging entries of the same function together."""
+    evaluations = [None] * len(log_entries)
+    for function_called in JUDGE_RUBRICS:
+        positions = [n for n, entry in enumerate(log_entries) if entry.get("function_called") == function_called]
+        if not positions:
+            continue
+        entries = [log_entries[n] for n in positions]
+        if function_called == "generate_meal_plan":
+            results = evaluate_meal_plans(entries, batch_size)
+        else:
+            results = judge_entries(function_called, entries, batch_size=batch_size)
+        log.info(f"Evaluated {len(entries)} {function_called} entries")
+        for n, evaluation in zip(positions, results):
+            evaluations[n] = evaluation
+
+    for n, entry in enumerate(log_entries):
+        if evaluations[n] is None:
+            function_called = entry.get("function_called")
+            log.warning(f"No evaluation function defined for '{function_called}'")
+            evaluations[n] = {"error": f"No evaluation function defined for '{function_called}'"}
+    return evaluations
 
 def main():
     """Reads the log file, evaluates outputs, and records results."""
+    parser = argparse.ArgumentParser(description="Evaluate logged model outputs with rule-based checks and a Gemini judge.")
+    parser.add_argument("--batch-size", type=int, default=JUDGE_BATCH_SIZE,
+                        help=f"Log entries judged per Gemini request (default {JUDGE_BATCH_SIZE}; 1 judges each entry alone)")
+    args = parser.parse_args()
+
     log_file_path = "api_log.jsonl"
     evaluation_results_file = "evaluation_results.jsonl"
 
@@ -186,39 +346,29 @@ def main():
         log.error(f"Log file not found: {log_file_path}")
         return
 
-    with open(log_file_path, 'r') as infile, open(evaluation_results_file, 'w') as outfile:
+    log_entries = []
+    with open(log_file_path, 'r') as infile:
         for line in infile:
             try:
-                log_entry = json.loads(line.strip())
-                function_called = log_entry.get("function_called")
-                timestamp = log_entry.get("timestamp")
-
-                log.info(f"Evaluating entry for function: {function_called} at timestamp: {timestamp}")
-
-                evaluation_result = {"timestamp": timestamp, "function_called": function_called, "original_log": log_entry}
-
-                if function_called == "analyze_image":
-                    evaluation = evaluate_analyze_image(log_entry)
-                    evaluation_result["evaluation"] = evaluation
-                elif function_called == "generate_meal_plan":
-                    evaluation = evaluate_generate_meal_plan(log_entry)
-                    evaluation_result["evaluation"] = evaluation
-                elif function_called == "generate_grocery_list":
-                    evaluation = evaluate_generate_grocery_list(log_entry)
-                    evaluation_result["evaluation"] = evaluation
-                else:
-                    evaluation_result["evaluation"] = {"error": f"No evaluation function defined for '{function_called}'"}
-                    log.warning(f"No evaluation function defined for '{function_called}'")
-
-                outfile.write(json.dumps(evaluation_result) + '\n')
-                log.info(f"Evaluation recorded for {function_called}")
-
+                log_entries.append(json.loads(line.strip()))
             except json.JSONDecodeError:
                 log.error(f"Could not decode JSON from line: {line.strip()}")
-            except Exception as e:
-                log.error(f"An unexpected error occurred: {e}")
+
+    # Batch work: yields rate limit capacity to interactive app requests
+    with rate_limiter.priority(rate_limiter.BATCH):
+        evaluations = evaluate_entries(log_entries, args.batch_size)
+
+    with open(evaluation_results_file, 'w') as outfile:
+        for log_entry, evaluation in zip(log_entries, evaluations):
+            evaluation_result = {
+                "timestamp": log_entry.get("timestamp"),
+                "function_called": log_entry.get("function_called"),
+                "original_log": log_entry,
+                "evaluation": evaluation,
+            }
+            outfile.write(json.dumps(evaluation_result) + '\n')
 
     log.info(f"Evaluation process completed. Results saved to {evaluation_results_file}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -2,21 +2,55 @@ import requests
 import base64
 import json
 import re
+import time
 import logging
-import pandas as pd
-import streamlit as st  # Required because st.error/warning are used directly here
-
-from fuzzywuzzy import fuzz
-from fuzzywuzzy import process
-
-from constants import GROQ_API_KEY, USDA_API_KEY, USDA_BASE_URL, EXAMPLE_MEAL_STRUCTURE
+from datetime import datetime, timezone
+
+from constants import GROQ_API_KEY, USDA_API_KEY, EXAMPLE_MEAL_STRUCTURE, LLM_REQUEST_TIMEOUT_SECONDS
+from meal_plan_schema import normalize_meal_plan
+from usda_client import fetch_nutrition_data_from_usda, fetch_nutrition_data_bulk
+import usage_ledger
+import rate_limiter
+from errors import (
+    MealPlannerError, InvalidRequestError, ConfigurationError, UpstreamAPIError, RateLimitError,
+    AuthenticationError, ResponseFormatError,
+)
 
 # Configure logger for this module
 log = logging.getLogger(__name__)
 
 
-def _handle_groq_http_error(err: requests.exceptions.HTTPError, feature_name: str) -> None:
-    """Show user-friendly, actionable Groq API errors in Streamlit."""
+GEMINI_MODEL = "gemini-2.0-flash"
+
+
+def post_generate_content(api_url: str, payload: dict, timeout: float, feature: str):
+    """
+    One Gemini generateContent request, recorded in the usage ledger under feature and throttled by
+    the shared rate limiter (Gemini sends no rate limit headers, so only its 429s throttle).
+    Raises BudgetExceededError or RateLimitError instead of calling when a budget or the rate limit is used up.
+    """
+    usage_ledger.check_budget()
+    rate_limiter.acquire("gemini", [GEMINI_MODEL], tokens=0)
+    started = time.perf_counter()
+    try:
+        response = requests.post(api_url, headers={"Content-Type": "application/json"}, json=payload, timeout=timeout)
+    except requests.exceptions.RequestException:
+        usage_ledger.record("gemini", GEMINI_MODEL, feature, "network_error", latency=time.perf_counter() - started)
+        raise
+    rate_limiter.observe("gemini", GEMINI_MODEL, response.headers, response.status_code)
+    usage = None
+    if response.ok:
+        try:
+            usage = usage_ledger.gemini_usage(response.json())
+        except ValueError:
+            pass
+    status = "ok" if response.ok else f"http_{response.status_code}"
+    usage_ledger.record("gemini", GEMINI_MODEL, feature, status, usage=usage, latency=time.perf_counter() - started)
+    return response
+
+
+def _gemini_http_error(err: requests.exceptions.HTTPError, feature_name: str) -> UpstreamAPIError:
+    """Builds a user-friendly, actionable error for a failed Gemini API call."""
     response = err.response
     status_code = response.status_code if response is not None else None
 
@@ -30,29 +64,30 @@ def _handle_groq_http_error(err: requests.exceptions.HTTPError, feature_name: st
         except Exception:
             message = ""
 
-    lower_message = message.lower()
-    if status_code == 429 and ("rate" in lower_message or "limit" in lower_message):
-        st.error(
-            f"❌ {feature_name} failed: Rate limit reached. Groq free tier has generous limits, please wait a moment and try again."
+    if status_code == 429:
+        return RateLimitError(
+            f"{feature_name} failed: Rate limit reached. Please wait a moment and try again.",
+            status_code=status_code,
         )
-        st.info("For higher limits, visit: https://console.groq.com")
-        return
 
     if status_code in (401, 403):
-        st.error(
-            f"❌ {feature_name} failed: Groq API key is invalid or expired. Get a new one from https://console.groq.com/keys"
+        return AuthenticationError(
+            f"{feature_name} failed: Google API key is invalid or expired.",
+            status_code=status_code,
         )
-        return
 
     if status_code:
-        st.error(f"❌ {feature_name} failed with API error {status_code}. Please try again later.")
+        text = f"{feature_name} failed with API error {status_code}. Please try again later."
     else:
-        st.error(f"❌ {feature_name} failed due to an API error. Please try again later.")
+        text = f"{feature_name} failed due to an API error. Please try again later."
 
     if message:
-        st.caption(f"API message: {message[:280]}")
+        detail = f"API message: {message[:280]}"
     elif raw_text:
-        st.caption(f"Raw API error: {raw_text[:280]}")
+        detail = f"Raw API error: {raw_text[:280]}"
+    else:
+        detail = None
+    return UpstreamAPIError(text, status_code=status_code, detail=detail)
 
 
 def test_groq_connection(api_key: str):
@@ -84,14 +119,13 @@ def test_groq_connection(api_key: str):
         return False, f"Network/API error: {exc}"
 
 
+# Callers pass the API key explicitly and report a missing one themselves (app.py, api_server.py);
+# this module must stay importable without it.
 if not GROQ_API_KEY:
-    st.error("❌ Groq API key ('groq_api_key') not found.")
-    st.info("Get free API key from: https://console.groq.com/keys")
-    st.info("Add it as 'groq_api_key' in Streamlit secrets or .env file.")
-    st.stop()
+    log.warning("Groq API key ('groq_api_key') not found; requests will fail until one is passed in.")
 
 if not USDA_API_KEY:
-    st.warning("⚠️ USDA API key ('usda_api_key') not found in .env file. Enhanced grounding will be limited.")
+    log.warning("USDA API key ('usda_api_key') not found. Enhanced grounding will be limited.")
 
 
 def validate_meal_plan_nutrition(meal_plan: dict) -> dict:
@@ -103,113 +137,54 @@ def validate_meal_plan_nutrition(meal_plan: dict) -> dict:
         "macro_discrepancies": []
     }
     
-    for day, meals in meal_plan.get("meal_plan", {}).items():
-        for meal_type in ["breakfast", "lunch", "dinner", "snacks"]:
-            meal = meals.get(meal_type, {})
-            if not meal.get("dish_name"):
-                continue
-            
-            validation_results["total_dishes"] += 1
-            
-            # Get USDA data
-            usda_data = fetch_nutrition_data_from_usda(meal["dish_name"])
-            if not usda_data:
-                continue
-                
-            validation_results["usda_verified"] += 1
-            
-            # Compare values
-            generated = meal.get("nutrition", {})
-            discrepancies = {}
-            
-            for key in ["calories", "protein", "carbs", "fat"]:
-                gen_val = generated.get(key, 0)
-                usda_val = usda_data.get(key, 0)
-                
-                if usda_val > 0 and abs(gen_val - usda_val)/usda_val > 0.15:  # 15% threshold
-                    discrepancies[key] = {
-                        "generated": gen_val,
-                        "usda": usda_val,
-                        "variance": round((gen_val - usda_val)/usda_val * 100, 1)
-                    }
-            
-            if discrepancies:
-                validation_results["calorie_discrepancies"].append({
-                    "dish": meal["dish_name"],
-                    **discrepancies
-                })
-    
-    return validation_results
-
-
-def fetch_nutrition_data_from_usda(food_name: str) -> dict:
-    """
-    Fetches nutrition data for a given food name from the USDA FoodData Central API.
-    Returns a dictionary with relevant nutrition information or None if not found or error.
-    """
-    try:
-        params = {
-            "api_key": USDA_API_KEY,
-            "query": food_name,
-            "pageSize": 3,  # Get top 3 for better matching
-            "dataType": ["Survey (FNDDS)"]  # Focus on standard reference data
-        }
+    meals = list(normalize_meal_plan(meal_plan).meals())
+    # One batched USDA lookup for the whole plan
+    usda_by_dish = fetch_nutrition_data_bulk([meal.dish_name for meal in meals])
+    for meal in meals:
+        validation_results["total_dishes"] += 1
         
-        response = requests.get(USDA_BASE_URL, params=params, timeout=15)
-        response.raise_for_status()
+        # Get USDA data
+        usda_data = usda_by_dish.get(meal.dish_name)
+        if not usda_data:
+            continue
+            
+        validation_results["usda_verified"] += 1
         
-        best_match = None
-        best_score = 0
+        # Compare values
+        discrepancies = {}
         
-        for food in response.json().get("foods", []):
-            # Use fuzzy matching to find best name match
-            score = fuzz.ratio(food_name.lower(), food["description"].lower())
-            if score > best_score:
-                best_match = food
-                best_score = score
-                
-        if best_score < 65:  # Only use good matches
-            return None
+        for key in ["calories", "protein", "carbs", "fat"]:
+            gen_val = getattr(meal, key)
+            usda_val = usda_data.get(key, 0)
             
-        # Extract nutrients with validation
-        nutrients = {
-            "calories": get_nutrient_value(best_match, "Energy"),
-            "protein": get_nutrient_value(best_match, "Protein"),
-            "carbs": get_nutrient_value(best_match, "Carbohydrate, by difference"),
-            "fat": get_nutrient_value(best_match, "Total lipid (fat)")
-        }
+            if usda_val > 0 and abs(gen_val - usda_val)/usda_val > 0.15:  # 15% threshold
+                discrepancies[key] = {
+                    "generated": gen_val,
+                    "usda": usda_val,
+                    "variance": round((gen_val - usda_val)/usda_val * 100, 1)
+                }
         
-        # Validate required fields
-        if all(v > 0 for v in nutrients.values()):
-            return nutrients
-            
-    except Exception as e:
-        log.error(f"USDA fetch error: {str(e)}")
-        return None
+        if discrepancies:
+            validation_results["calorie_discrepancies"].append({
+                "dish": meal.dish_name,
+                **discrepancies
+            })
+    
+    return validation_results
 
-def get_nutrient_value(food_data: dict, nutrient_name: str) -> float:
-    """Safe nutrient value extraction"""
-    return next(
-        (n["value"] for n in food_data.get("foodNutrients", []) 
-         if n.get("nutrientName") == nutrient_name and n.get("unitName") == "kcal"),
-        0.0
-    )
 
 def analyze_image_with_rest(api_key: str, image_bytes: bytes, language: str = "English"):
     """
     Sends image bytes to Gemini Vision REST API for analysis using requests.
-    Returns a dictionary with analysis data or None on failure.
+    Returns a dictionary with analysis data; raises MealPlannerError (see errors.py) on failure.
     """
     log.info(f"Entering analyze_image_with_rest for language: {language}")
     if not api_key:
         log.error("API key is missing for analyze_image_with_rest.")
-        st.error("Configuration error: API Key not provided.")
-        return None
+        raise ConfigurationError("Configuration error: API Key not provided.")
     if not image_bytes:
         log.warning("No image bytes provided for analysis.")
-        # Keep user warning
-        st.warning("No image bytes provided for analysis.")
-        return None
+        raise InvalidRequestError("No image bytes provided for analysis.")
 
     try:
         img_base64 = base64.b64encode(image_bytes).decode("utf-8")
@@ -231,7 +206,6 @@ def analyze_image_with_rest(api_key: str, image_bytes: bytes, language: str = "E
             f"Respond in {language} for the 'food' name if possible, keep keys in English."
         )
 
-        headers = {"Content-Type": "application/json"}
         payload = {
             "contents": [{
                 "parts": [
@@ -244,8 +218,7 @@ def analyze_image_with_rest(api_key: str, image_bytes: bytes, language: str = "E
         }
 
         log.info("Calling Vision API: gemini-2.0-flash generateContent")
-        response = requests.post(
-            api_url, headers=headers, json=payload, timeout=60)
+        response = post_generate_content(api_url, payload, timeout=60, feature="image_analysis")
         log.info(f"Vision API Status Code: {response.status_code}")
         log.info(
             f"Vision API Response Text (first 500): {response.text[:500]}")
@@ -257,26 +230,23 @@ def analyze_image_with_rest(api_key: str, image_bytes: bytes, language: str = "E
         # Check response structure based on Gemini API docs
         if not result_json.get("candidates"):
             log.error("Vision Error: No 'candidates' found in API response.")
-            st.error(
-                "❌ Image Analysis Error: No 'candidates' found in API response.")
             log.error("Full API Response: %s", result_json)
-            return None
+            raise ResponseFormatError("Image Analysis Error: No 'candidates' found in API response.")
 
         try:
             # Ensure the path to the text is correct
             if not result_json["candidates"][0].get("content") or not result_json["candidates"][0]["content"].get("parts"):
                 log.error(
                     "Vision Error: Unexpected content/parts structure in response.")
-                st.error("❌ Image Analysis Error: Unexpected response structure.")
                 log.error("Full API Response: %s", result_json)
-                return None
+                raise ResponseFormatError("Image Analysis Error: Unexpected response structure.")
 
             text_result = result_json["candidates"][0]["content"]["parts"][0]["text"]
             log.info(
                 f"Vision API Extracted Text (first 500): {text_result[:500]}")
             if text_result:
                 log_entry = {
-                    "timestamp": pd.Timestamp.now(tz='UTC').isoformat(),
+                    "timestamp": datetime.now(timezone.utc).isoformat(),
                     "function_called": "analyze_image",
                     "input_context": {
                         "language": language,
@@ -295,10 +265,8 @@ def analyze_image_with_rest(api_key: str, image_bytes: bytes, language: str = "E
         except (KeyError, IndexError, TypeError) as e:
             log.error(
                 f"Vision Error: Could not extract text part from API response: {e}")
-            st.error(
-                f"❌ Image Analysis Error: Could not process API response structure: {e}")
             log.error("Full API Response: %s", result_json)
-            return None
+            raise ResponseFormatError(f"Image Analysis Error: Could not process API response structure: {e}") from e
 
         # Parse JSON from the text result (more robust regex)
         match = re.search(
@@ -310,9 +278,7 @@ def analyze_image_with_rest(api_key: str, image_bytes: bytes, language: str = "E
         if not match:
             log.error(
                 "Vision Error: Could not parse/find JSON block in response text.")
-            st.error(
-                "⚠️ Image Analysis Error: Could not find expected JSON data in AI response.")
-            return None
+            raise ResponseFormatError("Image Analysis Error: Could not find expected JSON data in AI response.")
 
         try:
             json_str = match.group(1)
@@ -341,24 +307,20 @@ def analyze_image_with_rest(api_key: str, image_bytes: bytes, language: str = "E
         except json.JSONDecodeError as e:
             log.error(f"Vision Error: Failed to decode JSON: {e}")
             log.error(f"Problematic JSON string: {json_str}")
-            st.error(
-                f"⚠️ Image Analysis Error: Failed to decode AI response data: {e}")
-            return None
+            raise ResponseFormatError(f"Image Analysis Error: Failed to decode AI response data: {e}") from e
 
+    except MealPlannerError:
+        raise
     except requests.exceptions.HTTPError as e:
         log.error(f"API HTTP Error (Vision): {e}")
-        _handle_groq_http_error(e, "Image analysis")
-        return None
+        raise _gemini_http_error(e, "Image analysis") from e
     except requests.exceptions.RequestException as e:
         log.error(f"API Request Error (Vision): {e}")
-        st.error(
-            f"❌ Network Error: Failed to connect to Image Analysis service ({e})")
-        return None
+        raise UpstreamAPIError(f"Network Error: Failed to connect to Image Analysis service ({e})") from e
     except Exception as e:
         # Logs traceback
         log.exception("Unexpected error during image analysis.")
-        st.error(f"❌ An unexpected error occurred during image analysis: {e}")
-        return None
+        raise MealPlannerError(f"An unexpected error occurred during image analysis: {e}") from e
     finally:
         log.info("Exiting analyze_image_with_rest")
 
@@ -366,18 +328,16 @@ def analyze_image_with_rest(api_key: str, image_bytes: bytes, language: str = "E
 def generate_meal_plan_with_rest(api_key: str, calorie_target: int, preferences: dict, language: str = "English"):
     """
     Generates a 7-day meal plan dictionary using Gemini Text REST API.
-    Returns a dictionary { "day1": {...}, ... } or None on failure.
+    Returns a dictionary { "day1": {...}, ... }; raises MealPlannerError (see errors.py) on failure.
     """
     log.info(
         f"Entering generate_meal_plan_with_rest for {calorie_target} kcal, lang: {language}")
     if not api_key:
         log.error("API key is missing for generate_meal_plan_with_rest.")
-        st.error("Configuration error: API Key not provided.")
-        return None
+        raise ConfigurationError("Configuration error: API Key not provided.")
     if not calorie_target or not preferences:
         log.warning("Missing calorie target or preferences for meal plan.")
-        # No st.warning here, handled in app.py before calling
-        return None
+        raise InvalidRequestError("Missing calorie target or preferences for the meal plan.")
 
     try:
         # Using gemini-pro as it's generally better for complex JSON generation than flash
@@ -413,15 +373,13 @@ def generate_meal_plan_with_rest(api_key: str, calorie_target: int, preferences:
         log.info("Sending Meal Plan Prompt (first 300 chars):\n%s",
                  meal_prompt[:300] + "...")
 
-        headers = {"Content-Type": "application/json"}
         payload = {
             "contents": [{"role": "user", "parts": [{"text": meal_prompt}]}],
             "generationConfig": {"temperature": 0.6}
         }
 
         log.info("Calling Text API for meal plan: gemini-2.0-flash generateContent")
-        response = requests.post(
-            api_url, headers=headers, json=payload, timeout=180)  # Increased timeout
+        response = post_generate_content(api_url, payload, timeout=LLM_REQUEST_TIMEOUT_SECONDS, feature="meal_plan")
         log.info(f"Meal Plan API Status Code: {response.status_code}")
         log.info(
             f"Meal Plan API Response Text (first 500): {response.text[:500]}")
@@ -432,18 +390,15 @@ def generate_meal_plan_with_rest(api_key: str, calorie_target: int, preferences:
         if not result_json.get("candidates"):
             log.error(
                 "Meal Plan Error: No 'candidates' found in API response JSON.")
-            st.error("❌ Meal Plan Error: No 'candidates' found in AI response.")
             log.error("Full API Response: %s", result_json)
-            return None
+            raise ResponseFormatError("Meal Plan Error: No 'candidates' found in AI response.")
 
         try:
             if not result_json["candidates"][0].get("content") or not result_json["candidates"][0]["content"].get("parts"):
                 log.error(
                     "Meal Plan Error: Unexpected content/parts structure in response.")
-                st.error(
-                    "❌ Meal Plan Error: Unexpected response structure from AI.")
                 log.error("Full API Response: %s", result_json)
-                return None
+                raise ResponseFormatError("Meal Plan Error: Unexpected response structure from AI.")
             text_result = result_json["candidates"][0]["content"]["parts"][0]["text"]
             log.info(
                 f"Meal Plan Extracted Text (first 500): {text_result[:500]}")
@@ -452,7 +407,7 @@ def generate_meal_plan_with_rest(api_key: str, calorie_target: int, preferences:
             if text_result:  # Only log if we got text back
                 log_entry = {
                     # Use timezone-aware timestamp
-                    "timestamp": pd.Timestamp.now(tz='UTC').isoformat(),
+                    "timestamp": datetime.now(timezone.utc).isoformat(),
                     "function_called": "generate_meal_plan",
                     "input_context": {  # Log key inputs used for the prompt
                         "calorie_target": calorie_target,
@@ -476,10 +431,8 @@ def generate_meal_plan_with_rest(api_key: str, calorie_target: int, preferences:
 
         except (KeyError, IndexError, TypeError) as e:
             log.error(f"Meal Plan Error: Could not extract text part: {e}")
-            st.error(
-                f"❌ Meal Plan Error: Could not process AI response structure: {e}")
             log.error("Full API Response: %s", result_json)
-            return None
+            raise ResponseFormatError(f"Meal Plan Error: Could not process AI response structure: {e}") from e
 
         # Attempt to find JSON block (checking for ```json fence first)
         match = re.search(
@@ -492,9 +445,7 @@ def generate_meal_plan_with_rest(api_key: str, calorie_target: int, preferences:
         if not match:
             log.error(
                 "Could not parse/find JSON block within the meal plan text response.")
-            st.error(
-                "⚠️ Meal Plan Error: Could not find expected JSON data in AI response.")
-            return None
+            raise ResponseFormatError("Meal Plan Error: Could not find expected JSON data in AI response.")
 
         try:
             json_str = match.group(1)
@@ -505,10 +456,8 @@ def generate_meal_plan_with_rest(api_key: str, calorie_target: int, preferences:
             if "meal_plan" not in meal_data:
                 log.error(
                     "Meal Plan Error: Decoded JSON missing 'meal_plan' key.")
-                st.error(
-                    "❌ Meal Plan Error: AI response missing 'meal_plan' data.")
                 log.error("Structure of decoded JSON: %s", meal_data)
-                return None
+                raise ResponseFormatError("Meal Plan Error: AI response missing 'meal_plan' data.")
 
             final_plan_data = meal_data.get("meal_plan")
 
@@ -522,32 +471,25 @@ def generate_meal_plan_with_rest(api_key: str, calorie_target: int, preferences:
                 # If it's neither or is empty, something is wrong
                 log.error(
                     "Meal Plan Error: Value under 'meal_plan' is not a non-empty list or dictionary (type: %s).", type(final_plan_data))
-                st.error(
-                    f"❌ Meal Plan Error: AI returned unexpected data format for meal plan (expected List or Dict, got {type(final_plan_data)}).")
                 log.error("Full Decoded JSON: %s", meal_data)
-                return None
+                raise ResponseFormatError(f"Meal Plan Error: AI returned unexpected data format for meal plan (expected List or Dict, got {type(final_plan_data)}).")
 
         except json.JSONDecodeError as e:
             log.error(f"Failed to decode meal plan JSON block: {e}")
             log.error(f"Problematic JSON string: {json_str[:500]}...")
-            st.error(
-                f"⚠️ Meal Plan Error: Failed to decode AI response data: {e}")
-            return None
+            raise ResponseFormatError(f"Meal Plan Error: Failed to decode AI response data: {e}") from e
 
+    except MealPlannerError:
+        raise
     except requests.exceptions.HTTPError as e:
         log.error(f"API HTTP Error (Meal Plan): {e}")
-        _handle_gemini_http_error(e, "Meal plan generation")
-        return None
+        raise _gemini_http_error(e, "Meal plan generation") from e
     except requests.exceptions.RequestException as e:
         log.error(f"API Request Error (Meal Plan): {e}")
-        st.error(
-            f"❌ Network Error: Failed to connect to Meal Plan service ({e})")
-        return None
+        raise UpstreamAPIError(f"Network Error: Failed to connect to Meal Plan service ({e})") from e
     except Exception as e:
         log.exception("Unexpected error during meal plan generation.")
-        st.error(
-            f"❌ An unexpected error occurred during meal plan generation: {e}")
-        return None
+        raise MealPlannerError(f"An unexpected error occurred during meal plan generation: {e}") from e
     finally:
         log.info("Exiting generate_meal_plan_with_rest")
 
@@ -555,63 +497,29 @@ def generate_meal_plan_with_rest(api_key: str, calorie_target: int, preferences:
 def generate_grocery_list_with_rest(api_key: str, meal_plan_dict: dict, language: str = "English"):
     """
     Generates a grocery list string using Gemini Text REST API based on dish names.
-    Returns a Markdown string or None on failure.
+    Returns a Markdown string; raises MealPlannerError (see errors.py) on failure.
     """
     log.info("Entering generate_grocery_list_with_rest")
     if not api_key:
         log.error("API key is missing for generate_grocery_list_with_rest.")
-        st.error("Configuration error: API Key not provided.")
-        return None
+        raise ConfigurationError("Configuration error: API Key not provided.")
     if not meal_plan_dict or not isinstance(meal_plan_dict, dict):
         log.warning(
             "Invalid or empty meal_plan_dict provided for grocery list.")
-        return None  # No st.warning needed here, handled in button click
+        raise InvalidRequestError("No meal plan provided for the grocery list.")
 
-    all_dishes = []
     try:
-        # Extract dish names (including handling complex snacks)
-        for day_key, day_content in meal_plan_dict.items():
-            if not isinstance(day_content, dict):
-                continue
-            for meal_type in ["breakfast", "lunch", "dinner", "snacks"]:
-                info = day_content.get(meal_type)
-                if isinstance(info, dict):
-                    suffix = ""
-                    i = 1
-                    while True:
-                        dish_key = f"dish_name{suffix}"
-                        if dish_key in info:
-                            dish_name = info.get(dish_key)
-                            if dish_name and isinstance(dish_name, str) and dish_name.strip():
-                                all_dishes.append(dish_name.strip())
-                            i += 1
-                            suffix = str(i)
-                        elif suffix == "" and "dish_name" in info:
-                            break
-                        elif suffix != "":
-                            break
-                        else:
-                            break
-                elif isinstance(info, list):
-                    for item in info:
-                        if isinstance(item, dict) and "dish_name" in item:
-                            dish_name = item.get("dish_name")
-                            if dish_name and isinstance(dish_name, str) and dish_name.strip():
-                                all_dishes.append(dish_name.strip())
+        all_dishes = normalize_meal_plan(meal_plan_dict).dish_names()
 
         if not all_dishes:
             log.warning(
                 "No dish names extracted from meal plan for grocery list.")
-            # User feedback
-            st.warning(
-                "No dish names found in the plan to create a grocery list.")
-            return None
+            raise InvalidRequestError("No dish names found in the plan to create a grocery list.")
 
         unique_dishes = sorted(list(set(filter(None, all_dishes))))
         if not unique_dishes:
             log.warning("Filtered dish list for grocery list is empty.")
-            st.warning("No valid dish names found to generate grocery list.")
-            return None
+            raise InvalidRequestError("No valid dish names found to generate grocery list.")
 
         dishes_text = ", ".join(unique_dishes)
         log.info(
@@ -634,15 +542,13 @@ def generate_grocery_list_with_rest(api_key: str, meal_plan_dict: dict, language
 
         # Make API Call (can use flash for this less complex task)
         api_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={api_key}"
-        headers = {"Content-Type": "application/json"}
         payload = {
             "contents": [{"role": "user", "parts": [{"text": prompt}]}],
             "generationConfig": {"temperature": 0.3}  # More deterministic list
         }
 
         log.info("Making API call for grocery list...")
-        response = requests.post(
-            api_url, headers=headers, json=payload, timeout=90)
+        response = post_generate_content(api_url, payload, timeout=90, feature="grocery_list")
         log.info(f"Grocery List API Status Code: {response.status_code}")
         log.info(
             f"Grocery List Raw Response Text (first 500): {response.text[:500]}")
@@ -652,26 +558,22 @@ def generate_grocery_list_with_rest(api_key: str, meal_plan_dict: dict, language
         result_json = response.json()
         if not result_json.get("candidates"):
             log.error("Grocery List Error: No 'candidates' in response.")
-            st.error(
-                "❌ Grocery List Error: AI service did not provide a valid response.")
-            return None
+            raise ResponseFormatError("Grocery List Error: AI service did not provide a valid response.")
 
         # Extract text
         try:
             if not result_json["candidates"][0].get("content") or not result_json["candidates"][0]["content"].get("parts"):
                 log.error(
                     "Grocery List Error: Unexpected content/parts structure in response.")
-                st.error(
-                    "❌ Grocery List Error: Unexpected response structure from AI.")
                 log.error("Full API Response: %s", result_json)
-                return None
+                raise ResponseFormatError("Grocery List Error: Unexpected response structure from AI.")
 
             grocery_list_text = result_json["candidates"][0]["content"]["parts"][0]["text"]
             log.info("Successfully extracted grocery list text.")
 
             if grocery_list_text:
                 log_entry = {
-                    "timestamp": pd.Timestamp.now(tz='UTC').isoformat(),
+                    "timestamp": datetime.now(timezone.utc).isoformat(),
                     "function_called": "generate_grocery_list",
                     "input_context": {
                         "language": language,
@@ -695,21 +597,19 @@ def generate_grocery_list_with_rest(api_key: str, meal_plan_dict: dict, language
 
         except (KeyError, IndexError, TypeError) as e:
             log.error(f"Grocery List Error: Could not extract text part: {e}")
-            st.error("❌ Grocery List Error: Could not process response from AI.")
             log.error("Full API Response: %s", result_json)
-            return None
+            raise ResponseFormatError("Grocery List Error: Could not process response from AI.") from e
 
+    except MealPlannerError:
+        raise
     except requests.exceptions.HTTPError as e:
         log.error(f"API HTTP Error (Grocery List): {e}")
-        _handle_gemini_http_error(e, "Grocery list generation")
-        return None
+        raise _gemini_http_error(e, "Grocery list generation") from e
     except requests.exceptions.RequestException as e:
         log.error(f"API Request Error (Grocery List): {e}")
-        st.error(f"❌ Network Error connecting to AI for grocery list ({e})")
-        return None
+        raise UpstreamAPIError(f"Network Error connecting to AI for grocery list ({e})") from e
     except Exception as e:
         log.exception("Unexpected error during grocery list generation.")
-        st.error(f"❌ Unexpected error creating grocery list: {e}")
-        return None
+        raise MealPlannerError(f"Unexpected error creating grocery list: {e}") from e
     finally:
         log.info("Exiting generate_grocery_list_with_rest")
\ No newline at end of file
@@ -0,0 +1,234 @@
+"""
+Deterministic grocery list aggregation.
+
+Dishes are decomposed into ingredients (name, quantity, unit, category) once per normalized dish
+name and stored in a local knowledge base. A week's grocery list is then built locally by summing
+ingredient quantities across all meals, normalizing units and grouping by category. Only dishes
+the knowledge base has never seen need an LLM decomposition.
+"""
+
+import re
+import json
+import time
+import logging
+import threading
+
+import meal_utils as utils
+from meal_plan_schema import normalize_meal_plan
+from storage import open_db
+
+log = logging.getLogger(__name__)
+
+GROCERY_CATEGORIES = [
+    "Produce", "Meat & Poultry", "Fish & Seafood", "Dairy & Eggs", "Grains & Bakery",
+    "Legumes & Tofu", "Nuts & Seeds", "Pantry Staples", "Spices & Oils", "Frozen", "Other",
+]
+
+# Fallback categories when a decomposition does not name one (first match wins)
+CATEGORY_KEYWORDS = [
+    ("Fish & Seafood", ["salmon", "tuna", "cod", "tilapia", "shrimp", "prawn", "fish", "crab", "sardine"]),
+    ("Meat & Poultry", ["chicken", "beef", "pork", "lamb", "turkey", "bacon", "ham", "sausage", "steak"]),
+    ("Dairy & Eggs", ["milk", "cheese", "yogurt", "butter", "cream", "egg", "eggs", "paneer"]),
+    ("Legumes & Tofu", ["tofu", "tempeh", "lentil", "lentils", "chickpea", "chickpeas", "bean", "beans", "edamame", "hummus"]),
+    ("Nuts & Seeds", ["almond", "almonds", "walnut", "walnuts", "cashew", "peanut", "seed", "seeds"]),
+    ("Grains & Bakery", ["rice", "pasta", "bread", "oats", "oatmeal", "quinoa", "tortilla", "tortillas", "granola", "couscous", "noodle", "noodles", "buckwheat", "flour"]),
+    ("Spices & Oils", ["oil", "vinegar", "cumin", "paprika", "garlic powder", "oregano", "cinnamon", "spice"]),
+    ("Pantry Staples", ["chocolate", "honey", "sugar", "syrup", "sauce", "stock", "broth", "peanut butter"]),
+]
+# Staples nobody needs on a list
+EXCLUDED_INGREDIENTS = {"salt", "black pepper", "pepper", "water", "vegetable oil", "canola oil", "ice"}
+
+# Unit -> (base unit, factor to base)
+UNIT_CONVERSIONS = {
+    "g": ("g", 1.0), "gram": ("g", 1.0), "grams": ("g", 1.0),
+    "kg": ("g", 1000.0), "kilogram": ("g", 1000.0), "kilograms": ("g", 1000.0),
+    "oz": ("g", 28.3495), "ounce": ("g", 28.3495), "ounces": ("g", 28.3495),
+    "lb": ("g", 453.592), "lbs": ("g", 453.592), "pound": ("g", 453.592), "pounds": ("g", 453.592),
+    "ml": ("ml", 1.0), "milliliter": ("ml", 1.0), "milliliters": ("ml", 1.0),
+    "l": ("ml", 1000.0), "liter": ("ml", 1000.0), "liters": ("ml", 1000.0),
+    "cup": ("ml", 240.0), "cups": ("ml", 240.0),
+    "tbsp": ("ml", 15.0), "tablespoon": ("ml", 15.0), "tablespoons": ("ml", 15.0),
+    "tsp": ("ml", 5.0), "teaspoon": ("ml", 5.0), "teaspoons": ("ml", 5.0),
+    "pcs": ("pcs", 1.0), "pc": ("pcs", 1.0), "piece": ("pcs", 1.0), "pieces": ("pcs", 1.0),
+    "whole": ("pcs", 1.0), "clove": ("pcs", 1.0), "cloves": ("pcs", 1.0), "slice": ("pcs", 1.0), "slices": ("pcs", 1.0),
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dish_ingredients (
+    dish_key TEXT PRIMARY KEY,
+    dish_name TEXT NOT NULL,
+    serving_grams REAL,
+    ingredients TEXT NOT NULL,
+    source TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+_memo = {}
+_memo_lock = threading.Lock()
+
+
+def normalize_dish_name(dish_name: str) -> str:
+    """Canonical knowledge-base key: lower-case words without punctuation or extra spaces."""
+    return " ".join(re.findall(r"[a-z0-9]+", str(dish_name).lower()))
+
+
+def _kb_key(dish_name: str, language: str = "English") -> str:
+    """Knowledge-base key; ingredient names depend on the output language, so it is part of the key."""
+    key = normalize_dish_name(dish_name)
+    return key if language == "English" else f"{key}@{language.lower()}"
+
+
+def _normalize_ingredient_name(name: str) -> str:
+    words = re.findall(r"[a-z0-9]+", str(name).lower())
+    if words and len(words[-1]) > 3 and words[-1].endswith("s") and not words[-1].endswith("ss"):
+        words[-1] = words[-1][:-1]
+    return " ".join(words)
+
+
+def _guess_category(ingredient_name: str) -> str:
+    for category, keywords in CATEGORY_KEYWORDS:
+        if utils.mentions_any(ingredient_name, keywords):
+            return category
+    return "Produce"
+
+
+def normalize_ingredient(ingredient: dict):
+    """
+    Cleans one decomposed ingredient into {"name", "quantity", "unit", "category"} with the quantity
+    in a base unit (g, ml or pcs). Returns None for excluded staples or unusable entries.
+    """
+    if not isinstance(ingredient, dict):
+        return None
+    name = str(ingredient.get("name", "")).strip()
+    if not name or _normalize_ingredient_name(name) in EXCLUDED_INGREDIENTS:
+        return None
+    unit, factor = UNIT_CONVERSIONS.get(str(ingredient.get("unit", "g")).strip().lower().rstrip("."), ("pcs", 1.0))
+    category = ingredient.get("category")
+    if category not in GROCERY_CATEGORIES:
+        category = _guess_category(name)
+    return {
+        "name": name,
+        "quantity": utils.extract_num(ingredient.get("quantity", ingredient.get("grams", 0))) * factor,
+        "unit": unit,
+        "category": category,
+    }
+
+
+def get_cached_decompositions(dish_names, language: str = "English") -> dict:
+    """Returns {dish_key: {"serving_grams", "ingredients"}} for the dishes already in the knowledge base."""
+    keys = {_kb_key(n, language) for n in dish_names}
+    with _memo_lock:
+        found = {k: _memo[k] for k in keys if k in _memo}
+    missing = [k for k in keys if k not in found]
+    if missing:
+        with open_db() as conn:
+            conn.executescript(_SCHEMA)
+            placeholders = ",".join("?" * len(missing))
+            rows = conn.execute(
+                f"SELECT dish_key, serving_grams, ingredients FROM dish_ingredients WHERE dish_key IN ({placeholders})",
+                missing,
+            ).fetchall()
+        with _memo_lock:
+            for row in rows:
+                entry = {"serving_grams": row["serving_grams"], "ingredients": json.loads(row["ingredients"])}
+                _memo[row["dish_key"]] = entry
+                found[row["dish_key"]] = entry
+    return found
+
+
+def store_decomposition(dish_name: str, ingredients: list, serving_grams: float = None,
+                        source: str = "llm", language: str = "English") -> dict:
+    """Normalizes and stores one dish's ingredient breakdown. Returns the stored entry."""
+    cleaned = [i for i in (normalize_ingredient(x) for x in ingredients or []) if i]
+    serving_grams = utils.extract_num(serving_grams) or None
+    entry = {"serving_grams": serving_grams, "ingredients": cleaned}
+    key = _kb_key(dish_name, language)
+    with open_db() as conn:
+        conn.executescript(_SCHEMA)
+        conn.execute(
+            "INSERT OR REPLACE INTO dish_ingredients (dish_key, dish_name, serving_grams, ingredients, source, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (key, dish_name, serving_grams, json.dumps(cleaned), source, time.time()),
+        )
+    with _memo_lock:
+        _memo[key] = entry
+    return entry
+
+
+def _iter_dishes(meal_plan: dict):
+    """Yields (dish_name, portion_grams, ingredients) per dish; extra dishes of a meal have no portion."""
+    for meal in normalize_meal_plan(meal_plan).meals():
+        yield meal.dish_name, meal.portion_grams, meal.ingredients
+        for extra in meal.extra_dishes:
+            yield extra, 0.0, None
+
+
+def build_grocery_list(meal_plan: dict, decompose=None, language: str = "English") -> dict:
+    """
+    Aggregates the week's ingredients into {"categories": {category: [items]}, "missing_dishes": [...]}.
+    Each item is {"name", "quantity", "unit"} with quantities summed across meals in base units.
+    Meals that carry their own "ingredients" (instant plans) are used as-is; other dishes come from the
+    knowledge base, and decompose(dish_names) -> {dish_name: {"serving_grams", "ingredients"}} is called
+    once with all unknown dishes so they can be decomposed and stored.
+    """
+    dishes = list(_iter_dishes(meal_plan))
+    lookup_names = {name for name, _, ingredients in dishes if not ingredients}
+    known = get_cached_decompositions(lookup_names, language) if lookup_names else {}
+
+    unknown = sorted(n for n in lookup_names if _kb_key(n, language) not in known)
+    if unknown and decompose is not None:
+        log.info(f"Decomposing {len(unknown)} new dishes: {', '.join(unknown)[:200]}")
+        for dish_name, result in (decompose(unknown) or {}).items():
+            if result and result.get("ingredients"):
+                known[_kb_key(dish_name, language)] = store_decomposition(
+                    dish_name, result["ingredients"], result.get("serving_grams"), language=language
+                )
+
+    totals = {}  # (ingredient key, unit) -> item
+    missing = set()
+    for dish_name, portion, ingredients in dishes:
+        if ingredients:
+            entry = {"serving_grams": None, "ingredients": [i for i in map(normalize_ingredient, ingredients) if i]}
+        else:
+            entry = known.get(_kb_key(dish_name, language))
+        if not entry:
+            missing.add(dish_name)
+            continue
+
+        scale = portion / entry["serving_grams"] if portion and entry.get("serving_grams") else 1.0
+        for ingredient in entry["ingredients"]:
+            key = (_normalize_ingredient_name(ingredient["name"]), ingredient["unit"])
+            item = totals.setdefault(key, {
+                "name": ingredient["name"].strip().title(),
+                "quantity": 0.0,
+                "unit": ingredient["unit"],
+                "category": ingredient["category"],
+            })
+            item["quantity"] += ingredient["quantity"] * scale
+
+    categories = {}
+    for item in sorted(totals.values(), key=lambda i: i["name"]):
+        categories.setdefault(item.pop("category"), []).append(item)
+    ordered = {c: categories[c] for c in GROCERY_CATEGORIES if c in categories}
+    return {"categories": ordered, "missing_dishes": sorted(missing)}
+
+
+def format_quantity(quantity: float, unit: str) -> str:
+    """Human-friendly quantity: grams/ml above 1000 become kg/l, pieces are rounded up."""
+    if unit == "pcs":
+        return str(max(1, int(-(-quantity // 1))))
+    if quantity >= 1000:
+        return f"{utils.format_number(round(quantity / 1000, 1))} {'kg' if unit == 'g' else 'l'}"
+    return f"{int(round(quantity / 5) * 5) or 5} {unit}"
+
+
+def render_grocery_markdown(grocery: dict) -> str:
+    """Renders build_grocery_list() output as Markdown with one H3 heading per category."""
+    lines = []
+    for category, items in grocery.get("categories", {}).items():
+        lines.append(f"### {category}")
+        lines.extend(f"* {item['name']}: {format_quantity(item['quantity'], item['unit'])}" for item in items)
+        lines.append("")
+    if grocery.get("missing_dishes"):
+        lines.append(f"_Ingredients unavailable for: {', '.join(grocery['missing_dishes'])}_")
+    return "\n".join(lines).strip()
@@ -1,15 +1,28 @@
 import requests
-import base64
 import json
 import re
+import time
 import logging
-import pandas as pd
-import streamlit as st
-
-from fuzzywuzzy import fuzz
-from fuzzywuzzy import process
-
-from constants import GROQ_API_KEY, USDA_API_KEY, USDA_BASE_URL, EXAMPLE_MEAL_STRUCTURE
+from datetime import datetime, timezone
+
+from constants import (
+    GROQ_API_KEY, USDA_API_KEY, COMPACT_MEAL_STRUCTURE, COALESCE_ACROSS_PROCESSES,
+    STRUCTURED_OUTPUT_REPAIR_ATTEMPTS, CONTINUATION_MAX_REQUESTS, MEAL_PLAN_TOKENS_PER_DAY, DECOMPOSITION_TOKENS_PER_DISH,
+    LLM_MAX_OUTPUT_TOKENS, LLM_REQUEST_TIMEOUT_SECONDS,
+)
+from request_coalescing import SingleFlight, canonical_request_key
+from plan_calibration import calibrate_meal_plan
+from meal_utils import macro_split_for
+from meal_plan_schema import COMPACT_COLUMNS, expand_compact_plan
+import grocery
+import structured_output
+from token_budget import OutputTokenBudget
+import usage_ledger
+import rate_limiter
+from errors import (
+    MealPlannerError, InvalidRequestError, ConfigurationError, UpstreamAPIError, RateLimitError,
+    AuthenticationError, ResponseFormatError,
+)
 
 # Configure logger for this module
 log = logging.getLogger(__name__)
@@ -27,21 +40,33 @@ GROQ_MODELS = [
     "groq/compound-mini"            # Lightweight fallback
 ]
 
+MEAL_PLAN_DAY_KEYS = tuple(f"day{n}" for n in range(1, 8))
+
+# max_tokens sized from the requested days/dishes and observed usage; truncated replies are continued
+_meal_plan_tokens = OutputTokenBudget(MEAL_PLAN_TOKENS_PER_DAY, overhead=100, ceiling=LLM_MAX_OUTPUT_TOKENS)
+_decomposition_tokens = OutputTokenBudget(DECOMPOSITION_TOKENS_PER_DISH, overhead=200, ceiling=LLM_MAX_OUTPUT_TOKENS)
+
+# Callers pass the API key explicitly and report a missing one themselves (app.py, api_server.py);
+# this module must stay importable without it.
 if not GROQ_API_KEY:
-    st.error("❌ Groq API key ('groq_api_key') not found.")
-    st.info("Get free API key from: https://console.groq.com/keys")
-    st.info("Add it as 'groq_api_key' in Streamlit secrets or .env file.")
-    st.stop()
+    log.warning("Groq API key ('groq_api_key') not found; requests will fail until one is passed in.")
 
 if not USDA_API_KEY:
-    st.warning("⚠️ USDA API key ('usda_api_key') not found in .env file. Enhanced grounding will be limited.")
+    log.warning("USDA API key ('usda_api_key') not found. Enhanced grounding will be limited.")
 
+# Identical concurrent meal plan / grocery requests share one upstream call
+_inflight = SingleFlight(cross_process=COALESCE_ACROSS_PROCESSES)
 
-def _call_groq_with_fallback(api_key: str, messages: list, temperature: float, max_tokens: int, models: list = None, feature_name: str = "API"):
+
+def _call_groq_with_fallback(api_key: str, messages: list, temperature: float, max_tokens: int, models: list = None,
+                             feature_name: str = "API", response_schema: tuple = None):
     """
     Call Groq API with automatic model fallback.
-    Tries each model in sequence until one succeeds.
-    Returns (response, used_model) or raises on final failure.
+    Tries each model in sequence until one succeeds; a model at its rate limit (rate_limiter) is
+    skipped in favour of the next one with capacity, or waited for when none has any.
+    response_schema, a (name, JSON Schema) pair, requests structured JSON output from models that
+    support it (see structured_output.response_format); a model that rejects it is retried without.
+    Returns (response, used_model); raises UpstreamAPIError (or a subclass) when every model fails.
     """
     if models is None:
         models = GROQ_MODELS
@@ -52,18 +77,32 @@ def _call_groq_with_fallback(api_key: str, messages: list, temperature: float, m
     }
     
     last_error = None
+    remaining = list(models)
+    estimated_tokens = rate_limiter.estimate_tokens(messages, max_tokens)
     
-    for model in models:
+    while remaining:
+        # Skips ahead to a fallback model, or waits, while the preferred one is at its rate limit
+        model = rate_limiter.acquire("groq", remaining, estimated_tokens)
+        remaining.remove(model)
         payload = {
             "model": model,
             "messages": messages,
             "temperature": temperature,
             "max_tokens": max_tokens
         }
+        response_format = structured_output.response_format(model, *response_schema) if response_schema else None
+        if response_format:
+            payload["response_format"] = response_format
         
         try:
             log.info(f"Attempting Groq API call with model: {model}")
-            response = requests.post(GROQ_API_URL, headers=headers, json=payload, timeout=180)
+            response = _post_chat(headers, payload, feature_name)
+            if response_format and _rejects_response_format(response):
+                # Unsupported parameter, or the model's output failed Groq's own JSON validation:
+                # ask again without it and let the local validation and repair handle the reply
+                log.warning(f"Model {model} rejected response_format {response_format['type']}, retrying without it")
+                del payload["response_format"]
+                response = _post_chat(headers, payload, feature_name)
             
             # Check if model is decommissioned
             if response.status_code == 400:
@@ -74,7 +113,7 @@ def _call_groq_with_fallback(api_key: str, messages: list, temperature: float, m
                     
                     if "decommissioned" in error_msg.lower():
                         log.warning(f"Model {model} is decommissioned, trying next fallback...")
-                        last_error = error_msg
+                        last_error = RuntimeError(error_msg)
                         continue
                 except Exception:
                     pass
@@ -86,18 +125,102 @@ def _call_groq_with_fallback(api_key: str, messages: list, temperature: float, m
             
         except requests.exceptions.RequestException as e:
             log.warning(f"Model {model} failed: {str(e)}, trying next...")
-            last_error = str(e)
+            last_error = e
             continue
     
     # All models failed
-    if last_error:
-        raise RuntimeError(f"All Groq models exhausted. Last error: {last_error}")
-    else:
-        raise RuntimeError("Failed to call Groq API with any model")
+    log.error(f"All Groq models exhausted for {feature_name}. Last error: {last_error}")
+    if isinstance(last_error, requests.exceptions.HTTPError):
+        raise _groq_http_error(last_error, feature_name.capitalize())
+    raise UpstreamAPIError(
+        f"{feature_name.capitalize()} failed: could not reach the Groq API. Please try again later.",
+        detail=str(last_error)[:280] if last_error else None,
+    )
+
+
+def _post_chat(headers: dict, payload: dict, feature_name: str):
+    """
+    One chat completion request, recorded in the usage ledger (tokens, timing, outcome); its
+    rate limit headers update the shared rate limiter. Raises BudgetExceededError instead of calling when a usage budget is used up.
+    """
+    usage_ledger.check_budget()
+    feature = feature_name.replace(" ", "_")
+    started = time.perf_counter()
+    try:
+        response = requests.post(GROQ_API_URL, headers=headers, json=payload, timeout=LLM_REQUEST_TIMEOUT_SECONDS)
+    except requests.exceptions.RequestException:
+        usage_ledger.record("groq", payload["model"], feature, "network_error", latency=time.perf_counter() - started)
+        raise
+    latency = time.perf_counter() - started
+    rate_limiter.observe("groq", payload["model"], response.headers, response.status_code)
+    usage = None
+    if response.ok:
+        try:
+            usage = usage_ledger.groq_usage(response.json())
+        except ValueError:
+            pass
+    status = "ok" if response.ok else f"http_{response.status_code}"
+    usage_ledger.record("groq", payload["model"], feature, status, usage=usage, latency=latency)
+    return response
 
 
-def _handle_groq_http_error(err: requests.exceptions.HTTPError, feature_name: str) -> None:
-    """Show user-friendly, actionable Groq API errors in Streamlit."""
+def _rejects_response_format(response) -> bool:
+    if response.status_code != 400:
+        return False
+    try:
+        error = response.json().get("error", {})
+    except ValueError:
+        return False
+    message = str(error.get("message", "")).lower()
+    return error.get("code") == "json_validate_failed" or "response_format" in message or "json_schema" in message
+
+
+def _stitch(prefix: str, continuation: str) -> str:
+    """Joins a continuation onto truncated output, dropping text the model repeated from the end of prefix."""
+    if continuation.startswith(prefix):
+        return continuation
+    for size in range(min(len(prefix), len(continuation), 200), 7, -1):
+        if prefix.endswith(continuation[:size]):
+            return prefix + continuation[size:]
+    return prefix + continuation
+
+
+def _continue_truncated(api_key: str, messages: list, result_json: dict, model: str, max_tokens: int,
+                        temperature: float, feature_name: str):
+    """
+    Completes a reply that stopped at max_tokens (finish_reason "length"): the partial output is sent
+    back as an assistant prefix and the same model continues from there, up to CONTINUATION_MAX_REQUESTS
+    times. Only the missing tail is generated instead of the whole reply again.
+    Returns (full text, completion tokens used across all requests).
+    """
+    choice = result_json["choices"][0]
+    text = choice["message"]["content"] or ""
+    completion_tokens = result_json.get("usage", {}).get("completion_tokens", 0)
+    finish_reason = choice.get("finish_reason")
+    for attempt in range(1, CONTINUATION_MAX_REQUESTS + 1):
+        if finish_reason != "length":
+            break
+        log.warning(f"{feature_name.capitalize()} reply truncated at {len(text)} chars; continuation {attempt}")
+        response, _ = _call_groq_with_fallback(
+            api_key=api_key,
+            messages=messages + [{"role": "assistant", "content": text}],
+            temperature=temperature,
+            max_tokens=max_tokens,
+            models=[model],
+            feature_name=feature_name,
+        )
+        continued = response.json()
+        choice = continued["choices"][0]
+        text = _stitch(text, choice["message"]["content"] or "")
+        completion_tokens += continued.get("usage", {}).get("completion_tokens", 0)
+        finish_reason = choice.get("finish_reason")
+    if finish_reason == "length":
+        log.error(f"{feature_name.capitalize()} reply still truncated after {CONTINUATION_MAX_REQUESTS} continuations")
+    return text, completion_tokens
+
+
+def _groq_http_error(err: requests.exceptions.HTTPError, feature_name: str) -> UpstreamAPIError:
+    """Builds a user-friendly, actionable error for a failed Groq API call."""
     response = err.response
     status_code = response.status_code if response is not None else None
 
@@ -113,27 +236,30 @@ def _handle_groq_http_error(err: requests.exceptions.HTTPError, feature_name: st
 
     lower_message = message.lower()
     if status_code == 429 and ("rate" in lower_message or "limit" in lower_message):
-        st.error(
-            f"❌ {feature_name} failed: Rate limit reached. Groq free tier has generous limits, please wait a moment and try again."
+        return RateLimitError(
+            f"{feature_name} failed: Rate limit reached. Groq free tier has generous limits, please wait a moment and try again.",
+            status_code=status_code,
+            hint="For higher limits, visit: https://console.groq.com",
         )
-        st.info("For higher limits, visit: https://console.groq.com")
-        return
 
     if status_code in (401, 403):
-        st.error(
-            f"❌ {feature_name} failed: Groq API key is invalid or expired. Get a new one from https://console.groq.com/keys"
+        return AuthenticationError(
+            f"{feature_name} failed: Groq API key is invalid or expired. Get a new one from https://console.groq.com/keys",
+            status_code=status_code,
         )
-        return
 
     if status_code:
-        st.error(f"❌ {feature_name} failed with API error {status_code}. Please try again later.")
+        text = f"{feature_name} failed with API error {status_code}. Please try again later."
     else:
-        st.error(f"❌ {feature_name} failed due to an API error. Please try again later.")
+        text = f"{feature_name} failed due to an API error. Please try again later."
 
     if message:
-        st.caption(f"API message: {message[:280]}")
+        detail = f"API message: {message[:280]}"
     elif raw_text:
-        st.caption(f"Raw API error: {raw_text[:280]}")
+        detail = f"Raw API error: {raw_text[:280]}"
+    else:
+        detail = None
+    return UpstreamAPIError(text, status_code=status_code, detail=detail)
 
 
 def test_groq_connection(api_key: str):
@@ -158,69 +284,29 @@ def test_groq_connection(api_key: str):
         return False, f"Error: {str(exc)[:220]}"
 
 
-
-def fetch_nutrition_data_from_usda(food_name: str) -> dict:
-    """Fetches nutrition data for a given food name from the USDA FoodData Central API."""
-    try:
-        params = {
-            "api_key": USDA_API_KEY,
-            "query": food_name,
-            "pageSize": 3,
-            "dataType": ["Survey (FNDDS)"]
-        }
-        
-        response = requests.get(USDA_BASE_URL, params=params, timeout=15)
-        response.raise_for_status()
-        
-        best_match = None
-        best_score = 0
-        
-        for food in response.json().get("foods", []):
-            score = fuzz.ratio(food_name.lower(), food["description"].lower())
-            if score > best_score:
-                best_match = food
-                best_score = score
-                
-        if best_score < 65:
-            return None
-            
-        nutrients = {
-            "calories": get_nutrient_value(best_match, "Energy"),
-            "protein": get_nutrient_value(best_match, "Protein"),
-            "carbs": get_nutrient_value(best_match, "Carbohydrate, by difference"),
-            "fat": get_nutrient_value(best_match, "Total lipid (fat)")
-        }
-        
-        if all(v > 0 for v in nutrients.values()):
-            return nutrients
-            
-    except Exception as e:
-        log.error(f"USDA fetch error: {str(e)}")
-        return None
-
-
-def get_nutrient_value(food_data: dict, nutrient_name: str) -> float:
-    """Safe nutrient value extraction"""
-    return next(
-        (n["value"] for n in food_data.get("foodNutrients", []) 
-         if n.get("nutrientName") == nutrient_name and n.get("unitName") == "kcal"),
-        0.0
-    )
-
-
 def generate_meal_plan_with_rest(api_key: str, calorie_target: int, preferences: dict, language: str = "English"):
     """
     Generates a 7-day meal plan dictionary using Groq API.
-    Returns a dictionary { "day1": {...}, ... } or None on failure.
+    Concurrent identical requests are coalesced onto a single API call. Finished plans are not
+    cached: every new request (a regenerate, a template builder retry) gets a fresh generation.
+    Returns a dictionary { "day1": {...}, ... }; raises MealPlannerError (see errors.py) on failure.
     """
+    key = canonical_request_key(
+        "meal_plan", api_key, calorie_target=calorie_target, preferences=preferences, language=language
+    )
+    return _inflight.do(key, lambda: _generate_meal_plan(api_key, calorie_target, preferences, language))
+
+
+@usage_ledger.metered("meal_plan")
+def _generate_meal_plan(api_key: str, calorie_target: int, preferences: dict, language: str = "English"):
+    """Uncoalesced meal plan generation; see generate_meal_plan_with_rest."""
     log.info(f"Entering generate_meal_plan_with_rest for {calorie_target} kcal, lang: {language}")
     if not api_key:
         log.error("API key is missing for generate_meal_plan_with_rest.")
-        st.error("Configuration error: API Key not provided.")
-        return None
+        raise ConfigurationError("Configuration error: API Key not provided.")
     if not calorie_target or not preferences:
         log.warning("Missing calorie target or preferences for meal plan.")
-        return None
+        raise InvalidRequestError("Missing calorie target or preferences for the meal plan.")
 
     try:
         restrictions_str = ', '.join(preferences.get('restrictions', [])) or 'None'
@@ -235,14 +321,15 @@ def generate_meal_plan_with_rest(api_key: str, calorie_target: int, preferences:
             f"- Favorite Foods: {favorites_str}\n"
             f"- Disliked Foods: {dislikes_str}\n\n"
             f"CRITICAL: Return ONLY valid JSON (no extra text before or after).\n"
-            f"Use this exact structure:\n"
-            f"{EXAMPLE_MEAL_STRUCTURE}\n\n"
+            f"Use this exact compact structure, one row per meal:\n"
+            f"{COMPACT_MEAL_STRUCTURE}\n\n"
+            f"Each row is [{', '.join(COMPACT_COLUMNS)}]: grams is the portion in grams, kcal the calories, "
+            f"protein/carbs/fat in grams.\n\n"
             f"Requirements:\n"
             f"- Use common, well-known foods\n"
             f"- Include breakfast, lunch, dinner for 7 days (day1 through day7)\n"
-            f"- All nutrition values must be numbers only (no units)\n"
-            f"- portion_grams must be realistic\n"
-            f"- data_source can be 'USDA' or 'AI'\n"
+            f"- All numbers must be plain numbers (no units)\n"
+            f"- Portions must be realistic\n"
             f"- Return ONLY the JSON, nothing else"
         )
 
@@ -251,12 +338,14 @@ def generate_meal_plan_with_rest(api_key: str, calorie_target: int, preferences:
         messages = [{"role": "user", "content": meal_prompt}]
         
         log.info("Calling Groq API for meal plan generation with model fallback")
+        max_tokens = _meal_plan_tokens.max_tokens(len(MEAL_PLAN_DAY_KEYS))
         response, used_model = _call_groq_with_fallback(
             api_key=api_key,
             messages=messages,
             temperature=0.6,
-            max_tokens=2000,
-            feature_name="meal plan generation"
+            max_tokens=max_tokens,
+            feature_name="meal plan generation",
+            response_schema=("meal_plan", structured_output.meal_plan_schema(MEAL_PLAN_DAY_KEYS)),
         )
         log.info(f"Meal Plan API Status Code: {response.status_code}")
         log.info(f"Used model: {used_model}")
@@ -267,17 +356,19 @@ def generate_meal_plan_with_rest(api_key: str, calorie_target: int, preferences:
         result_json = response.json()
         if not result_json.get("choices"):
             log.error("Meal Plan Error: No 'choices' found in API response JSON.")
-            st.error("❌ Meal Plan Error: No 'choices' found in AI response.")
             log.error("Full API Response: %s", result_json)
-            return None
+            raise ResponseFormatError("Meal Plan Error: No 'choices' found in AI response.")
 
         try:
-            text_result = result_json["choices"][0]["message"]["content"]
+            text_result, completion_tokens = _continue_truncated(
+                api_key, messages, result_json, used_model, max_tokens, 0.6, "meal plan generation"
+            )
+            _meal_plan_tokens.observe(len(MEAL_PLAN_DAY_KEYS), completion_tokens)
             log.info(f"Meal Plan Extracted Text (first 500): {text_result[:500]}")
 
             if text_result:
                 log_entry = {
-                    "timestamp": pd.Timestamp.now(tz='UTC').isoformat(),
+                    "timestamp": datetime.now(timezone.utc).isoformat(),
                     "function_called": "generate_meal_plan",
                     "input_context": {
                         "calorie_target": calorie_target,
@@ -297,9 +388,8 @@ def generate_meal_plan_with_rest(api_key: str, calorie_target: int, preferences:
 
         except (KeyError, IndexError, TypeError) as e:
             log.error(f"Meal Plan Error: Could not extract text part: {e}")
-            st.error(f"❌ Meal Plan Error: Could not process AI response structure: {e}")
             log.error("Full API Response: %s", result_json)
-            return None
+            raise ResponseFormatError(f"Meal Plan Error: Could not process AI response structure: {e}") from e
 
         # Parse JSON from the text result - more robust extraction
         json_str = None
@@ -330,193 +420,282 @@ def generate_meal_plan_with_rest(api_key: str, calorie_target: int, preferences:
         if not json_str:
             log.error("Could not parse/find JSON block within the meal plan text response.")
             log.error(f"Response preview: {text_result[:500]}")
-            st.error("⚠️ Meal Plan Error: Could not find expected JSON data in AI response.")
-            st.info("Try generating again - sometimes the AI needs retry.")
-            return None
+            raise ResponseFormatError(
+                "Meal Plan Error: Could not find expected JSON data in AI response.",
+                hint="Try generating again - sometimes the AI needs retry.",
+            )
 
         try:
             log.info(f"Meal Plan Found JSON block: {json_str[:300]}...")
-            meal_data = json.loads(json_str)
+            valid_days, problems = structured_output.check_meal_plan(json_str, MEAL_PLAN_DAY_KEYS)
+            if valid_days is not None:
+                # Compact reply: resend only the days that are missing or invalid
+                for _ in range(STRUCTURED_OUTPUT_REPAIR_ATTEMPTS):
+                    if not problems:
+                        break
+                    repaired, problems = _repair_meal_plan_days(api_key, problems, calorie_target, preferences, language)
+                    valid_days.update(repaired)
+                if problems:
+                    log.error(f"Meal plan days still invalid after repair: {problems}")
+                    raise ResponseFormatError(
+                        f"Meal Plan Error: AI response has invalid data for {', '.join(problems)}.",
+                        hint="Try generating again - sometimes the AI needs retry.",
+                    )
+                expand_issues = []
+                meal_data = {"meal_plan": expand_compact_plan({"days": {k: valid_days[k] for k in MEAL_PLAN_DAY_KEYS}}, expand_issues)}
+                if expand_issues:
+                    log.warning(f"Skipped malformed compact meal plan rows: {expand_issues[:5]}")
+            else:
+                meal_data = json.loads(json_str)
             log.info("Meal plan JSON decoded successfully.")
 
             if "meal_plan" not in meal_data:
                 log.error("Meal Plan Error: Decoded JSON missing 'meal_plan' key.")
-                st.error("❌ Meal Plan Error: AI response missing 'meal_plan' data.")
                 log.error("Structure of decoded JSON: %s", meal_data)
-                return None
+                raise ResponseFormatError("Meal Plan Error: AI response missing 'meal_plan' data.")
 
             final_plan_data = meal_data.get("meal_plan")
 
             if final_plan_data and (isinstance(final_plan_data, dict) or isinstance(final_plan_data, list)):
                 data_type = "dictionary" if isinstance(final_plan_data, dict) else "list"
                 log.info(f"Successfully extracted meal plan {data_type} with {len(final_plan_data)} entries.")
+                if isinstance(final_plan_data, dict):
+                    # Fix calorie misses by rescaling portions rather than regenerating the plan
+                    calibration = calibrate_meal_plan(final_plan_data, calorie_target, macro_split_for(preferences))
+                    if calibration["max_abs_error_kcal"] > calorie_target * 0.05:
+                        log.warning(f"Meal plan still {calibration['max_abs_error_kcal']:.0f} kcal off target after calibration.")
                 return final_plan_data
             else:
                 log.error("Meal Plan Error: Value under 'meal_plan' is not a non-empty list or dictionary.")
-                st.error(f"❌ Meal Plan Error: AI returned unexpected data format (expected List or Dict, got {type(final_plan_data)}).")
                 log.error("Full Decoded JSON: %s", meal_data)
-                return None
+                raise ResponseFormatError(
+                    f"Meal Plan Error: AI returned unexpected data format (expected List or Dict, got {type(final_plan_data)})."
+                )
 
         except json.JSONDecodeError as e:
             log.error(f"Failed to decode meal plan JSON block: {e}")
             log.error(f"Problematic JSON string: {json_str[:500]}...")
-            st.error(f"⚠️ Meal Plan Error: Failed to decode AI response data: {e}")
-            return None
+            raise ResponseFormatError(f"Meal Plan Error: Failed to decode AI response data: {e}") from e
 
+    except MealPlannerError:
+        raise
     except requests.exceptions.HTTPError as e:
         log.error(f"API HTTP Error (Meal Plan): {e}")
-        _handle_groq_http_error(e, "Meal plan generation")
-        return None
+        raise _groq_http_error(e, "Meal plan generation") from e
     except requests.exceptions.RequestException as e:
         log.error(f"API Request Error (Meal Plan): {e}")
-        st.error(f"❌ Network Error: Failed to connect to Meal Plan service ({e})")
-        return None
+        raise UpstreamAPIError(f"Network Error: Failed to connect to Meal Plan service ({e})") from e
     except Exception as e:
         log.exception("Unexpected error during meal plan generation.")
-        st.error(f"❌ An unexpected error occurred during meal plan generation: {e}")
-        return None
+        raise MealPlannerError(f"An unexpected error occurred during meal plan generation: {e}") from e
     finally:
         log.info("Exiting generate_meal_plan_with_rest")
 
 
+def _repair_meal_plan_days(api_key: str, problems: dict, calorie_target: int, preferences: dict, language: str = "English"):
+    """
+    Asks for just the missing or invalid days of a compact meal plan, showing the model each broken fragment.
+    Returns (valid_days, remaining_problems) in the shape of structured_output.check_meal_plan.
+    """
+    day_keys = tuple(problems)
+    log.info(f"Requesting repair of meal plan days {day_keys}")
+    broken = "\n".join(
+        f"- {key}: {reason}" + (f"\n  Invalid fragment: {fragment[:1200]}" if fragment else "")
+        for key, (reason, fragment) in problems.items()
+    )
+    prompt = (
+        f"You are a nutritionist AI assistant. Part of a 7-day meal plan for {calorie_target} kcal/day was missing or invalid.\n"
+        f"- Goal: {preferences.get('goal', 'Maintain Weight')}\n"
+        f"- Diet/Restrictions: {', '.join(preferences.get('restrictions', [])) or 'None'}\n"
+        f"- Disliked Foods: {preferences.get('dislikes', 'None')}\n\n"
+        f"Days to fix:\n{broken}\n\n"
+        f"Return ONLY valid JSON of the form {{\"days\": {{\"{day_keys[0]}\": [rows]}}}} containing exactly these days: {', '.join(day_keys)}.\n"
+        f"Each row is [{', '.join(COMPACT_COLUMNS)}] with plain numbers; include breakfast, lunch and dinner; "
+        f"dish names in {language}."
+    )
+    messages = [{"role": "user", "content": prompt}]
+    max_tokens = _meal_plan_tokens.max_tokens(len(day_keys))
+    response, used_model = _call_groq_with_fallback(
+        api_key=api_key,
+        messages=messages,
+        temperature=0.3,
+        max_tokens=max_tokens,
+        feature_name="meal plan generation",
+        response_schema=("meal_plan", structured_output.meal_plan_schema(day_keys)),
+    )
+    try:
+        text_result, completion_tokens = _continue_truncated(
+            api_key, messages, response.json(), used_model, max_tokens, 0.3, "meal plan generation"
+        )
+        _meal_plan_tokens.observe(len(day_keys), completion_tokens)
+    except (KeyError, IndexError, TypeError, ValueError) as e:
+        log.error(f"Meal plan repair returned no content: {e}")
+        return {}, problems
+    json_str = text_result[text_result.find('{'):text_result.rfind('}') + 1]
+    valid_days, remaining = structured_output.check_meal_plan(json_str, day_keys)
+    if valid_days is None:
+        log.error(f"Meal plan repair reply is not in the compact format: {text_result[:200]}")
+        return {}, problems
+    return valid_days, remaining
+
+
 def generate_grocery_list_with_rest(api_key: str, meal_plan_dict: dict, language: str = "English"):
     """
-    Generates a grocery list string using Groq API based on dish names.
-    Returns a Markdown string or None on failure.
+    Generates a grocery list for the meal plan.
+    Returns a Markdown string; raises MealPlannerError on failure. See generate_grocery_data_with_rest.
     """
+    return generate_grocery_data_with_rest(api_key, meal_plan_dict, language)["markdown"]
+
+
+def generate_grocery_data_with_rest(api_key: str, meal_plan_dict: dict, language: str = "English"):
+    """
+    Builds the structured grocery list from the per-dish ingredient cache.
+    Only dishes missing from the cache go to Groq, all in one batched JSON request; the cached
+    decompositions are merged locally. Concurrent identical requests are coalesced onto a single call.
+    Returns {"categories": {...}, "missing_dishes": [...], "markdown": str}; raises MealPlannerError on failure.
+    """
+    key = canonical_request_key("grocery_list", api_key, meal_plan=meal_plan_dict, language=language)
+    return _inflight.do(key, lambda: _generate_grocery_data(api_key, meal_plan_dict, language))
+
+
+@usage_ledger.metered("grocery_list")
+def _generate_grocery_data(api_key: str, meal_plan_dict: dict, language: str = "English"):
+    """Uncoalesced grocery list generation; see generate_grocery_data_with_rest."""
     log.info("Entering generate_grocery_list_with_rest")
     if not api_key:
         log.error("API key is missing for generate_grocery_list_with_rest.")
-        st.error("Configuration error: API Key not provided.")
-        return None
+        raise ConfigurationError("Configuration error: API Key not provided.")
     if not meal_plan_dict or not isinstance(meal_plan_dict, dict):
         log.warning("Invalid or empty meal_plan_dict provided for grocery list.")
-        return None
+        raise InvalidRequestError("No meal plan provided for the grocery list.")
 
-    all_dishes = []
     try:
-        for day_key, day_content in meal_plan_dict.items():
-            if not isinstance(day_content, dict):
-                continue
-            for meal_type in ["breakfast", "lunch", "dinner", "snacks"]:
-                info = day_content.get(meal_type)
-                if isinstance(info, dict):
-                    suffix = ""
-                    i = 1
-                    while True:
-                        dish_key = f"dish_name{suffix}"
-                        if dish_key in info:
-                            dish_name = info.get(dish_key)
-                            if dish_name and isinstance(dish_name, str) and dish_name.strip():
-                                all_dishes.append(dish_name.strip())
-                            i += 1
-                            suffix = str(i)
-                        elif suffix == "" and "dish_name" in info:
-                            break
-                        elif suffix != "":
-                            break
-                        else:
-                            break
-                elif isinstance(info, list):
-                    for item in info:
-                        if isinstance(item, dict) and "dish_name" in item:
-                            dish_name = item.get("dish_name")
-                            if dish_name and isinstance(dish_name, str) and dish_name.strip():
-                                all_dishes.append(dish_name.strip())
-
-        if not all_dishes:
-            log.warning("No dish names extracted from meal plan for grocery list.")
-            st.warning("No dish names found in the plan to create a grocery list.")
-            return None
-
-        unique_dishes = sorted(list(set(filter(None, all_dishes))))
-        if not unique_dishes:
-            log.warning("Filtered dish list for grocery list is empty.")
-            st.warning("No valid dish names found to generate grocery list.")
-            return None
-
-        dishes_text = ", ".join(unique_dishes)
-        log.info(f"Generating grocery list for {len(unique_dishes)} unique dishes: {dishes_text[:200]}...")
-
-        prompt = f"""Act as a helpful shopping assistant. Based *only* on the following list of meal dishes planned for a week, generate a likely grocery list of ingredients needed.
-
-Dishes Planned:
-{dishes_text}
-
-Instructions for Grocery List:
-- List necessary ingredients to make these dishes in {language}.
-- Combine similar items. Estimate reasonable weekly quantities for one person (e.g., "Onions: 2-3", "Chicken Breast: 1.5 lbs / 700g").
-- Group ingredients into logical categories using Markdown H3 headings (### Category Name).
-- Exclude: salt, black pepper, water, basic vegetable/canola oil.
-- Format the output *only* as a Markdown list with bullet points (*) under category headings.
-- Do NOT include introductory or concluding sentences. Just the list."""
-
-        messages = [{"role": "user", "content": prompt}]
-        
-        log.info("Making API call for grocery list with model fallback...")
-        response, used_model = _call_groq_with_fallback(
-            api_key=api_key,
-            messages=messages,
-            temperature=0.3,
-            max_tokens=1500,
-            feature_name="grocery list generation"
+        decomposed = {"requested": 0, "error": None}
+
+        def decompose(dish_names):
+            # Cached dishes still make a (partial) list when the API call fails
+            decomposed["requested"] = len(dish_names)
+            try:
+                return decompose_dishes_with_rest(api_key, dish_names, language)
+            except UpstreamAPIError as e:
+                decomposed["error"] = e
+                return {}
+
+        grocery_data = grocery.build_grocery_list(meal_plan_dict, decompose=decompose, language=language)
+        if not grocery_data["categories"]:
+            log.warning("No ingredients could be resolved for the grocery list.")
+            if decomposed["error"] is not None:
+                raise decomposed["error"]
+            raise MealPlannerError("No dish names found in the plan to create a grocery list.")
+
+        grocery_data["markdown"] = grocery.render_grocery_markdown(grocery_data)
+        log.info(
+            f"Grocery list built locally; {decomposed['requested']} dishes needed decomposition, "
+            f"{len(grocery_data['missing_dishes'])} unresolved."
         )
-        log.info(f"Grocery List API Status Code: {response.status_code}")
-        log.info(f"Used model: {used_model}")
-        log.info(f"Grocery List Raw Response Text (first 500): {response.text[:500]}")
-
-        response.raise_for_status()
-
-        result_json = response.json()
-        if not result_json.get("choices"):
-            log.error("Grocery List Error: No 'choices' in response.")
-            st.error("❌ Grocery List Error: AI service did not provide a valid response.")
-            return None
 
+        log_entry = {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "function_called": "generate_grocery_list",
+            "input_context": {
+                "language": language,
+                "meal_plan_keys": list(meal_plan_dict.keys()),
+                "api_provider": "groq",
+                "dishes_decomposed": decomposed["requested"]
+            },
+            "raw_response_text": grocery_data["markdown"]
+        }
         try:
-            grocery_list_text = result_json["choices"][0]["message"]["content"]
-            log.info("Successfully extracted grocery list text.")
+            with open("api_log.jsonl", "a", encoding="utf-8") as f:
+                json.dump(log_entry, f)
+                f.write("\n")
+            log.info("Logged grocery list request/response")
+        except Exception as log_e:
+            log.error(f"Failed to log grocery list: {log_e}")
 
-            if grocery_list_text:
-                log_entry = {
-                    "timestamp": pd.Timestamp.now(tz='UTC').isoformat(),
-                    "function_called": "generate_grocery_list",
-                    "input_context": {
-                        "language": language,
-                        "meal_plan_keys": list(meal_plan_dict.keys()),
-                        "api_provider": "groq"
-                    },
-                    "raw_response_text": grocery_list_text
-                }
-                try:
-                    with open("api_log.jsonl", "a", encoding="utf-8") as f:
-                        json.dump(log_entry, f)
-                        f.write("\n")
-                    log.info("Logged grocery list request/response")
-                except Exception as log_e:
-                    log.error(f"Failed to log grocery list: {log_e}")
+        return grocery_data
 
-            grocery_list_text = re.sub(r"^```markdown\s*\n?", "", grocery_list_text, flags=re.IGNORECASE | re.MULTILINE)
-            grocery_list_text = re.sub(r"\n?```\s*$", "", grocery_list_text, flags=re.IGNORECASE | re.MULTILINE)
-            return grocery_list_text.strip()
-
-        except (KeyError, IndexError, TypeError) as e:
-            log.error(f"Grocery List Error: Could not extract text part: {e}")
-            st.error("❌ Grocery List Error: Could not process response from AI.")
-            log.error("Full API Response: %s", result_json)
-            return None
-
-    except requests.exceptions.HTTPError as e:
-        log.error(f"API HTTP Error (Grocery List): {e}")
-        _handle_groq_http_error(e, "Grocery list generation")
-        return None
-    except requests.exceptions.RequestException as e:
-        log.error(f"API Request Error (Grocery List): {e}")
-        st.error(f"❌ Network Error connecting to AI for grocery list ({e})")
-        return None
+    except MealPlannerError:
+        raise
     except Exception as e:
         log.exception("Unexpected error during grocery list generation.")
-        st.error(f"❌ Unexpected error creating grocery list: {e}")
-        return None
+        raise MealPlannerError(f"Unexpected error creating grocery list: {e}") from e
     finally:
         log.info("Exiting generate_grocery_list_with_rest")
+
+
+def decompose_dishes_with_rest(api_key: str, dish_names: list, language: str = "English",
+                               repair_attempts: int = STRUCTURED_OUTPUT_REPAIR_ATTEMPTS) -> dict:
+    """
+    Asks Groq for the ingredients of one serving of each dish, all in a single request.
+    Returns {dish_name: {"serving_grams": <number>, "ingredients": [{"name", "quantity", "unit", "category"}]}}
+    for the dishes the model answered; dishes missing from the reply are simply absent.
+    Results are cached per dish by grocery.build_grocery_list, so each dish is decomposed once.
+    Entries that fail schema validation are requested again on their own, up to repair_attempts times.
+    Raises UpstreamAPIError when Groq cannot be called; an unparseable reply returns {}.
+    """
+    if not api_key or not dish_names:
+        return {}
+    log.info(f"Decomposing {len(dish_names)} dishes into ingredients in one batch")
+
+    dishes_text = "\n".join(f"- {name}" for name in dish_names)
+    prompt = (
+        f"List the raw ingredients needed for ONE serving of each dish below, in {language}.\n\n"
+        f"Dishes:\n{dishes_text}\n\n"
+        f"Return ONLY valid JSON like:\n"
+        f"{{\"dishes\": [{{\"dish\": \"<dish name exactly as given>\", \"serving_grams\": 350, "
+        f"\"ingredients\": [{{\"name\": \"Chicken Breast\", \"quantity\": 150, \"unit\": \"g\", \"category\": \"Meat & Poultry\"}}]}}]}}\n"
+        f"- One entry per dish, using the dish name exactly as given\n"
+        f"- unit must be one of: g, ml, pcs\n"
+        f"- category must be one of: {', '.join(grocery.GROCERY_CATEGORIES)}\n"
+        f"- Exclude salt, black pepper and water"
+    )
+    messages = [{"role": "user", "content": prompt}]
+    max_tokens = _decomposition_tokens.max_tokens(len(dish_names))
+    try:
+        response, used_model = _call_groq_with_fallback(
+            api_key=api_key,
+            messages=messages,
+            temperature=0.2,
+            max_tokens=max_tokens,
+            feature_name="grocery list generation",
+            response_schema=("grocery_decomposition", structured_output.GROCERY_DECOMPOSITION_SCHEMA),
+        )
+        text_result, completion_tokens = _continue_truncated(
+            api_key, messages, response.json(), used_model, max_tokens, 0.2, "grocery list generation"
+        )
+        _decomposition_tokens.observe(len(dish_names), completion_tokens)
+        start_idx = text_result.find('{')
+        end_idx = text_result.rfind('}')
+        if start_idx == -1 or end_idx <= start_idx:
+            log.error(f"Dish decomposition returned no JSON: {text_result[:200]}")
+            return {}
+        entries = json.loads(text_result[start_idx:end_idx + 1]).get("dishes", [])
+    except UpstreamAPIError as e:
+        log.error(f"API error decomposing dishes: {e}")
+        raise
+    except (KeyError, IndexError, TypeError, ValueError, AttributeError) as e:
+        log.error(f"Could not parse dish decomposition: {e}")
+        return {}
+
+    # Map answers back onto the requested names; the model may alter case or punctuation
+    requested = {grocery.normalize_dish_name(name): name for name in dish_names}
+    results, invalid = {}, []
+    for entry in entries if isinstance(entries, list) else []:
+        if not isinstance(entry, dict):
+            continue
+        name = requested.get(grocery.normalize_dish_name(str(entry.get("dish", ""))))
+        if not name:
+            continue
+        error = structured_output.validate_dish_decomposition(entry)
+        if error:
+            log.info(f"Invalid decomposition for '{name}': {error}")
+            invalid.append(name)
+            continue
+        results[name] = {"serving_grams": entry.get("serving_grams"), "ingredients": entry["ingredients"]}
+    log.info(f"Decomposed {len(results)}/{len(dish_names)} dishes")
+
+    if invalid and repair_attempts > 0:
+        # Resend only the dishes whose entries were invalid, not the whole batch
+        results.update(decompose_dishes_with_rest(api_key, invalid, language, repair_attempts - 1))
+    return results
@@ -0,0 +1,185 @@
+import json
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from constants import JOB_WORKERS, JOB_HEARTBEAT_SECONDS, JOB_STALE_SECONDS
+from storage import open_db
+from errors import MealPlannerError
+
+log = logging.getLogger(__name__)
+
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+# Registered job kinds: kind -> callable(**params) returning a JSON-serializable result or None
+_JOB_HANDLERS = {}
+
+# One pool per process. Streamlit keeps imported modules alive across reruns,
+# so jobs keep running when the script that submitted them is rerun or abandoned.
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="meal-job")
+
+# Jobs of this process that are pending or running; the heartbeat thread keeps them fresh
+_active_jobs = set()
+_active_lock = threading.Lock()
+_heartbeat_thread = None
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    params TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, updated_at);
+"""
+_schema_ready = False
+
+
+def _ensure_schema(conn) -> None:
+    global _schema_ready
+    if not _schema_ready:
+        conn.executescript(_SCHEMA)
+        _schema_ready = True
+
+
+def register_job_handler(kind: str, handler) -> None:
+    """Registers the callable that executes jobs of the given kind."""
+    _JOB_HANDLERS[kind] = handler
+
+
+def _heartbeat() -> None:
+    """Refreshes updated_at of this process's unfinished jobs every JOB_HEARTBEAT_SECONDS."""
+    while True:
+        time.sleep(JOB_HEARTBEAT_SECONDS)
+        with _active_lock:
+            job_ids = list(_active_jobs)
+        if not job_ids:
+            continue
+        try:
+            with open_db() as conn:
+                conn.execute(
+                    f"UPDATE jobs SET updated_at = ? WHERE status IN (?, ?) AND job_id IN ({','.join('?' * len(job_ids))})",
+                    (time.time(), JOB_PENDING, JOB_RUNNING, *job_ids),
+                )
+        except Exception as e:
+            log.warning(f"Job heartbeat failed: {e}")
+
+
+def _ensure_heartbeat() -> None:
+    global _heartbeat_thread
+    with _active_lock:
+        if _heartbeat_thread is None:
+            _heartbeat_thread = threading.Thread(target=_heartbeat, name="meal-job-heartbeat", daemon=True)
+            _heartbeat_thread.start()
+
+
+def submit_job(kind: str, params: dict) -> str:
+    """
+    Records a new job and hands it to the worker pool.
+    Returns the job id immediately; poll get_job() for the result.
+    Params are persisted as JSON, so never pass secrets such as API keys here.
+    """
+    if kind not in _JOB_HANDLERS:
+        raise ValueError(f"No job handler registered for '{kind}'")
+
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    with open_db() as conn:
+        _ensure_schema(conn)
+        conn.execute(
+            "INSERT INTO jobs (job_id, kind, status, params, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, kind, JOB_PENDING, json.dumps(params), now, now),
+        )
+    log.info(f"Submitted {kind} job {job_id}")
+    _ensure_heartbeat()
+    with _active_lock:
+        _active_jobs.add(job_id)
+    _executor.submit(_run_job, job_id, kind, params)
+    return job_id
+
+
+def _update_job(job_id: str, status: str, result=None, error: str = None) -> None:
+    with open_db() as conn:
+        conn.execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE job_id = ?",
+            (status, json.dumps(result) if result is not None else None, error, time.time(), job_id),
+        )
+
+
+def _run_job(job_id: str, kind: str, params: dict) -> None:
+    """Worker entry point: runs the handler and persists its outcome."""
+    log.info(f"Running {kind} job {job_id}")
+    try:
+        _update_job(job_id, JOB_RUNNING)
+        result = _JOB_HANDLERS[kind](**params)
+        if result is None:
+            _update_job(job_id, JOB_FAILED, error=f"{kind} returned no result")
+        else:
+            _update_job(job_id, JOB_DONE, result=result)
+        log.info(f"Finished {kind} job {job_id}")
+    except MealPlannerError as e:
+        # Expected failure with a user-facing message; that message becomes the job's error
+        log.warning(f"Job {job_id} ({kind}) failed: {e.describe()}")
+        try:
+            _update_job(job_id, JOB_FAILED, error=e.describe()[:500])
+        except Exception as db_e:
+            log.error(f"Could not record failure of job {job_id}: {db_e}")
+    except Exception as e:
+        log.exception(f"Job {job_id} ({kind}) failed.")
+        try:
+            _update_job(job_id, JOB_FAILED, error=str(e)[:500])
+        except Exception as db_e:
+            log.error(f"Could not record failure of job {job_id}: {db_e}")
+    finally:
+        with _active_lock:
+            _active_jobs.discard(job_id)
+
+
+def get_job(job_id: str) -> dict:
+    """
+    Returns the job as a dict (job_id, kind, status, result, error, created_at, updated_at),
+    or None if the id is unknown. Unfinished jobs whose heartbeat stopped for JOB_STALE_SECONDS
+    (their worker process died) are reported as failed.
+    """
+    if not job_id:
+        return None
+    with open_db() as conn:
+        _ensure_schema(conn)
+        row = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+    if row is None:
+        return None
+
+    job = {
+        "job_id": row["job_id"],
+        "kind": row["kind"],
+        "status": row["status"],
+        "result": json.loads(row["result"]) if row["result"] else None,
+        "error": row["error"],
+        "created_at": row["created_at"],
+        "updated_at": row["updated_at"],
+    }
+    if job["status"] in (JOB_PENDING, JOB_RUNNING) and time.time() - job["updated_at"] > JOB_STALE_SECONDS:
+        job["status"] = JOB_FAILED
+        job["error"] = "Job stopped: its worker is no longer running."
+    return job
+
+
+def purge_jobs(older_than_seconds: float = 7 * 24 * 3600) -> int:
+    """Deletes finished jobs older than the given age. Returns the number removed."""
+    cutoff = time.time() - older_than_seconds
+    with open_db() as conn:
+        _ensure_schema(conn)
+        cur = conn.execute(
+            "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+            (JOB_DONE, JOB_FAILED, cutoff),
+        )
+    return cur.rowcount
@@ -0,0 +1,274 @@
+"""
+Canonical, typed representation of a meal plan.
+
+LLM plans arrive in several shapes: wrapped in {"meal_plan": ...} or not, days as a dict or a list,
+snacks as "snack1"/"snack2" keys, a "snacks" dict or list, extra dishes under "dish_name2",
+nutrition nested or flat, numbers as strings with units, or the compact row format (see
+COMPACT_COLUMNS) the planner prompts for. normalize_meal_plan() turns any of them
+into MealPlan/DayPlan/Meal objects in a single traversal, collecting problems as it goes, and every
+consumer (rendering, validation, grocery, calibration, evaluation) reads that structure instead of
+walking the raw dict.
+"""
+
+import re
+from dataclasses import dataclass, field
+
+import numpy as np
+
+import meal_utils as utils
+
+NUTRIENT_KEYS = ("calories", "protein", "carbs", "fat")
+MAIN_MEALS = ("breakfast", "lunch", "dinner")
+# Compact wire format: {"days": {"dayN": [[meal, dish, grams, kcal, protein, carbs, fat], ...]}}.
+# One row per meal instead of a nested dict repeating every key, so the LLM emits about half the tokens.
+COMPACT_COLUMNS = ("meal", "dish", "grams", "kcal", "protein", "carbs", "fat")
+
+
+@dataclass(slots=True)
+class Meal:
+    meal_key: str          # key as emitted, e.g. "snack2"
+    meal_type: str         # breakfast, lunch, dinner, snack or other
+    dish_name: str
+    portion_grams: float
+    calories: float
+    protein: float
+    carbs: float
+    fat: float
+    data_source: str = "AI"
+    extra_dishes: list = field(default_factory=list)  # further dish_name2, dish_name3... sharing this meal's nutrition
+    ingredients: list = None
+    source: dict = field(default=None, repr=False)  # the raw meal dict, for in-place rewrites
+
+    def nutrients(self) -> tuple:
+        return (self.calories, self.protein, self.carbs, self.fat)
+
+
+@dataclass(slots=True)
+class DayPlan:
+    day_key: str
+    day_number: int
+    meals: list
+
+    def totals(self) -> dict:
+        return {k: sum(getattr(m, k) for m in self.meals) for k in NUTRIENT_KEYS}
+
+
+@dataclass(slots=True)
+class MealPlan:
+    days: list
+    issues: list
+
+    def meals(self):
+        for day in self.days:
+            yield from day.meals
+
+    def dish_names(self) -> list:
+        return [name for m in self.meals() for name in (m.dish_name, *m.extra_dishes)]
+
+    def unique_dish_names(self) -> list:
+        return sorted(set(self.dish_names()))
+
+    def nutrient_matrix(self):
+        """Returns a (days, max meals, 4) array of (calories, protein, carbs, fat) and a boolean meal mask."""
+        width = max((len(d.meals) for d in self.days), default=0)
+        values = np.zeros((len(self.days), width, len(NUTRIENT_KEYS)))
+        mask = np.zeros((len(self.days), width), dtype=bool)
+        for d, day in enumerate(self.days):
+            for m, meal in enumerate(day.meals):
+                values[d, m] = meal.nutrients()
+                mask[d, m] = True
+        return values, mask
+
+    def to_dict(self) -> dict:
+        """Canonical {"dayN": {meal_key: {...}}} dictionary."""
+        plan = {}
+        for day in self.days:
+            day_dict = {}
+            for meal in day.meals:
+                meal_dict = {
+                    "dish_name": meal.dish_name,
+                    "portion_grams": meal.portion_grams,
+                    "nutrition": {k: getattr(meal, k) for k in NUTRIENT_KEYS},
+                    "data_source": meal.data_source,
+                }
+                for position, extra in enumerate(meal.extra_dishes, start=2):
+                    meal_dict[f"dish_name{position}"] = extra
+                if meal.ingredients:
+                    meal_dict["ingredients"] = meal.ingredients
+                day_dict[meal.meal_key] = meal_dict
+            plan[day.day_key] = day_dict
+        return plan
+
+
+_DISH_KEY_RE = re.compile(r"^dish_name(\d*)$")
+_DAY_NUMBER_RE = re.compile(r"\d+")
+
+
+def _meal_type(meal_key: str) -> str:
+    key = meal_key.lower()
+    if key in MAIN_MEALS:
+        return key
+    if key.startswith("snack"):
+        return "snack"
+    return "other"
+
+
+def _number(container: dict, key: str) -> float:
+    """Reads a number that may be stored as key or estimated_key, possibly as a string with units."""
+    value = container.get(key, container.get(f"estimated_{key}", 0))
+    return float(utils.extract_num(value))
+
+
+def _add_meal(meals: list, issues: list, where: str, meal_key: str, info: dict) -> None:
+    """Appends the Meal described by one raw meal dict."""
+    nutrition = info.get("nutrition")
+    if not isinstance(nutrition, dict):
+        nutrition = info  # flat layout: calories etc. next to dish_name
+    names = [
+        info[k].strip()
+        for k in sorted((k for k in info if _DISH_KEY_RE.match(k)), key=lambda k: int(k[9:] or 1))
+        if isinstance(info[k], str) and info[k].strip()
+    ]
+    if not names:
+        issues.append(f"{where}: no dish_name")
+        return
+
+    meal = Meal(
+        meal_key=meal_key,
+        meal_type=_meal_type(meal_key),
+        dish_name=names[0],
+        portion_grams=float(utils.extract_num(info.get("portion_grams", 0))),
+        calories=_number(nutrition, "calories"),
+        protein=_number(nutrition, "protein"),
+        carbs=_number(nutrition, "carbs"),
+        fat=_number(nutrition, "fat"),
+        data_source=str(info.get("data_source", "AI")),
+        extra_dishes=names[1:],
+        ingredients=info["ingredients"] if isinstance(info.get("ingredients"), list) else None,
+        source=info,
+    )
+    if meal.calories <= 0:
+        issues.append(f"{where}: missing calories")
+    meals.append(meal)
+
+
+def _compact_days(raw):
+    """The day container of a compact plan ({"days": ...} or {"meal_plan": ...}), or None if raw is not one."""
+    if not isinstance(raw, dict):
+        return None
+    days = raw.get("days", raw.get("meal_plan"))
+    if isinstance(days, dict):
+        rows_per_day = list(days.values())
+    elif isinstance(days, list):
+        rows_per_day = days
+    else:
+        return None
+    is_compact = rows_per_day and all(
+        isinstance(rows, list) and all(isinstance(row, list) for row in rows) for rows in rows_per_day
+    )
+    return days if is_compact else None
+
+
+def is_compact_plan(raw) -> bool:
+    """True if raw is in the compact row format (see COMPACT_COLUMNS)."""
+    return _compact_days(raw) is not None
+
+
+def expand_compact_plan(raw, issues: list = None) -> dict:
+    """
+    Expands a compact plan into the regular {"dayN": {meal_key: {"dish_name", "portion_grams",
+    "nutrition", "data_source"}}} dictionary. Days given as a list are numbered in order; repeated
+    meal names get numbered keys (snack1, snack2, lunch2). Malformed rows are skipped and listed in issues.
+    """
+    issues = issues if issues is not None else []
+    days = _compact_days(raw)
+    if days is None:
+        issues.append("plan is not in the compact row format")
+        return {}
+    day_items = days.items() if isinstance(days, dict) else ((f"day{n}", rows) for n, rows in enumerate(days, start=1))
+
+    plan = {}
+    for day_key, rows in day_items:
+        day, seen = {}, {}
+        snack_count = sum(1 for row in rows if row and str(row[0]).strip().lower().startswith("snack"))
+        for position, row in enumerate(rows, start=1):
+            if len(row) < len(COMPACT_COLUMNS) or not isinstance(row[1], str) or not row[1].strip():
+                issues.append(f"{day_key}[{position}]: expected {len(COMPACT_COLUMNS)} values {list(COMPACT_COLUMNS)}")
+                continue
+            meal_name = re.sub(r"\W+", "_", str(row[0]).strip().lower()).strip("_") or "meal"
+            if meal_name.startswith("snack"):
+                meal_name = "snack"
+            seen[meal_name] = seen.get(meal_name, 0) + 1
+            if meal_name == "snack" and snack_count > 1:
+                meal_key = f"snack{seen[meal_name]}"
+            else:
+                meal_key = meal_name if seen[meal_name] == 1 else f"{meal_name}{seen[meal_name]}"
+            grams, kcal, protein, carbs, fat = (float(utils.extract_num(v)) for v in row[2:7])
+            day[meal_key] = {
+                "dish_name": row[1].strip(),
+                "portion_grams": grams,
+                "nutrition": {"calories": kcal, "protein": protein, "carbs": carbs, "fat": fat},
+                "data_source": "AI",
+            }
+        plan[str(day_key)] = day
+    return plan
+
+
+def normalize_day(day_key: str, day_content, issues: list = None) -> DayPlan:
+    """Normalizes one day's raw content into a DayPlan."""
+    issues = issues if issues is not None else []
+    match = _DAY_NUMBER_RE.search(str(day_key))
+    day = DayPlan(day_key=str(day_key), day_number=int(match.group()) if match else 0, meals=[])
+    if not isinstance(day_content, dict):
+        issues.append(f"{day_key}: not a dictionary")
+        return day
+
+    for meal_key, info in day_content.items():
+        where = f"{day_key}.{meal_key}"
+        if isinstance(info, dict) and any(_DISH_KEY_RE.match(k) for k in info):
+            _add_meal(day.meals, issues, where, meal_key, info)
+        elif isinstance(info, dict):
+            # A container such as "snacks": {"snack1": {...}, "snack2": {...}}
+            for sub_key, sub_info in info.items():
+                if isinstance(sub_info, dict):
+                    _add_meal(day.meals, issues, f"{where}.{sub_key}", sub_key, sub_info)
+        elif isinstance(info, list):
+            singular = "snack" if meal_key.lower().startswith("snack") else meal_key
+            for position, item in enumerate(info, start=1):
+                if isinstance(item, dict):
+                    _add_meal(day.meals, issues, f"{where}[{position}]", f"{singular}{position}", item)
+        # Scalars such as "daily_nutrition" totals or notes are not meals
+
+    present = {m.meal_type for m in day.meals}
+    for meal_type in MAIN_MEALS:
+        if meal_type not in present:
+            issues.append(f"{day_key}: no {meal_type}")
+    return day
+
+
+def normalize_meal_plan(raw) -> MealPlan:
+    """
+    Converts any supported raw plan variant into a MealPlan with days sorted by day number.
+    Problems found along the way are listed in MealPlan.issues; an unusable input yields an empty plan.
+    """
+    issues = []
+    if is_compact_plan(raw):
+        raw = expand_compact_plan(raw, issues)
+    if isinstance(raw, dict) and "meal_plan" in raw:
+        raw = raw["meal_plan"]
+
+    if isinstance(raw, dict):
+        day_items = list(raw.items())
+    elif isinstance(raw, list):
+        day_items = []
+        for position, entry in enumerate(raw, start=1):
+            if isinstance(entry, dict):
+                number = entry.get("day", position)
+                meals = entry.get("meals", {k: v for k, v in entry.items() if k != "day"})
+                day_items.append((f"day{utils.format_number(number)}", meals))
+    else:
+        return MealPlan(days=[], issues=["plan is neither a dictionary nor a list"])
+
+    days = [normalize_day(day_key, content, issues) for day_key, content in day_items]
+    days.sort(key=lambda d: d.day_number)
+    return MealPlan(days=days, issues=issues)
@@ -0,0 +1,225 @@
+"""
+Deterministic meal planner that assembles plans from the local nutrition dataset without an LLM.
+
+Each meal is a small combination of foods (e.g. protein + carb + vegetable) picked from the
+dataset after restriction and dislike filtering. Portions are then solved with a bounded least
+squares fit against the meal's calorie share and the goal's macro split, and finally each day is
+rescaled onto the exact calorie target. A 7-day plan takes a few milliseconds on CPU.
+"""
+
+import hashlib
+import logging
+import random
+
+import numpy as np
+
+import meal_utils as utils
+
+log = logging.getLogger(__name__)
+
+# Share of the daily calories per meal slot
+MEAL_CALORIE_SHARES = {"breakfast": 0.25, "lunch": 0.32, "dinner": 0.30, "snack": 0.13}
+# Below this target a single snack is planned, above it the snack share is split over two
+TWO_SNACK_THRESHOLD = 2000
+
+# Role pattern per meal slot; roles with no remaining candidates are skipped
+MEAL_PATTERNS = {
+    "breakfast": ["protein", "carb", "fruit"],
+    "lunch": ["protein", "carb", "veg"],
+    "dinner": ["protein", "carb", "veg"],
+    "snack": ["snack"],
+}
+# Low-carb meals swap the starch for a second vegetable or a fat source
+LOW_CARB_PATTERNS = {
+    "breakfast": ["protein", "fat", "fruit"],
+    "lunch": ["protein", "veg", "fat"],
+    "dinner": ["protein", "veg", "veg"],
+    "snack": ["snack"],
+}
+# Low-carb plans drop foods that get more than this share of their calories from carbs (beans,
+# lentils, grains, fruit); vegetables are kept, their carbs are low per portion
+LOW_CARB_MAX_CARB_ENERGY = 0.4
+_LOW_CARB_EXEMPT_ROLES = {"veg"}
+
+# Portion bounds in grams per role
+PORTION_BOUNDS = {
+    "protein": (60, 300),
+    "carb": (40, 350),
+    "veg": (50, 250),
+    "fruit": (50, 250),
+    "fat": (10, 60),
+    "snack": (15, 300),
+}
+
+# Weight of the calorie term relative to each macro term in the portion fit
+_CALORIE_WEIGHT = 3.0
+_COLUMN_ALIASES = {
+    "calories": ["calories", "energy", "kcal"],
+    "protein": ["protein"],
+    "carbs": ["carbohydrate", "carbohydrates", "carbs"],
+    "fat": ["total_fat", "fat"],
+}
+
+
+def _prepare_foods(df):
+    """Normalizes dataset columns to name/role/meal_slots plus per-gram nutrient values."""
+    columns = {c.lower(): c for c in df.columns}
+    foods = []
+    for _, row in df.iterrows():
+        food = {
+            "name": str(row[columns["name"]]).strip(),
+            "role": str(row[columns["role"]]).strip() if "role" in columns else "protein",
+            "slots": set(str(row[columns["meal_slots"]]).split(";")) if "meal_slots" in columns else set(MEAL_PATTERNS),
+        }
+        for key, aliases in _COLUMN_ALIASES.items():
+            column = next((columns[a] for a in aliases if a in columns), None)
+            food[key] = utils.extract_num(row[column]) / 100.0 if column else 0.0
+        if food["calories"] > 0:
+            foods.append(food)
+    return foods
+
+
+def _candidates(foods, slot, role):
+    if role == "snack":
+        return [f for f in foods if "snack" in f["slots"]]
+    return [f for f in foods if f["role"] == role and slot in f["slots"]]
+
+
+def _solve_portions(components, roles, calorie_target, macro_split):
+    """
+    Fits gram amounts for the meal's components to the calorie target and macro split,
+    within each role's portion bounds. Returns an array of grams.
+    """
+    # Rows: calories, protein kcal, carb kcal, fat kcal (all per gram), so every term is in kcal
+    A = np.array([
+        [c["calories"] for c in components],
+        [c["protein"] * 4 for c in components],
+        [c["carbs"] * 4 for c in components],
+        [c["fat"] * 9 for c in components],
+    ])
+    b = np.array([calorie_target, *(calorie_target * share for share in macro_split)])
+    weights = np.array([_CALORIE_WEIGHT, 1.0, 1.0, 1.0])[:, None]
+
+    lower = np.array([PORTION_BOUNDS[r][0] for r in roles], dtype=float)
+    upper = np.array([PORTION_BOUNDS[r][1] for r in roles], dtype=float)
+    grams, *_ = np.linalg.lstsq(A * weights, b * weights[:, 0], rcond=None)
+    grams = np.clip(grams, lower, upper)
+
+    # Pull the meal onto its calorie share; the bounds win if they conflict
+    meal_calories = A[0] @ grams
+    if meal_calories > 0:
+        grams = np.clip(grams * (calorie_target / meal_calories), lower, upper)
+    return grams
+
+
+def _dish_name(slot, picked):
+    names = [f["name"] for f in picked]
+    if slot == "breakfast" and len(names) == 3:
+        return f"{names[0]} with {names[1]} and {names[2]}"
+    if len(names) == 1:
+        return names[0]
+    return f"{names[0]} with {' and '.join(names[1:])}"
+
+
+def _build_meal(slot, picked, roles, calorie_target, macro_split):
+    grams = _solve_portions(picked, roles, calorie_target, macro_split)
+    grams = np.maximum(np.round(grams), 1)
+    nutrition = {
+        key: float(sum(f[key] * g for f, g in zip(picked, grams)))
+        for key in ("calories", "protein", "carbs", "fat")
+    }
+    return {
+        "dish_name": _dish_name(slot, picked),
+        "portion_grams": int(grams.sum()),
+        "nutrition": {
+            "calories": round(nutrition["calories"]),
+            "protein": round(nutrition["protein"], 1),
+            "carbs": round(nutrition["carbs"], 1),
+            "fat": round(nutrition["fat"], 1),
+        },
+        "data_source": "Nutrition dataset",
+        "ingredients": [{"name": f["name"], "grams": int(g)} for f, g in zip(picked, grams)],
+    }
+
+
+def _pick(candidates, used_recently, favorites, rng):
+    """Picks a candidate, preferring favourites and foods not used in the last few meals."""
+    fresh = [c for c in candidates if c["name"] not in used_recently] or candidates
+    liked = [c for c in fresh if utils.mentions_any(c["name"], favorites)]
+    pool = liked if liked and rng.random() < 0.6 else fresh
+    return rng.choice(pool)
+
+
+def generate_meal_plan_locally(calorie_target: int, preferences: dict, days: int = 7, foods_df=None):
+    """
+    Builds a plan { "day1": {...}, ... } in the same schema as the LLM planners, from the nutrition
+    dataset (load_nutrition_data() by default). Returns None if the dataset is unavailable or the
+    restrictions/dislikes leave no food for some meal.
+    Output is deterministic for a given target and preference set.
+    """
+    if not calorie_target:
+        return None
+    preferences = preferences or {}
+    if foods_df is None:
+        foods_df = utils.load_nutrition_data()
+    if foods_df is None or len(foods_df) == 0:
+        log.error("Local meal planner: nutrition dataset unavailable.")
+        return None
+
+    restrictions = preferences.get("restrictions") or []
+    dislikes = utils.split_food_list(preferences.get("dislikes"))
+    favorites = utils.split_food_list(preferences.get("favorites"))
+    foods = [
+        f for f in _prepare_foods(foods_df)
+        if not utils.find_restriction_violations(f["name"], restrictions)
+        and not (dislikes and utils.mentions_any(f["name"], dislikes))
+    ]
+
+    if "Low Carb" in restrictions:
+        foods = [
+            f for f in foods
+            if f["role"] in _LOW_CARB_EXEMPT_ROLES or f["carbs"] * 4 <= f["calories"] * LOW_CARB_MAX_CARB_ENERGY
+        ]
+    patterns = LOW_CARB_PATTERNS if "Low Carb" in restrictions else MEAL_PATTERNS
+    macro_split = utils.macro_split_for(preferences)
+
+    slots = ["breakfast", "lunch", "dinner"]
+    snack_keys = ["snack1", "snack2"] if calorie_target >= TWO_SNACK_THRESHOLD else ["snack1"]
+    slot_calories = {slot: calorie_target * MEAL_CALORIE_SHARES[slot] for slot in slots}
+    for key in snack_keys:
+        slot_calories[key] = calorie_target * MEAL_CALORIE_SHARES["snack"] / len(snack_keys)
+
+    seed_text = f"{calorie_target}|{sorted(restrictions)}|{dislikes}|{favorites}|{preferences.get('goal')}"
+    rng = random.Random(hashlib.sha256(seed_text.encode("utf-8")).hexdigest())
+
+    plan = {}
+    recent = {}  # role -> names used in the last few meals, for variety
+    for day_number in range(1, days + 1):
+        day = {}
+        for meal_key in slots + snack_keys:
+            slot = "snack" if meal_key.startswith("snack") else meal_key
+            picked, roles = [], []
+            for role in patterns[slot]:
+                candidates = [c for c in _candidates(foods, slot, role) if c not in picked]
+                if not candidates:
+                    continue
+                used = recent.setdefault(role, [])
+                choice = _pick(candidates, used[-4:], favorites, rng)
+                used.append(choice["name"])
+                picked.append(choice)
+                roles.append(role)
+            if not picked:
+                log.warning(f"Local meal planner: no foods left for {meal_key} with {restrictions} / dislikes {dislikes}")
+                return None
+            day[meal_key] = _build_meal(slot, picked, roles, slot_calories[meal_key], macro_split)
+
+        # Close the remaining gap to the exact daily target by scaling the whole day
+        day_calories = sum(m["nutrition"]["calories"] for m in day.values())
+        if day_calories > 0 and abs(day_calories - calorie_target) > 1:
+            factor = calorie_target / day_calories
+            for meal in day.values():
+                utils.scale_meal(meal, factor)
+        plan[f"day{day_number}"] = day
+
+    log.info(f"Local meal planner built a {days}-day plan for {calorie_target} kcal")
+    return plan
@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+"""
+Precomputed meal plan template library.
+
+Offline, build_template_library() generates and validates plans over a grid of goals x calorie
+buckets x restriction sets and stores them in a compact, indexed gzip JSON file. Online,
+find_template_plan() picks the nearest template built for the profile's goal (so its macro split matches), filters it by dislikes/favorites and rescales portions
+to the exact calorie target, so common profiles are served without an LLM call.
+
+Build the library with:  python meal_templates.py --api-key $GROQ_API_KEY
+"""
+
+import os
+import gzip
+import json
+import bisect
+import logging
+import argparse
+from functools import lru_cache
+
+import meal_utils as utils
+import rate_limiter
+from constants import TEMPLATE_LIBRARY_PATH, TEMPLATE_MAX_CALORIE_GAP, MACRO_SPLITS
+from errors import MealPlannerError, ConfigurationError, AuthenticationError
+from meal_plan_schema import normalize_meal_plan
+
+log = logging.getLogger(__name__)
+
+LIBRARY_VERSION = 2  # 2: templates per goal
+
+GOALS = list(MACRO_SPLITS)
+DEFAULT_GOAL = "Maintain Weight"  # the planners' goal when preferences name none
+CALORIE_BUCKETS = list(range(1200, 4001, 200))
+RESTRICTION_SETS = [
+    [],
+    ["Vegetarian"],
+    ["Vegan"],
+    ["Gluten-Free"],
+    ["Dairy-Free"],
+    ["Nut-Free"],
+    ["Low Carb"],
+    ["Gluten-Free", "Vegetarian"],
+    ["Dairy-Free", "Gluten-Free"],
+    ["Gluten-Free", "Vegan"],
+    ["Low Carb", "Vegetarian"],
+]
+# Generated days may miss their bucket by this fraction; they are rescaled onto it before storage
+BUILD_MAX_CALORIE_GAP = 0.4
+
+
+def restriction_key(restrictions) -> str:
+    """Canonical index key for a restriction set."""
+    return "|".join(sorted(set(restrictions or [])))
+
+
+def validate_template_plan(plan: dict, calorie_target: int, restrictions: list) -> list:
+    """Returns a list of problems that make a generated plan unfit for the library (empty if valid)."""
+    if not isinstance(plan, dict):
+        return ["plan is not a dictionary"]
+    normalized = normalize_meal_plan(plan)
+    problems = list(normalized.issues)  # unreadable meals, missing calories, missing breakfast/lunch/dinner
+    days = {day.day_number: day for day in normalized.days}
+    for day_number in range(1, 8):
+        day = days.get(day_number)
+        if day is None:
+            problems.append(f"day{day_number} missing")
+            continue
+        for meal in day.meals:
+            if meal.protein <= 0:
+                problems.append(f"day{day_number}.{meal.meal_key} has missing protein")
+            violations = utils.find_restriction_violations(" ".join([meal.dish_name, *meal.extra_dishes]), restrictions)
+            if violations:
+                problems.append(f"day{day_number}.{meal.meal_key} violates {violations}")
+        day_calories = day.totals()["calories"]
+        if abs(day_calories - calorie_target) > calorie_target * BUILD_MAX_CALORIE_GAP:
+            problems.append(f"day{day_number} totals {day_calories:.0f} kcal, far from {calorie_target}")
+    return problems
+
+
+def rescale_plan_days(plan: dict, calorie_target: int) -> dict:
+    """Scales every day's portions in place so its calories sum to calorie_target."""
+    for day in normalize_meal_plan(plan).days:
+        day_calories = day.totals()["calories"]
+        if day_calories > 0:
+            for meal in day.meals:
+                utils.scale_meal(meal.source, calorie_target / day_calories)
+    return plan
+
+
+def _encode_plan(plan: dict, dishes: dict, meal_keys: dict, sources: dict) -> list:
+    """Encodes a plan as per-day rows [meal_idx, dish_idx, grams, kcal, protein, carbs, fat, source_idx]."""
+    days = []
+    for day in normalize_meal_plan(plan).days[:7]:
+        days.append([
+            [
+                meal_keys.setdefault(meal.meal_key, len(meal_keys)),
+                dishes.setdefault(meal.dish_name, len(dishes)),
+                meal.portion_grams,
+                *meal.nutrients(),
+                sources.setdefault(meal.data_source, len(sources)),
+            ]
+            for meal in day.meals
+        ])
+    return days
+
+
+def save_template_library(entries: list, path: str = TEMPLATE_LIBRARY_PATH) -> None:
+    """
+    Writes validated templates to the compact library file.
+    entries: list of {"goal": str, "calories": int, "restrictions": [...], "plan": {"day1": {...}, ...}}.
+    """
+    dishes, meal_keys, sources = {}, {}, {}
+    templates = []
+    index = {}
+    for entry in entries:
+        templates.append({
+            "goal": entry["goal"],
+            "calories": entry["calories"],
+            "restrictions": sorted(entry["restrictions"]),
+            "days": _encode_plan(entry["plan"], dishes, meal_keys, sources),
+        })
+        by_restrictions = index.setdefault(entry["goal"], {})
+        by_restrictions.setdefault(restriction_key(entry["restrictions"]), []).append([entry["calories"], len(templates) - 1])
+    for by_restrictions in index.values():
+        for bucket_list in by_restrictions.values():
+            bucket_list.sort()
+
+    library = {
+        "version": LIBRARY_VERSION,
+        "dishes": list(dishes),
+        "meal_keys": list(meal_keys),
+        "sources": list(sources),
+        "templates": templates,
+        "index": index,
+    }
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        json.dump(library, f, separators=(",", ":"))
+    log.info(f"Saved {len(templates)} meal plan templates to {path}")
+
+
+@lru_cache(maxsize=4)
+def _load_library(path: str, mtime: float):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        library = json.load(f)
+    if library.get("version") != LIBRARY_VERSION:
+        log.warning(f"Ignoring template library {path} with unsupported version {library.get('version')}")
+        return None
+    # Join each template's dish names once so preference filtering is a single text scan per template
+    library["dish_text"] = [
+        " | ".join(library["dishes"][row[1]].lower() for day in t["days"] for row in day)
+        for t in library["templates"]
+    ]
+    library["sorted_index"] = {
+        goal: {
+            key: ([bucket for bucket, _ in entries], [idx for _, idx in entries])
+            for key, entries in by_restrictions.items()
+        }
+        for goal, by_restrictions in library["index"].items()
+    }
+    return library
+
+
+def load_template_library(path: str = TEMPLATE_LIBRARY_PATH):
+    """Returns the decoded library (cached per file version) or None if it is missing or unreadable."""
+    try:
+        return _load_library(path, os.path.getmtime(path))
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        log.error(f"Failed to load template library {path}: {e}")
+        return None
+
+
+def _decode_template(library: dict, template_idx: int) -> dict:
+    template = library["templates"][template_idx]
+    plan = {}
+    for day_number, rows in enumerate(template["days"], start=1):
+        day = {}
+        for meal_idx, dish_idx, grams, calories, protein, carbs, fat, source_idx in rows:
+            day[library["meal_keys"][meal_idx]] = {
+                "dish_name": library["dishes"][dish_idx],
+                "portion_grams": grams,
+                "nutrition": {"calories": calories, "protein": protein, "carbs": carbs, "fat": fat},
+                "data_source": library["sources"][source_idx],
+            }
+        plan[f"day{day_number}"] = day
+    return plan
+
+
+def find_template_plan(calorie_target: int, preferences: dict, path: str = TEMPLATE_LIBRARY_PATH):
+    """
+    Returns a plan { "day1": {...}, ... } adapted from the nearest library template,
+    or None when no template fits (the caller should then fall back to the LLM).
+    Only templates built for the requested goal are used; templates built for a superset of the
+    requested restrictions are acceptable.
+    """
+    library = load_template_library(path)
+    if not library or not calorie_target:
+        return None
+
+    goal = (preferences or {}).get("goal") or DEFAULT_GOAL
+    wanted = set((preferences or {}).get("restrictions") or [])
+    dislikes = utils.split_food_list((preferences or {}).get("dislikes"))
+    favorites = utils.split_food_list((preferences or {}).get("favorites"))
+    max_gap = calorie_target * TEMPLATE_MAX_CALORIE_GAP
+
+    best = None
+    for key, (buckets, template_ids) in library["sorted_index"].get(goal, {}).items():
+        key_set = set(key.split("|")) if key else set()
+        if not wanted <= key_set:
+            continue
+        lo = bisect.bisect_left(buckets, calorie_target - max_gap)
+        hi = bisect.bisect_right(buckets, calorie_target + max_gap)
+        for bucket, template_idx in zip(buckets[lo:hi], template_ids[lo:hi]):
+            dish_text = library["dish_text"][template_idx]
+            if dislikes and utils.mentions_any(dish_text, dislikes):
+                continue
+            rank = (
+                -len(utils.mentions_any(dish_text, favorites)),
+                len(key_set - wanted),
+                abs(bucket - calorie_target),
+            )
+            if best is None or rank < best[0]:
+                best = (rank, template_idx)
+
+    if best is None:
+        log.info(f"No meal plan template fits {goal}, {calorie_target} kcal with restrictions {sorted(wanted)}")
+        return None
+
+    plan = rescale_plan_days(_decode_template(library, best[1]), calorie_target)
+    log.info(f"Serving meal plan from template #{best[1]} for {calorie_target} kcal")
+    return plan
+
+
+def build_template_library(api_key: str, path: str = TEMPLATE_LIBRARY_PATH,
+                           calorie_buckets: list = None, restriction_sets: list = None,
+                           attempts: int = 2, goals: list = None) -> int:
+    """
+    Generates, validates and stores a template for every goal x calorie bucket x restriction set.
+    Each cell gets up to `attempts` generations; cells that never validate are left out.
+    Returns the number of templates written.
+    """
+    import groq_api  # Only the offline builder needs the LLM client
+
+    entries = []
+    # Batch work: yields rate limit capacity to interactive app requests
+    with rate_limiter.priority(rate_limiter.BATCH):
+        for goal in goals or GOALS:
+            for restrictions in restriction_sets or RESTRICTION_SETS:
+                for calories in calorie_buckets or CALORIE_BUCKETS:
+                    preferences = {"goal": goal, "restrictions": restrictions, "favorites": "", "dislikes": ""}
+                    cell = f"{goal} {calories} kcal {restrictions}"
+                    for attempt in range(1, attempts + 1):
+                        try:
+                            plan = groq_api.generate_meal_plan_with_rest(api_key, calories, preferences)
+                        except (ConfigurationError, AuthenticationError):
+                            raise  # would fail every remaining cell too
+                        except MealPlannerError as e:
+                            log.warning(f"Template {cell} attempt {attempt} failed: {e}")
+                            continue
+                        problems = validate_template_plan(plan, calories, restrictions)
+                        if not problems:
+                            plan = rescale_plan_days(plan, calories)
+                            entries.append({"goal": goal, "calories": calories, "restrictions": restrictions, "plan": plan})
+                            break
+                        log.warning(f"Template {cell} attempt {attempt} rejected: {problems[:3]}")
+
+    save_template_library(entries, path)
+    return len(entries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the precomputed meal plan template library.")
+    parser.add_argument("--api-key", default=os.getenv("GROQ_API_KEY") or os.getenv("groq_api_key"))
+    parser.add_argument("--output", default=TEMPLATE_LIBRARY_PATH)
+    parser.add_argument("--buckets", help="Comma-separated calorie buckets (default: 1200-4000 step 200)")
+    parser.add_argument("--goals", help=f"Comma-separated goals (default: {','.join(GOALS)})")
+    args = parser.parse_args()
+
+    if not args.api_key:
+        raise SystemExit("A Groq API key is required (--api-key or GROQ_API_KEY).")
+    buckets = [int(b) for b in args.buckets.split(",")] if args.buckets else None
+    goals = [goal.strip() for goal in args.goals.split(",")] if args.goals else None
+    if goals and not set(goals) <= set(GOALS):
+        raise SystemExit(f"Unknown goal; choose from {GOALS}.")
+    count = build_template_library(args.api_key, args.output, calorie_buckets=buckets, goals=goals)
+    print(f"Wrote {count} templates to {args.output}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()
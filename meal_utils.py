@@ -1,8 +1,10 @@
 
 import re
 import logging
-import pandas as pd
-import streamlit as st # Needed only for the @st.cache_data decorator
+from functools import lru_cache
+
+from constants import RESTRICTION_KEYWORDS, RESTRICTION_ALLOWED_PHRASES, MACRO_SPLITS, LOW_CARB_MACRO_SPLIT
+import meal_plan_schema
 
 log = logging.getLogger(__name__)
 
@@ -25,6 +27,8 @@ def format_number(val):
 
 def estimate_grams(portion):
     """Provides a rough gram estimate based on common portion descriptions."""
+    if isinstance(portion, (int, float)) and not isinstance(portion, bool):
+        return f"{round(portion)}g" if portion > 0 else "N/A"
     portion_str = str(portion).lower()
     # Check for explicit grams first
     match = re.search(r"(\d+)\s*g", portion_str)
@@ -40,6 +44,54 @@ def estimate_grams(portion):
     # Return original string if no estimate matched
     return str(portion) # Return original if no rule matches
 
+def split_food_list(value):
+    """Turns a comma-separated preference string (or list) into lower-cased, stripped terms."""
+    if isinstance(value, str):
+        value = value.split(",")
+    return [str(v).strip().lower() for v in (value or []) if str(v).strip()]
+
+def mentions_any(text, terms):
+    """Returns the terms that appear in text as whole words (case-insensitive)."""
+    text = str(text).lower()
+    return [t for t in terms if re.search(rf"\b{re.escape(t)}\b", text)]
+
+def find_restriction_violations(dish_name, restrictions):
+    """Returns {restriction: [offending keywords]} for the restrictions a dish name breaks."""
+    violations = {}
+    for restriction in restrictions or []:
+        text = str(dish_name).lower()
+        for phrase in RESTRICTION_ALLOWED_PHRASES.get(restriction, []):
+            text = text.replace(phrase, " ")
+        hits = mentions_any(text, RESTRICTION_KEYWORDS.get(restriction, []))
+        if hits:
+            violations[restriction] = hits
+    return violations
+
+def scale_meal(meal, factor):
+    """Scales a meal's portion and nutrition numbers in place by factor."""
+    grams = extract_num(meal.get("portion_grams", 0))
+    if grams:
+        meal["portion_grams"] = round(grams * factor)
+    nutrition = meal.get("nutrition")
+    if not isinstance(nutrition, dict):
+        nutrition = meal  # flat layout
+    for key in ("calories", "protein", "carbs", "fat"):
+        for stored_key in (key, f"estimated_{key}"):
+            if stored_key in nutrition:
+                value = extract_num(nutrition[stored_key]) * factor
+                nutrition[stored_key] = round(value) if key == "calories" else round(value, 1)
+    for ingredient in meal.get("ingredients") or []:
+        if isinstance(ingredient, dict) and "grams" in ingredient:
+            ingredient["grams"] = round(extract_num(ingredient["grams"]) * factor)
+    return meal
+
+def macro_split_for(preferences):
+    """Returns the (protein, carbs, fat) calorie split for the user's goal and restrictions."""
+    preferences = preferences or {}
+    if "Low Carb" in (preferences.get("restrictions") or []):
+        return LOW_CARB_MACRO_SPLIT
+    return MACRO_SPLITS.get(preferences.get("goal"), MACRO_SPLITS["Maintain Weight"])
+
 def calculate_calories(age, weight, height, gender, activity, goal):
     """
     Calculates estimated daily caloric needs using Mifflin-St Jeor equation.
@@ -87,9 +139,15 @@ def calculate_calories(age, weight, height, gender, activity, goal):
         return None # Indicate general failure
 
 
-@st.cache_data
+@lru_cache(maxsize=4)
 def load_nutrition_data(filepath="data/nutrition.csv"):
-    """Loads and cleans the nutrition data CSV file."""
+    """
+    Loads and cleans the nutrition data CSV file.
+    Cached per process and shared by all callers, so treat the returned DataFrame as read-only;
+    load_nutrition_data.cache_clear() reloads it.
+    """
+    import pandas as pd  # deferred: only needed when the dataset is loaded, keeps app start-up light
+
     try:
         log.info(f"Attempting to load nutrition data from: {filepath}")
         df = pd.read_csv(filepath)
@@ -109,47 +167,27 @@ def load_nutrition_data(filepath="data/nutrition.csv"):
         return None
 
 def process_day_content(day_content):
-    """Processes the content for a single day to extract meal rows and daily totals."""
+    """
+    Processes the content for a single day to extract meal rows and daily totals.
+    Accepts a raw day dict or an already normalized meal_plan_schema.DayPlan.
+    """
+    if isinstance(day_content, meal_plan_schema.DayPlan):
+        day = day_content
+    else:
+        day = meal_plan_schema.normalize_day("day", day_content)
+
     meal_rows = []
-    daily_calories = 0
-    daily_protein = 0
-    daily_carbs = 0
-    daily_fat = 0
-
-    for meal_item_key, meal_item_content in day_content.items():
-        if isinstance(meal_item_content, dict) and "nutrition" in meal_item_content:
-            meal_type = meal_item_key.lower()
-            dish_name = meal_item_content.get("dish_name", "N/A")
-            portion_grams = estimate_grams(meal_item_content.get("portion_grams", "N/A"))
-            nutrition = meal_item_content.get("nutrition", {})
-            calories = extract_num(nutrition.get("calories", 0))
-            protein = extract_num(nutrition.get("protein", 0))
-            carbs = extract_num(nutrition.get("carbs", 0))
-            fat = extract_num(nutrition.get("fat", 0))
-
-            daily_calories += calories
-            daily_protein += protein
-            daily_carbs += carbs
-            daily_fat += fat
-
-            if meal_type == "breakfast" or meal_type == "lunch" or meal_type == "dinner":
-                meal_rows.append({
-                    "Meal": meal_type.capitalize(),
-                    "Dish": dish_name,
-                    "Portion(g)": portion_grams,
-                    "Calories (kcal)": format_number(calories),
-                    "Protein (g)": format_number(protein),
-                    "Carbs (g)": format_number(carbs),
-                    "Fat (g)": format_number(fat),
-                })
-            elif meal_type.startswith("snack"):
-                meal_rows.append({
-                    "Meal": "Snack",
-                    "Dish": dish_name,
-                    "Portion(g)": portion_grams,
-                    "Calories (kcal)": format_number(calories),
-                    "Protein (g)": format_number(protein),
-                    "Carbs (g)": format_number(carbs),
-                    "Fat (g)": format_number(fat),
-                })
-    return meal_rows, daily_calories, daily_protein, daily_carbs, daily_fat
\ No newline at end of file
+    for meal in day.meals:
+        label = meal.meal_key if meal.meal_type == "other" else meal.meal_type
+        dish_name = ", ".join([meal.dish_name, *meal.extra_dishes])
+        meal_rows.append({
+            "Meal": label.replace("_", " ").capitalize(),
+            "Dish": dish_name,
+            "Portion(g)": estimate_grams(meal.source.get("portion_grams", "N/A")),
+            "Calories (kcal)": format_number(meal.calories),
+            "Protein (g)": format_number(meal.protein),
+            "Carbs (g)": format_number(meal.carbs),
+            "Fat (g)": format_number(meal.fat),
+        })
+    totals = day.totals()
+    return meal_rows, totals["calories"], totals["protein"], totals["carbs"], totals["fat"]
@@ -0,0 +1,98 @@
+"""
+Post-generation calorie calibration for meal plans.
+
+LLM plans often miss the daily calorie target. Instead of regenerating, calibrate_meal_plan()
+solves for a portion multiplier per meal that brings every day onto the target (and towards the
+requested macro split), then rewrites portion_grams and nutrition in place. All days are solved
+together as one batched linear system.
+"""
+
+import logging
+
+import numpy as np
+
+import meal_utils as utils
+from constants import CALIBRATION_BOUNDS
+from meal_plan_schema import normalize_meal_plan
+
+log = logging.getLogger(__name__)
+
+# Converts (calories, protein g, carbs g, fat g) columns into kcal so every residual has the same unit
+_KCAL_FACTORS = np.array([1.0, 4.0, 4.0, 9.0])
+# Residual weights: hitting the calorie total matters more than the macro split
+_CALORIE_WEIGHT = 4.0
+_MACRO_WEIGHT = 1.0
+# Penalty on moving multipliers away from 1, relative to target^2, so portions change as little as possible
+_STABILITY_WEIGHT = 0.05
+# Rounds of "rescale free meals, clip to bounds" used to land exactly on the target after clipping
+_EXACT_PASSES = 4
+
+
+def solve_portion_multipliers(values: np.ndarray, mask: np.ndarray, calorie_target: float,
+                              macro_split=None, bounds=CALIBRATION_BOUNDS) -> np.ndarray:
+    """
+    Solves per-meal multipliers x[d, m] for nutrient values[d, m, (kcal, p, c, f)].
+    Minimizes the weighted calorie and macro residuals plus a penalty on |x - 1|, for all days at once,
+    then clips to bounds and redistributes the remaining calorie gap over the meals still inside them.
+    """
+    days, width, _ = values.shape
+    kcal = values * _KCAL_FACTORS  # (days, meals, 4) in kcal
+    kcal[~mask] = 0.0
+
+    weights = np.array([_CALORIE_WEIGHT, _MACRO_WEIGHT, _MACRO_WEIGHT, _MACRO_WEIGHT])
+    if macro_split is None:
+        weights[1:] = 0.0
+        targets = np.array([calorie_target, 0.0, 0.0, 0.0])
+    else:
+        targets = np.array([calorie_target, *(calorie_target * s for s in macro_split)])
+
+    stability = _STABILITY_WEIGHT * calorie_target ** 2
+    # Normal equations (K W K^T + s I) x = K W t + s 1, batched over days
+    gram = np.einsum("dmr,r,dnr->dmn", kcal, weights, kcal) + stability * np.eye(width)
+    rhs = np.einsum("dmr,r,r->dm", kcal, weights, targets) + stability
+    x = np.linalg.solve(gram, rhs[..., None])[..., 0]
+
+    lower, upper = bounds
+    x = np.where(mask, np.clip(x, lower, upper), 1.0)
+    meal_kcal = kcal[..., 0]
+    for _ in range(_EXACT_PASSES):
+        free = mask & (x > lower) & (x < upper)
+        gap = calorie_target - (meal_kcal * x).sum(axis=1)
+        free_kcal = (meal_kcal * x * free).sum(axis=1)
+        scale = np.where(free_kcal > 0, 1.0 + gap / np.where(free_kcal > 0, free_kcal, 1.0), 1.0)
+        x = np.where(free, np.clip(x * scale[:, None], lower, upper), x)
+    return x
+
+
+def calibrate_meal_plan(plan: dict, calorie_target: int, macro_split=None, bounds=CALIBRATION_BOUNDS) -> dict:
+    """
+    Rescales each meal's portion_grams and nutrition in place so daily totals hit calorie_target
+    (and approach macro_split, a (protein, carbs, fat) calorie fraction tuple, when given).
+    Returns a report: per-day calories before/after and residual error, plus the worst residual.
+    """
+    report = {"days": {}, "max_abs_error_kcal": 0.0}
+    if not isinstance(plan, dict) or not calorie_target:
+        return report
+
+    normalized = normalize_meal_plan(plan)
+    values, mask = normalized.nutrient_matrix()
+    if not normalized.days or not mask.any():
+        return report
+
+    x = solve_portion_multipliers(values, mask, float(calorie_target), macro_split, bounds)
+    before = values[..., 0].sum(axis=1)
+
+    for d, day in enumerate(normalized.days):
+        for m, meal in enumerate(day.meals):
+            utils.scale_meal(meal.source, float(x[d, m]))
+        after = sum(round(meal.calories * x[d, m]) for m, meal in enumerate(day.meals))
+        report["days"][day.day_key] = {
+            "calories_before": round(float(before[d])),
+            "calories_after": round(after),
+            "error_kcal": round(after - calorie_target),
+            "multipliers": [round(float(v), 3) for v in x[d, :len(day.meals)]],
+        }
+        report["max_abs_error_kcal"] = max(report["max_abs_error_kcal"], abs(after - calorie_target))
+
+    log.info(f"Calibrated {len(normalized.days)} days to {calorie_target} kcal; worst residual {report['max_abs_error_kcal']:.0f} kcal")
+    return report
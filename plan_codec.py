@@ -0,0 +1,169 @@
+"""
+Compact binary codec for meal plans.
+
+A plan {"dayN": {meal_key: {...}}} is stored as one fixed-width numpy record per meal
+(day, meal key, dish, data source, grams and the four nutrients) plus one record per listed
+ingredient, with every string interned once in a shared table. Anything that does not fit that
+canonical shape (unit strings such as "250g", extra fields, day-level totals, unusual ingredient
+entries) is kept verbatim in a small JSON side table, so decode_plan(encode_plan(plan)) == plan
+for any plan. The whole blob is zlib-compressed.
+
+decode_nutrients() reads the numeric columns straight from the buffer for bulk analytics
+without building any per-meal Python objects.
+"""
+
+import json
+import zlib
+import struct
+
+import numpy as np
+
+MAGIC = b"MPC1"
+_HEADER = struct.Struct("<4sIII")  # magic, header length, meal rows, ingredient rows
+
+# Numeric columns: portion_grams, calories, protein, carbs, fat
+VALUE_KEYS = ("portion_grams", "calories", "protein", "carbs", "fat")
+NUTRIENT_KEYS = VALUE_KEYS[1:]
+_CANONICAL_MEAL_KEYS = {"dish_name", "portion_grams", "nutrition", "data_source", "ingredients"}
+
+MEAL_DTYPE = np.dtype([
+    ("day", "<u2"),        # index into day_keys
+    ("position", "<u2"),   # position of the meal within its day, to restore key order
+    ("meal_key", "<u4"),   # string table indices
+    ("dish", "<u4"),
+    ("source", "<u4"),
+    ("int_mask", "u1"),    # bit i set: VALUE_KEYS[i] was an int
+    ("present", "u1"),     # bit i set: VALUE_KEYS[i] was present; bits 5/6: data_source/ingredients present
+    ("n_ingredients", "<u2"),
+    ("values", "<f8", (len(VALUE_KEYS),)),
+])
+INGREDIENT_DTYPE = np.dtype([("name", "<u4"), ("grams", "<f8"), ("is_int", "u1")])
+_SOURCE_BIT = 1 << len(VALUE_KEYS)
+_INGREDIENTS_BIT = 1 << (len(VALUE_KEYS) + 1)
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _canonical_ingredients(ingredients) -> bool:
+    return isinstance(ingredients, list) and all(
+        isinstance(i, dict) and set(i) == {"name", "grams"} and isinstance(i["name"], str) and _is_number(i["grams"])
+        for i in ingredients
+    )
+
+
+def _is_canonical_meal(meal) -> bool:
+    """True if every field of the meal maps onto the fixed-width columns."""
+    if not isinstance(meal, dict) or not isinstance(meal.get("dish_name"), str) or not set(meal) <= _CANONICAL_MEAL_KEYS:
+        return False
+    if "portion_grams" in meal and not _is_number(meal["portion_grams"]):
+        return False
+    if "data_source" in meal and not isinstance(meal["data_source"], str):
+        return False
+    if "ingredients" in meal and not _canonical_ingredients(meal["ingredients"]):
+        return False
+    nutrition = meal.get("nutrition")
+    return isinstance(nutrition, dict) and set(nutrition) <= set(NUTRIENT_KEYS) and all(map(_is_number, nutrition.values()))
+
+
+def encode_plan(plan) -> bytes:
+    """Serializes a meal plan dict into a compressed binary blob."""
+    strings = {}
+
+    def intern(text):
+        return strings.setdefault(text, len(strings))
+
+    day_keys, extras, meals, ingredients = [], [], [], []
+    if not isinstance(plan, dict) or not all(isinstance(k, str) and isinstance(v, dict) for k, v in plan.items()):
+        extras.append([None, None, None, plan])  # not a day -> meal mapping; keep it whole
+        plan = {}
+
+    for day_index, (day_key, day) in enumerate(plan.items()):
+        day_keys.append(day_key)
+        for position, (meal_key, meal) in enumerate(day.items()):
+            if not _is_canonical_meal(meal):
+                extras.append([day_index, position, meal_key, meal])
+                continue
+            nutrition = meal["nutrition"]
+            raw = [meal.get("portion_grams"), *(nutrition.get(k) for k in NUTRIENT_KEYS)]
+            present = sum(1 << i for i, v in enumerate(raw) if v is not None)
+            if "data_source" in meal:
+                present |= _SOURCE_BIT
+            if "ingredients" in meal:
+                present |= _INGREDIENTS_BIT
+            meal_ingredients = meal.get("ingredients") or []
+            meals.append((
+                day_index, position, intern(meal_key), intern(meal["dish_name"]), intern(meal.get("data_source", "")),
+                sum(1 << i for i, v in enumerate(raw) if isinstance(v, int)), present, len(meal_ingredients),
+                [0.0 if v is None else float(v) for v in raw],
+            ))
+            ingredients.extend((intern(i["name"]), float(i["grams"]), isinstance(i["grams"], int)) for i in meal_ingredients)
+
+    header = json.dumps(
+        {"strings": list(strings), "days": day_keys, "extras": extras}, separators=(",", ":"), ensure_ascii=False
+    ).encode("utf-8")
+    meal_array = np.array(meals, dtype=MEAL_DTYPE)
+    ingredient_array = np.array(ingredients, dtype=INGREDIENT_DTYPE)
+    body = _HEADER.pack(MAGIC, len(header), len(meal_array), len(ingredient_array)) + header
+    return zlib.compress(body + meal_array.tobytes() + ingredient_array.tobytes(), 6)
+
+
+def _read(blob: bytes):
+    data = zlib.decompress(blob)
+    magic, header_length, n_meals, n_ingredients = _HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not an encoded meal plan")
+    offset = _HEADER.size
+    header = json.loads(data[offset:offset + header_length])
+    offset += header_length
+    meals = np.frombuffer(data, dtype=MEAL_DTYPE, count=n_meals, offset=offset)
+    offset += meals.nbytes
+    ingredients = np.frombuffer(data, dtype=INGREDIENT_DTYPE, count=n_ingredients, offset=offset)
+    return header, meals, ingredients
+
+
+def decode_plan(blob: bytes) -> dict:
+    """Restores the exact plan dict passed to encode_plan()."""
+    header, meals, ingredients = _read(blob)
+    strings, extras = header["strings"], header["extras"]
+    if extras and extras[0][0] is None:
+        return extras[0][3]
+
+    days = [[] for _ in header["days"]]
+    starts = np.concatenate(([0], np.cumsum(meals["n_ingredients"], dtype=np.int64)))
+    for row, start in zip(meals.tolist(), starts.tolist()):
+        day_index, position, meal_key, dish, source, int_mask, present, n_ingredients, values = row
+        numbers = [
+            (int(v) if int_mask >> i & 1 else v) if present >> i & 1 else None
+            for i, v in enumerate(values)
+        ]
+        meal = {"dish_name": strings[dish]}
+        if numbers[0] is not None:
+            meal["portion_grams"] = numbers[0]
+        meal["nutrition"] = {k: v for k, v in zip(NUTRIENT_KEYS, numbers[1:]) if v is not None}
+        if present & _SOURCE_BIT:
+            meal["data_source"] = strings[source]
+        if present & _INGREDIENTS_BIT:
+            meal["ingredients"] = [
+                {"name": strings[name], "grams": int(grams) if is_int else grams}
+                for name, grams, is_int in ingredients[start:start + n_ingredients].tolist()
+            ]
+        days[day_index].append((position, strings[meal_key], meal))
+    for day_index, position, meal_key, meal in extras:
+        days[day_index].append((position, meal_key, meal))
+
+    return {
+        day_key: {meal_key: meal for _, meal_key, meal in sorted(entries, key=lambda e: e[0])}
+        for day_key, entries in zip(header["days"], days)
+    }
+
+
+def decode_nutrients(blob: bytes):
+    """
+    Returns (day_keys, day_index, values) for the canonical meals without building dicts:
+    day_index is an int array per meal and values a (meals, 5) float array of VALUE_KEYS.
+    Meals kept in the side table (non-numeric values) are not included.
+    """
+    header, meals, _ = _read(blob)
+    return header["days"], meals["day"].astype(np.int64), meals["values"]
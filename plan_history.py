@@ -0,0 +1,169 @@
+"""
+Meal plan history.
+
+Every generated plan is stored per user with its profile (calorie target, restriction set, goal,
+preference fingerprint), so returning users can reuse a week they already had instead of
+regenerating it. Plans are normalized (meal_plan_schema) and stored as plan_codec blobs.
+
+SQLite is the default backend; set_history_backend() swaps in any object with the same methods
+(save_plan, get_plan, list_plans, find_latest).
+"""
+
+import time
+import logging
+
+import plan_codec
+from meal_plan_schema import normalize_meal_plan
+from meal_templates import restriction_key
+from request_coalescing import canonical_request_key
+from storage import open_db
+
+log = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 20
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS plan_history (
+    plan_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    calorie_target INTEGER NOT NULL,
+    restrictions TEXT NOT NULL,
+    goal TEXT,
+    profile_key TEXT NOT NULL,
+    source TEXT NOT NULL,
+    plan BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_history_user_created ON plan_history (user_id, created_at DESC, plan_id DESC);
+CREATE INDEX IF NOT EXISTS idx_history_user_profile ON plan_history (user_id, profile_key, calorie_target, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_history_restrictions ON plan_history (restrictions, calorie_target);
+"""
+_SUMMARY_COLUMNS = "plan_id, user_id, created_at, calorie_target, restrictions, goal, source"
+
+
+def profile_key(preferences: dict) -> str:
+    """Fingerprint of goal, restrictions, favorites and dislikes (order- and case-insensitive)."""
+    return canonical_request_key("plan_history", preferences=preferences or {})
+
+
+def _summary(row) -> dict:
+    return {
+        "plan_id": row["plan_id"],
+        "user_id": row["user_id"],
+        "created_at": row["created_at"],
+        "calorie_target": row["calorie_target"],
+        "restrictions": row["restrictions"].split("|") if row["restrictions"] else [],
+        "goal": row["goal"],
+        "source": row["source"],
+    }
+
+
+def _record(row) -> dict:
+    record = _summary(row)
+    record["plan"] = plan_codec.decode_plan(row["plan"])
+    return record
+
+
+class SQLitePlanHistory:
+    """Plan history in the local planner database (see storage.open_db)."""
+
+    def __init__(self, db_path: str = None):
+        self.db_path = db_path
+        self._schema_ready = False
+
+    def _connect(self):
+        return open_db(self.db_path)
+
+    def _ensure_schema(self, conn) -> None:
+        if not self._schema_ready:
+            conn.executescript(_SCHEMA)
+            self._schema_ready = True
+
+    def save_plan(self, user_id: str, plan: dict, calorie_target: int, preferences: dict, source: str) -> int:
+        """Stores a normalized copy of the plan. Returns its plan_id."""
+        preferences = preferences or {}
+        blob = plan_codec.encode_plan(normalize_meal_plan(plan).to_dict())
+        with self._connect() as conn:
+            self._ensure_schema(conn)
+            cursor = conn.execute(
+                "INSERT INTO plan_history (user_id, created_at, calorie_target, restrictions, goal, profile_key, source, plan) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (user_id, time.time(), int(calorie_target), restriction_key(preferences.get("restrictions")),
+                 preferences.get("goal"), profile_key(preferences), source, blob),
+            )
+        log.info(f"Stored {source} plan {cursor.lastrowid} for user {user_id} ({len(blob)} bytes)")
+        return cursor.lastrowid
+
+    def get_plan(self, plan_id: int, user_id: str = None) -> dict:
+        """Returns the plan record (summary fields plus "plan"), or None. user_id, if given, must match."""
+        with self._connect() as conn:
+            self._ensure_schema(conn)
+            row = conn.execute(f"SELECT {_SUMMARY_COLUMNS}, plan FROM plan_history WHERE plan_id = ?", (plan_id,)).fetchone()
+        if row is None or (user_id is not None and row["user_id"] != user_id):
+            return None
+        return _record(row)
+
+    def list_plans(self, user_id: str, limit: int = DEFAULT_PAGE_SIZE, cursor=None):
+        """
+        Returns (summaries, next_cursor) for the user's plans, newest first, without decoding plans.
+        Pass next_cursor back to fetch the following page; it is None on the last page.
+        """
+        query = f"SELECT {_SUMMARY_COLUMNS} FROM plan_history WHERE user_id = ?"
+        params = [user_id]
+        if cursor:
+            created_at, plan_id = cursor
+            query += " AND (created_at < ? OR (created_at = ? AND plan_id < ?))"
+            params += [created_at, created_at, plan_id]
+        query += " ORDER BY created_at DESC, plan_id DESC LIMIT ?"
+        params.append(limit + 1)
+        with self._connect() as conn:
+            self._ensure_schema(conn)
+            rows = conn.execute(query, params).fetchall()
+        summaries = [_summary(r) for r in rows[:limit]]
+        next_cursor = (summaries[-1]["created_at"], summaries[-1]["plan_id"]) if len(rows) > limit else None
+        return summaries, next_cursor
+
+    def find_latest(self, user_id: str, calorie_target: int = None, preferences: dict = None) -> dict:
+        """Returns the user's newest plan record, optionally for the same calorie target and preferences."""
+        query = f"SELECT {_SUMMARY_COLUMNS}, plan FROM plan_history WHERE user_id = ?"
+        params = [user_id]
+        if preferences is not None:
+            query += " AND profile_key = ?"
+            params.append(profile_key(preferences))
+        if calorie_target is not None:
+            query += " AND calorie_target = ?"
+            params.append(int(calorie_target))
+        query += " ORDER BY created_at DESC, plan_id DESC LIMIT 1"
+        with self._connect() as conn:
+            self._ensure_schema(conn)
+            row = conn.execute(query, params).fetchone()
+        return _record(row) if row else None
+
+
+_backend = SQLitePlanHistory()
+
+
+def set_history_backend(backend) -> None:
+    """Replaces the history backend for this process."""
+    global _backend
+    _backend = backend
+
+
+def get_history_backend():
+    return _backend
+
+
+def save_plan(user_id: str, plan: dict, calorie_target: int, preferences: dict, source: str) -> int:
+    return _backend.save_plan(user_id, plan, calorie_target, preferences, source)
+
+
+def get_plan(plan_id: int, user_id: str = None) -> dict:
+    return _backend.get_plan(plan_id, user_id)
+
+
+def list_plans(user_id: str, limit: int = DEFAULT_PAGE_SIZE, cursor=None):
+    return _backend.list_plans(user_id, limit, cursor)
+
+
+def find_latest(user_id: str, calorie_target: int = None, preferences: dict = None) -> dict:
+    return _backend.find_latest(user_id, calorie_target, preferences)
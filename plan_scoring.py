@@ -0,0 +1,150 @@
+"""
+Rule-based scoring of generated meal plans.
+
+Scores plans on the mechanical criteria of the LLM judge in evaluate_outputs.py (calorie alignment,
+calorie distribution, restriction violations, dislikes, favorites, variety) over every day of the
+plan, using the judge's 1-5 score keys. The numeric metrics of a whole batch of plans are computed
+as arrays in one pass; dish name checks reuse the app's keyword matching (meal_utils).
+
+Each evaluation lists in "needs_review" the criteria the rules cannot settle: borderline scores
+and favorites that may be present under another name. Only those go to the LLM judge.
+"""
+
+import numpy as np
+
+import meal_utils as utils
+from meal_plan_schema import NUTRIENT_KEYS, normalize_meal_plan
+
+SCORE_KEYS = (
+    "adherence_to_restrictions", "inclusion_of_favorites", "exclusion_of_dislikes",
+    "calorie_distribution_reasonableness", "meal_variety", "daily_calories_alignment",
+)
+PLAN_DAYS = 7
+MEAL_TYPES = ("breakfast", "lunch", "dinner", "snack")
+# Reasonable share of a day's calories per meal type (min, max); snacks may be absent
+MEAL_SHARE_BOUNDS = {"breakfast": (0.15, 0.35), "lunch": (0.25, 0.45), "dinner": (0.25, 0.45), "snack": (0.0, 0.25)}
+# Metric thresholds between scores 1..5
+CALORIE_DEVIATION_BINS = [0.05, 0.10, 0.15, 0.25]  # mean |day total - target| / target; lower is better
+DISTRIBUTION_BINS = [0.25, 0.5, 0.75, 0.9]          # fraction of meal-type shares within bounds
+VARIETY_BINS = [0.3, 0.45, 0.6, 0.8]                # distinct dishes / dishes
+FAVORITE_DAY_BINS = [0.15, 0.3, 0.5, 0.7]           # fraction of days with a favorite
+VIOLATION_SCORES = np.array([5, 3, 2, 1])           # by number of offending meals (0, 1, 2, 3+)
+# Scores the rules treat as undecided and hand to the LLM judge
+BORDERLINE_SCORES = {3}
+
+_CALORIES = NUTRIENT_KEYS.index("calories")
+
+
+def _higher_is_better(values, bins):
+    return 1 + np.digitize(values, bins)
+
+
+def _lower_is_better(values, bins):
+    return 5 - np.digitize(values, bins, right=True)
+
+
+def _calorie_metrics(plans: list, targets: np.ndarray) -> tuple:
+    """Mean calorie deviation and in-bounds meal share fraction per plan, over PLAN_DAYS days."""
+    width = max((len(day.meals) for plan in plans for day in plan.days), default=1) or 1
+    calories = np.zeros((len(plans), PLAN_DAYS, width))
+    types = np.full((len(plans), PLAN_DAYS, width), -1)
+    for p, plan in enumerate(plans):
+        for day in plan.days:
+            if not 1 <= day.day_number <= PLAN_DAYS:
+                continue
+            for m, meal in enumerate(day.meals):
+                calories[p, day.day_number - 1, m] = meal.nutrients()[_CALORIES]
+                if meal.meal_type in MEAL_TYPES:
+                    types[p, day.day_number - 1, m] = MEAL_TYPES.index(meal.meal_type)
+
+    day_totals = calories.sum(axis=2)                                    # (plans, days)
+    present = day_totals > 0
+    deviation = np.abs(day_totals - targets[:, None]) / targets[:, None]
+    deviation = np.where(present, deviation, 1.0)                        # a missing day counts as fully off
+
+    shares_ok = np.zeros(day_totals.shape)
+    safe_totals = np.where(present, day_totals, 1.0)
+    for t, meal_type in enumerate(MEAL_TYPES):
+        share = np.where(types == t, calories, 0).sum(axis=2) / safe_totals
+        low, high = MEAL_SHARE_BOUNDS[meal_type]
+        shares_ok += (share >= low) & (share <= high)
+    day_count = np.maximum(present.sum(axis=1), 1)
+    distribution = (np.where(present, shares_ok / len(MEAL_TYPES), 0)).sum(axis=1) / day_count
+    return deviation.mean(axis=1), distribution
+
+
+def _name_metrics(plan, preferences: dict) -> dict:
+    restrictions = preferences.get("restrictions") or []
+    dislikes = utils.split_food_list(preferences.get("dislikes"))
+    favorites = utils.split_food_list(preferences.get("favorites"))
+    violations, disliked, favorite_days = [], [], set()
+    names = []
+    for day in plan.days:
+        for meal in day.meals:
+            text = " ".join([meal.dish_name, *meal.extra_dishes])
+            names.append(meal.dish_name.strip().lower())
+            broken = utils.find_restriction_violations(text, restrictions)
+            if broken:
+                violations.append(f"{day.day_key}.{meal.meal_key}: {meal.dish_name} ({', '.join(broken)})")
+            hits = utils.mentions_any(text, dislikes)
+            if hits:
+                disliked.append(f"{day.day_key}.{meal.meal_key}: {meal.dish_name} ({', '.join(hits)})")
+            if utils.mentions_any(text, favorites):
+                favorite_days.add(day.day_key)
+    return {
+        "violations": violations,
+        "disliked": disliked,
+        "favorites": favorites,
+        "favorite_day_ratio": len(favorite_days) / PLAN_DAYS,
+        "variety": len(set(names)) / len(names) if names else 0.0,
+    }
+
+
+def score_plans(entries: list) -> list:
+    """
+    Scores [(raw plan, calorie_target, preferences)] and returns one evaluation per entry:
+    the SCORE_KEYS (1-5), "justification", "metrics" and "needs_review" (criteria for the LLM judge).
+    """
+    plans = [normalize_meal_plan(raw) for raw, _, _ in entries]
+    targets = np.array([float(target or 0) for _, target, _ in entries])
+    targets = np.where(targets > 0, targets, np.nan)
+    deviation, distribution = _calorie_metrics(plans, np.nan_to_num(targets, nan=1.0))
+    alignment = np.where(np.isnan(targets), 1, _lower_is_better(deviation, CALORIE_DEVIATION_BINS))
+    distribution_scores = _higher_is_better(distribution, DISTRIBUTION_BINS)
+
+    evaluations = []
+    for i, (plan, (_, target, preferences)) in enumerate(zip(plans, entries)):
+        names = _name_metrics(plan, preferences or {})
+        scores = {
+            "adherence_to_restrictions": int(VIOLATION_SCORES[min(len(names["violations"]), 3)]),
+            "inclusion_of_favorites": int(_higher_is_better(names["favorite_day_ratio"], FAVORITE_DAY_BINS)) if names["favorites"] else 5,
+            "exclusion_of_dislikes": int(VIOLATION_SCORES[min(len(names["disliked"]), 3)]),
+            "calorie_distribution_reasonableness": int(distribution_scores[i]),
+            "meal_variety": int(_higher_is_better(names["variety"], VARIETY_BINS)),
+            "daily_calories_alignment": int(alignment[i]),
+        }
+        needs_review = [key for key in SCORE_KEYS if scores[key] in BORDERLINE_SCORES]
+        if names["favorites"] and names["favorite_day_ratio"] == 0 and "inclusion_of_favorites" not in needs_review:
+            needs_review.append("inclusion_of_favorites")  # favorites may appear under another name
+
+        findings = [f"{len(plan.days)} days, mean daily calorie deviation {deviation[i]:.0%} from {target} kcal"]
+        if names["violations"]:
+            findings.append(f"restriction violations: {'; '.join(names['violations'][:5])}")
+        if names["disliked"]:
+            findings.append(f"disliked foods: {'; '.join(names['disliked'][:5])}")
+        findings.append(f"{names['variety']:.0%} distinct dishes, favorites on {names['favorite_day_ratio']:.0%} of days")
+        evaluations.append({
+            **scores,
+            "justification": "Rule-based: " + "; ".join(findings) + ".",
+            "metrics": {
+                "calorie_deviation": round(float(deviation[i]), 3),
+                "distribution_in_bounds": round(float(distribution[i]), 3),
+                "distinct_dish_ratio": round(names["variety"], 3),
+                "favorite_day_ratio": round(names["favorite_day_ratio"], 3),
+                "restriction_violations": len(names["violations"]),
+                "disliked_meals": len(names["disliked"]),
+                "plan_issues": len(plan.issues),
+            },
+            "needs_review": needs_review,
+        })
+    return evaluations
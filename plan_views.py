@@ -0,0 +1,87 @@
+"""
+Render-ready views of a meal plan.
+
+Streamlit reruns the whole script on every widget interaction. build_plan_view() does the
+per-plan work once (normalizing, table rows, daily totals, Plotly figure specs as plain dicts)
+and is memoized by st.cache_data on the plan_codec blob (and in the shared cache across workers),
+so reruns for an already generated plan only replay cached data into the page.
+"""
+
+import hashlib
+
+import streamlit as st
+
+import meal_utils as utils
+import plan_codec
+from constants import PLAN_VIEW_CACHE_TTL_SECONDS
+from meal_plan_schema import normalize_meal_plan
+from shared_cache import cached_call
+
+MACRO_COLORS = ["#FF6361", "#58508D", "#FFA600"]
+WEEKLY_SERIES = [
+    ("Calories", "calories", "#4CAF50"),
+    ("Protein", "protein", "#FF6361"),
+    ("Carbs", "carbs", "#58508D"),
+    ("Fat", "fat", "#FFA600"),
+]
+
+
+def macro_pie_spec(protein: float, carbs: float, fat: float) -> dict:
+    """Plotly figure spec of the day's calories by macro."""
+    return {
+        "data": [{
+            "type": "pie",
+            "labels": ["Protein", "Carbs", "Fat"],
+            "values": [protein * 4, carbs * 4, fat * 9],
+            "hole": 0.4,
+            "marker": {"colors": MACRO_COLORS},
+        }],
+        "layout": {"title": {"text": "Macros Breakdown", "x": 0.5}},
+    }
+
+
+def weekly_bar_spec(day_keys: list, totals: list) -> dict:
+    """Plotly figure spec of daily calories and macros across the week."""
+    return {
+        "data": [
+            {"type": "bar", "name": name, "x": day_keys, "y": [t[key] for t in totals], "marker": {"color": color}}
+            for name, key, color in WEEKLY_SERIES
+        ],
+        "layout": {
+            "barmode": "group",
+            "xaxis": {"title": {"text": "Day"}},
+            "yaxis": {"title": {"text": "Amount"}},
+            "title": {"text": "Weekly Nutrition Overview"},
+        },
+    }
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def build_plan_view(plan_blob: bytes) -> dict:
+    """
+    Returns {"days": [{"day_key", "rows", "totals", "pie"}], "weekly": spec, "issues": [...]}
+    for a plan_codec blob. Cached per blob in this process and in the shared cache, so identical
+    plans are processed once across all workers.
+    """
+    digest = hashlib.sha256(plan_blob).hexdigest()
+    return cached_call("plan_view", (digest,), PLAN_VIEW_CACHE_TTL_SECONDS, lambda: _build_plan_view(plan_blob))
+
+
+def _build_plan_view(plan_blob: bytes) -> dict:
+    plan = normalize_meal_plan(plan_codec.decode_plan(plan_blob))
+    days, totals = [], []
+    for day in plan.days:
+        rows, calories, protein, carbs, fat = utils.process_day_content(day)
+        day_totals = {"calories": calories, "protein": protein, "carbs": carbs, "fat": fat}
+        totals.append(day_totals)
+        days.append({
+            "day_key": day.day_key,
+            "rows": rows,
+            "totals": day_totals,
+            "pie": macro_pie_spec(protein, carbs, fat),
+        })
+    return {
+        "days": days,
+        "weekly": weekly_bar_spec([d["day_key"] for d in days], totals),
+        "issues": plan.issues,
+    }
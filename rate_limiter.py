@@ -0,0 +1,246 @@
+"""
+Client-side rate limiting for upstream LLM APIs, shared by every worker process.
+
+Each provider/model has a requests bucket and a tokens bucket, kept in the planner database.
+Buckets are fed by the x-ratelimit-* response headers (limit, remaining, reset) and refill
+linearly until the reported reset; between responses each call debits its estimated cost. Before
+a request, acquire() picks the first model in fallback order whose buckets can take it, waits for
+the soonest one when none can, or gives up with RateLimitError once the wait would exceed the
+caller's limit, so throttling happens here instead of as a 429 after the user has waited.
+
+Calls run at a priority (see priority()). Interactive calls (the app, the HTTP API) may drain a
+bucket; batch calls (evaluator, template builder) must leave RATE_LIMIT_BATCH_RESERVE of it free
+and also hold back while an interactive call in any process is waiting on the same model.
+A model that has not answered yet has no buckets and is never throttled.
+"""
+
+import re
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import contextvars
+from contextlib import contextmanager
+
+from constants import RATE_LIMIT_BATCH_RESERVE, RATE_LIMIT_MAX_WAIT_SECONDS, RATE_LIMIT_DEFAULT_RETRY_SECONDS
+from errors import RateLimitError
+from storage import open_db
+
+log = logging.getLogger(__name__)
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+
+_POLL_INTERVAL_SECONDS = 1.0
+_KINDS = ("requests", "tokens")
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+    provider TEXT NOT NULL,
+    model TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    capacity REAL NOT NULL,
+    level REAL NOT NULL,
+    refill_rate REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (provider, model, kind)
+);
+CREATE TABLE IF NOT EXISTS rate_limit_waiters (
+    waiter TEXT PRIMARY KEY,
+    provider TEXT NOT NULL,
+    model TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+# Priority of the calls made in the current context; set it with priority()
+current_priority = contextvars.ContextVar("rate_limit_priority", default=INTERACTIVE)
+
+_schema_ready = False
+
+
+def _ensure_schema(conn) -> None:
+    global _schema_ready
+    if not _schema_ready:
+        conn.executescript(_SCHEMA)
+        _schema_ready = True
+
+
+@contextmanager
+def priority(level: str):
+    """Runs the calls made inside the block at INTERACTIVE or BATCH priority."""
+    token = current_priority.set(level)
+    try:
+        yield
+    finally:
+        current_priority.reset(token)
+
+
+def estimate_tokens(messages: list, max_tokens: int) -> int:
+    """Tokens a chat request can count against a tokens-per-minute limit: ~4 characters per prompt token plus max_tokens."""
+    return len(json.dumps(messages, ensure_ascii=False)) // 4 + (max_tokens or 0)
+
+
+def _parse_duration(value) -> float:
+    """Seconds in a reset header: "7.66s", "2m59.56s", "1h2m", "450ms" or plain seconds."""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_RE.findall(value)
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts) if parts else None
+
+
+def _level(row, now: float) -> float:
+    return min(row["capacity"], row["level"] + row["refill_rate"] * max(0.0, now - row["updated_at"]))
+
+
+def observe(provider: str, model: str, headers, status_code: int = None) -> None:
+    """
+    Updates the buckets of provider/model from a response: x-ratelimit-{limit,remaining,reset}-{requests,tokens}
+    headers when present, and a 429 empties the requests bucket until Retry-After.
+    Never raises.
+    """
+    now = time.time()
+    updates = []
+    for kind in _KINDS:
+        try:
+            capacity = float(headers.get(f"x-ratelimit-limit-{kind}"))
+            level = float(headers.get(f"x-ratelimit-remaining-{kind}"))
+        except (TypeError, ValueError):
+            continue
+        reset = _parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+        if level < capacity and reset:
+            refill_rate = (capacity - level) / reset
+        else:
+            refill_rate = capacity / 60
+        updates.append((kind, capacity, level, refill_rate))
+    if status_code == 429:
+        retry_after = _parse_duration(headers.get("retry-after")) or RATE_LIMIT_DEFAULT_RETRY_SECONDS
+        updates = [u for u in updates if u[0] != "requests"]
+        updates.append(("requests", None, 0.0, 1.0 / retry_after))
+    if not updates:
+        return
+
+    try:
+        with open_db() as conn:
+            _ensure_schema(conn)
+            for kind, capacity, level, refill_rate in updates:
+                if capacity is None:
+                    # Keep the known capacity; one request becomes available after Retry-After
+                    conn.execute(
+                        "INSERT INTO rate_limit_buckets (provider, model, kind, capacity, level, refill_rate, updated_at) "
+                        "VALUES (?, ?, ?, 1, ?, ?, ?) ON CONFLICT (provider, model, kind) DO UPDATE SET "
+                        "level = excluded.level, refill_rate = excluded.refill_rate, updated_at = excluded.updated_at",
+                        (provider, model, kind, level, refill_rate, now),
+                    )
+                else:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO rate_limit_buckets (provider, model, kind, capacity, level, refill_rate, updated_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (provider, model, kind, capacity, level, refill_rate, now),
+                    )
+    except sqlite3.Error as e:
+        log.warning(f"Could not update rate limits for {provider}/{model}: {e}")
+
+
+def _try_reserve(conn, provider: str, model: str, tokens: int, level: str, waiter: str, now: float) -> float:
+    """Debits one request and tokens from the model's buckets if they allow it. Returns 0, or seconds to wait."""
+    if level == BATCH:
+        interactive_waiting = conn.execute(
+            "SELECT 1 FROM rate_limit_waiters WHERE provider = ? AND model = ? AND expires_at > ? AND waiter != ?",
+            (provider, model, now, waiter),
+        ).fetchone()
+        if interactive_waiting:
+            return _POLL_INTERVAL_SECONDS
+
+    rows = conn.execute(
+        "SELECT kind, capacity, level, refill_rate, updated_at FROM rate_limit_buckets WHERE provider = ? AND model = ?",
+        (provider, model),
+    ).fetchall()
+    wait = 0.0
+    for row in rows:
+        # A request larger than the whole bucket waits for a full bucket rather than forever
+        cost = min(1 if row["kind"] == "requests" else tokens, row["capacity"])
+        reserve = row["capacity"] * RATE_LIMIT_BATCH_RESERVE if level == BATCH else 0.0
+        shortfall = cost + reserve - _level(row, now)
+        if shortfall > 0:
+            wait = max(wait, shortfall / row["refill_rate"] if row["refill_rate"] > 0 else float("inf"))
+    if wait > 0:
+        return wait
+
+    for row in rows:
+        cost = min(1 if row["kind"] == "requests" else tokens, row["capacity"])
+        conn.execute(
+            "UPDATE rate_limit_buckets SET level = ?, updated_at = ? WHERE provider = ? AND model = ? AND kind = ?",
+            (_level(row, now) - cost, now, provider, model, row["kind"]),
+        )
+    return 0.0
+
+
+def acquire(provider: str, models: list, tokens: int, max_wait: float = None) -> str:
+    """
+    Reserves capacity for one request of about `tokens` tokens and returns the model to send it to:
+    the first of models (in fallback order) that has capacity now, otherwise the first to get it.
+    Waits at most max_wait seconds (default: RATE_LIMIT_MAX_WAIT_SECONDS for the current priority),
+    then raises RateLimitError. If the shared store is unavailable, returns models[0] unthrottled.
+    """
+    level = current_priority.get()
+    deadline = time.time() + (max_wait if max_wait is not None else RATE_LIMIT_MAX_WAIT_SECONDS[level])
+    waiter = uuid.uuid4().hex
+    waiting = False
+    try:
+        while True:
+            now = time.time()
+            with open_db() as conn:
+                _ensure_schema(conn)
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    # In fallback order, stopping at the first model that has capacity: only that one is debited
+                    waits, model = {}, None
+                    for candidate in models:
+                        waits[candidate] = _try_reserve(conn, provider, candidate, tokens, level, waiter, now)
+                        if waits[candidate] == 0:
+                            model = candidate
+                            break
+                    if model is None and level == INTERACTIVE:
+                        # Announce the wait so batch callers in every process hold back
+                        conn.execute(
+                            "INSERT OR REPLACE INTO rate_limit_waiters (waiter, provider, model, expires_at) VALUES (?, ?, ?, ?)",
+                            (waiter, provider, min(models, key=waits.get), now + _POLL_INTERVAL_SECONDS * 3),
+                        )
+                        waiting = True
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+            if model is not None:
+                if waiting:
+                    log.info(f"Rate limit wait over for {provider}/{model}")
+                return model
+
+            delay = min(waits.values())
+            if now + delay > deadline:
+                log.warning(f"{provider} rate limits exhausted for {models}; next capacity in {delay:.0f}s")
+                raise RateLimitError(
+                    "The AI service is busy right now (rate limit reached).",
+                    hint=f"Please try again in about {max(1, round(delay))} seconds." if delay != float("inf") else "Please try again later.",
+                )
+            log.info(f"Waiting {delay:.1f}s for {provider} rate limit capacity ({level})")
+            time.sleep(min(delay, _POLL_INTERVAL_SECONDS))
+    except sqlite3.Error as e:
+        log.warning(f"Rate limit store unavailable, calling {provider}/{models[0]} unthrottled: {e}")
+        return models[0]
+    finally:
+        if waiting:
+            try:
+                with open_db() as conn:
+                    conn.execute("DELETE FROM rate_limit_waiters WHERE waiter = ? OR expires_at < ?", (waiter, time.time()))
+            except sqlite3.Error:
+                pass
@@ -0,0 +1,186 @@
+import copy
+import json
+import time
+import hashlib
+import logging
+import threading
+
+from constants import COALESCE_LEASE_SECONDS
+from storage import open_db
+
+log = logging.getLogger(__name__)
+
+# How long a finished result stays readable for followers in other processes that were waiting on it
+_RESULT_GRACE_SECONDS = 60
+_POLL_INTERVAL_SECONDS = 0.5
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS inflight_requests (
+    request_key TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    lease_expires_at REAL NOT NULL,
+    finished_at REAL,
+    result TEXT
+);
+"""
+
+
+def _normalize_list(value) -> list:
+    """Turns a list or comma-separated string into a sorted, lower-cased list."""
+    if isinstance(value, str):
+        value = value.split(",")
+    return sorted({str(v).strip().lower() for v in (value or []) if str(v).strip()})
+
+
+def canonical_request_key(feature: str, api_key: str = None, **params) -> str:
+    """
+    Hashes a request into a stable key. Preference lists are order- and case-insensitive,
+    so "Salmon, avocado" and "avocado,salmon" coalesce. The API key only enters as a digest.
+    """
+    canonical = {}
+    for name, value in params.items():
+        if name == "preferences" and isinstance(value, dict):
+            value = {
+                "goal": value.get("goal"),
+                "restrictions": _normalize_list(value.get("restrictions")),
+                "favorites": _normalize_list(value.get("favorites")),
+                "dislikes": _normalize_list(value.get("dislikes")),
+            }
+        canonical[name] = value
+    canonical["feature"] = feature
+    canonical["api_key"] = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:16]
+    blob = json.dumps(canonical, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class _InflightCall:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls with the same key onto one execution.
+    The first caller (the leader) runs the function; every concurrent caller with the same key
+    waits and receives a copy of the leader's result. With cross_process=True a SQLite lease
+    extends this to other worker processes sharing the planner database; results must then be
+    JSON-serializable. Only callers that were already waiting get a finished result: a later
+    caller runs fn itself, and a failed leader hands the lease to the next waiter.
+    """
+
+    def __init__(self, cross_process: bool = False, lease_seconds: float = COALESCE_LEASE_SECONDS):
+        self.cross_process = cross_process
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._owner = f"{id(self):x}-{time.time():.6f}"
+
+    def do(self, key: str, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _InflightCall()
+                self._calls[key] = call
+
+        if not is_leader:
+            log.info(f"Coalescing onto in-flight request {key[:12]}")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+
+        try:
+            if self.cross_process:
+                call.result = self._do_cross_process(key, fn)
+            else:
+                call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def _do_cross_process(self, key: str, fn):
+        """Runs fn under a SQLite lease, or waits for another process that already holds it."""
+        waiting_since = None
+        while True:
+            now = time.time()
+            with open_db() as conn:
+                conn.executescript(_SCHEMA)
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    conn.execute(
+                        "DELETE FROM inflight_requests WHERE finished_at IS NOT NULL AND finished_at < ?",
+                        (now - _RESULT_GRACE_SECONDS,),
+                    )
+                    row = conn.execute(
+                        "SELECT owner, lease_expires_at, finished_at, result FROM inflight_requests WHERE request_key = ?",
+                        (key,),
+                    ).fetchone()
+                    reusable = row is not None and row["finished_at"] is not None and waiting_since is not None \
+                        and row["finished_at"] >= waiting_since
+                    expired = row is not None and row["finished_at"] is None and row["lease_expires_at"] < now
+                    if row is None or expired or (row["finished_at"] is not None and not reusable):
+                        conn.execute(
+                            "INSERT OR REPLACE INTO inflight_requests (request_key, owner, lease_expires_at) VALUES (?, ?, ?)",
+                            (key, self._owner, now + self.lease_seconds),
+                        )
+                        acquired = True
+                    else:
+                        acquired = False
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+
+            if acquired:
+                break
+            if reusable:
+                log.info(f"Reusing result of request {key[:12]} finished by another worker")
+                return json.loads(row["result"]) if row["result"] else None
+            if waiting_since is None:
+                waiting_since = now
+            time.sleep(_POLL_INTERVAL_SECONDS)
+
+        stop_renewing = threading.Event()
+        threading.Thread(target=self._renew_lease, args=(key, stop_renewing), daemon=True).start()
+        try:
+            result = fn()
+        except BaseException:
+            # Nothing to share: waiters take the lease and run the request themselves
+            self._publish(key, "DELETE FROM inflight_requests WHERE request_key = ? AND owner = ?", (key, self._owner))
+            raise
+        finally:
+            stop_renewing.set()
+        self._publish(
+            key, "UPDATE inflight_requests SET finished_at = ?, result = ? WHERE request_key = ? AND owner = ?",
+            (time.time(), json.dumps(result) if result is not None else None, key, self._owner),
+        )
+        return result
+
+    def _renew_lease(self, key: str, stop: threading.Event) -> None:
+        """Extends the lease every third of lease_seconds while fn runs, so a long generation keeps it."""
+        while not stop.wait(self.lease_seconds / 3):
+            try:
+                with open_db() as conn:
+                    conn.execute(
+                        "UPDATE inflight_requests SET lease_expires_at = ? WHERE request_key = ? AND owner = ? AND finished_at IS NULL",
+                        (time.time() + self.lease_seconds, key, self._owner),
+                    )
+            except Exception as e:
+                log.warning(f"Failed to renew lease of request {key[:12]}: {e}")
+
+    def _publish(self, key: str, sql: str, params: tuple) -> None:
+        try:
+            with open_db() as conn:
+                conn.execute(sql, params)
+        except Exception as e:
+            log.error(f"Failed to publish coalesced result for {key[:12]}: {e}")
@@ -0,0 +1,273 @@
+"""
+Cache shared by every app process.
+
+st.cache_data and module-level dicts are per process, so each Streamlit replica warms its own
+copy. Values stored here (USDA lookups, rendered plan views) are visible to all workers pointed
+at the same backend:
+
+- SQLiteCache: a table in the planner database (storage.DB_PATH), the default;
+- RedisCache: any Redis-compatible client (get / set(ex=) / delete), e.g. redis.Redis or the
+  in-process MemoryRedis stand-in used for "memory://".
+
+Values must be JSON-serializable. Keys come from make_key(), so every caller hashes the same
+request the same way. Entries expire after their TTL; each namespace keeps at most
+SHARED_CACHE_MAX_ENTRIES entries and values over SHARED_CACHE_MAX_VALUE_BYTES are not stored.
+"""
+
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from constants import SHARED_CACHE_URL, SHARED_CACHE_MAX_ENTRIES, SHARED_CACHE_MAX_VALUE_BYTES
+from storage import open_db
+
+log = logging.getLogger(__name__)
+
+# Bump to invalidate every entry after a change in what cached values mean
+CACHE_VERSION = 1
+# SQLite eviction runs on one write in this many
+_EVICT_EVERY = 50
+# Stored for a remembered None result (cached_call miss_ttl_seconds)
+_NEGATIVE_ENTRY = {"_negative_cache_entry": True}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS shared_cache (
+    cache_key TEXT PRIMARY KEY,
+    namespace TEXT NOT NULL,
+    value BLOB NOT NULL,
+    expires_at REAL NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_shared_cache_namespace ON shared_cache (namespace, created_at);
+CREATE INDEX IF NOT EXISTS idx_shared_cache_expires ON shared_cache (expires_at);
+"""
+
+
+def make_key(namespace: str, *parts, **params) -> str:
+    """Stable cache key: namespace plus a digest of the canonical JSON of parts and params."""
+    canonical = json.dumps([parts, params], sort_keys=True, separators=(",", ":"), default=str)
+    digest = hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:40]
+    return f"mp:v{CACHE_VERSION}:{namespace}:{digest}"
+
+
+def _namespace(key: str) -> str:
+    return key.split(":")[2] if key.count(":") >= 3 else ""
+
+
+def _encode(value):
+    blob = json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    if len(blob) > SHARED_CACHE_MAX_VALUE_BYTES:
+        log.info(f"Not caching {len(blob)} byte value (limit {SHARED_CACHE_MAX_VALUE_BYTES})")
+        return None
+    return blob
+
+
+class SQLiteCache:
+    """Shared cache in the local planner database; every process on the host sees the same entries."""
+
+    def __init__(self, db_path: str = None, max_entries: int = SHARED_CACHE_MAX_ENTRIES):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self._schema_ready = False
+        self._writes = 0
+
+    def _ensure_schema(self, conn) -> None:
+        if not self._schema_ready:
+            conn.executescript(_SCHEMA)
+            self._schema_ready = True
+
+    def get(self, key: str):
+        with open_db(self.db_path) as conn:
+            self._ensure_schema(conn)
+            row = conn.execute("SELECT value, expires_at FROM shared_cache WHERE cache_key = ?", (key,)).fetchone()
+        if row is None or row["expires_at"] < time.time():
+            return None
+        return json.loads(row["value"])
+
+    def set(self, key: str, value, ttl_seconds: float) -> None:
+        blob = _encode(value)
+        if blob is None:
+            return
+        now = time.time()
+        namespace = _namespace(key)
+        with open_db(self.db_path) as conn:
+            self._ensure_schema(conn)
+            conn.execute(
+                "INSERT OR REPLACE INTO shared_cache (cache_key, namespace, value, expires_at, created_at) VALUES (?, ?, ?, ?, ?)",
+                (key, namespace, blob, now + ttl_seconds, now),
+            )
+            self._writes += 1
+            if self._writes % _EVICT_EVERY == 0:
+                self._evict(conn, now)
+
+    def _evict(self, conn, now: float) -> None:
+        """Drops expired entries and trims every namespace to its newest max_entries."""
+        conn.execute("DELETE FROM shared_cache WHERE expires_at < ?", (now,))
+        conn.execute(
+            "DELETE FROM shared_cache WHERE cache_key IN (SELECT cache_key FROM ("
+            "SELECT cache_key, ROW_NUMBER() OVER (PARTITION BY namespace ORDER BY created_at DESC) AS newest "
+            "FROM shared_cache) WHERE newest > ?)",
+            (self.max_entries,),
+        )
+
+    def delete(self, key: str) -> None:
+        with open_db(self.db_path) as conn:
+            self._ensure_schema(conn)
+            conn.execute("DELETE FROM shared_cache WHERE cache_key = ?", (key,))
+
+
+class MemoryRedis:
+    """
+    Minimal in-process stand-in for a Redis client (get, set with ex, delete), with LRU eviction.
+    Lets RedisCache run without a server, e.g. in development or single-process deployments.
+    """
+
+    def __init__(self, max_entries: int = SHARED_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        with self._lock:
+            item = self._data.get(name)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at is not None and expires_at < time.time():
+                del self._data[name]
+                return None
+            self._data.move_to_end(name)
+            return value
+
+    def set(self, name, value, ex=None):
+        with self._lock:
+            self._data[name] = (value, time.time() + ex if ex else None)
+            self._data.move_to_end(name)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+        return True
+
+    def delete(self, *names):
+        with self._lock:
+            return sum(self._data.pop(n, None) is not None for n in names)
+
+
+class RedisCache:
+    """Shared cache on a Redis-compatible client; TTLs map to EX and the server's maxmemory policy bounds size."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, key: str):
+        blob = self.client.get(key)
+        return json.loads(blob) if blob is not None else None
+
+    def set(self, key: str, value, ttl_seconds: float) -> None:
+        blob = _encode(value)
+        if blob is not None:
+            self.client.set(key, blob, ex=max(1, int(ttl_seconds)))
+
+    def delete(self, key: str) -> None:
+        self.client.delete(key)
+
+
+def cache_from_url(url: str):
+    """Builds the backend for SHARED_CACHE_URL: "" (SQLite), "memory://" or "redis://..."."""
+    if not url:
+        return SQLiteCache()
+    if url.startswith("memory://"):
+        return RedisCache(MemoryRedis())
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        import redis  # optional dependency, only needed for Redis deployments
+
+        return RedisCache(redis.Redis.from_url(url))
+    raise ValueError(f"Unsupported shared cache URL: {url}")
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Returns the process-wide shared cache backend, created from SHARED_CACHE_URL on first use."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = cache_from_url(SHARED_CACHE_URL)
+    return _cache
+
+
+def set_cache(backend) -> None:
+    """Replaces the shared cache backend for this process."""
+    global _cache
+    _cache = backend
+
+
+def cached_call(namespace: str, key_parts: tuple, ttl_seconds: float, compute, miss_ttl_seconds: float = None):
+    """
+    Returns the cached value for make_key(namespace, *key_parts), computing and storing it on a miss.
+    None results are not cached, unless miss_ttl_seconds is given: then a None result is remembered
+    for that long (a negative cache entry) and returned without calling compute() again. Such a
+    compute() must raise, not return None, on transient failures.
+    Cache errors are logged and fall back to compute().
+    """
+    key = make_key(namespace, *key_parts)
+    cache = get_cache()
+    try:
+        value = cache.get(key)
+    except Exception as e:
+        log.warning(f"Shared cache read failed for {namespace}: {e}")
+        return compute()
+    if value == _NEGATIVE_ENTRY:
+        return None
+    if value is not None:
+        return value
+
+    value = compute()
+    if value is not None or miss_ttl_seconds:
+        try:
+            if value is None:
+                cache.set(key, _NEGATIVE_ENTRY, miss_ttl_seconds)
+            else:
+                cache.set(key, value, ttl_seconds)
+        except Exception as e:
+            log.warning(f"Shared cache write failed for {namespace}: {e}")
+    return value
+
+
+def cached_many(namespace: str, keys: list, ttl_seconds: float, compute_missing) -> dict:
+    """
+    Batch form of cached_call for values keyed by one scalar each (e.g. database ids).
+    compute_missing(missing_keys) is called once with the keys that have no cached value and
+    returns {key: value}; the values are stored individually. Returns {key: value} for the keys
+    that have a value. Cache errors are logged and fall back to computing.
+    """
+    cache = get_cache()
+    found, missing = {}, []
+    for key in dict.fromkeys(keys):
+        try:
+            value = cache.get(make_key(namespace, key))
+        except Exception as e:
+            log.warning(f"Shared cache read failed for {namespace}: {e}")
+            value = None
+        if value is None:
+            missing.append(key)
+        else:
+            found[key] = value
+    if not missing:
+        return found
+
+    computed = compute_missing(missing) or {}
+    for key, value in computed.items():
+        if value is None:
+            continue
+        found[key] = value
+        try:
+            cache.set(make_key(namespace, key), value, ttl_seconds)
+        except Exception as e:
+            log.warning(f"Shared cache write failed for {namespace}: {e}")
+    return found
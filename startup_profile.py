@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""
+Start-up import profile for the Streamlit app.
+
+Imports the modules app.py loads in a fresh interpreter with `python -X importtime`, prints the
+slowest imports and checks them against an import-time budget. Heavy libraries that are only
+needed on specific code paths (pandas, plotly figures, fuzzy matching) must stay out of start-up.
+
+    python startup_profile.py            # report
+    python startup_profile.py --check    # also exit 1 when over budget (use in CI)
+"""
+
+import os
+import re
+import sys
+import argparse
+import subprocess
+
+# Modules app.py imports before the first render
+APP_MODULES = [
+    "streamlit", "meal_utils", "groq_api", "job_queue", "meal_templates", "meal_solver",
+    "plan_codec", "plan_history", "plan_views", "streamlit_adapter", "usage_ledger",
+]
+# Must not be imported at start-up by our modules (Streamlit's own imports are excluded);
+# each is loaded lazily by the code path that needs it
+DEFERRED_MODULES = ["pandas", "plotly.graph_objects", "fuzzywuzzy"]
+# Cumulative import time budget for APP_MODULES, in milliseconds
+DEFAULT_BUDGET_MS = 1500
+
+_LINE_RE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def profile_imports(modules=APP_MODULES) -> list:
+    """Returns [(module, self_us, cumulative_us, depth)] for one cold import of modules."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {', '.join(modules)}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Import failed:\n{result.stderr[-2000:]}")
+    entries = []
+    for line in result.stderr.splitlines():
+        match = _LINE_RE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            entries.append((name, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    return entries
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Profile the app's start-up imports.")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--top", type=int, default=15, help="Number of slowest imports to list")
+    parser.add_argument("--check", action="store_true", help="Exit 1 if over budget or a deferred module is imported")
+    args = parser.parse_args()
+
+    entries = profile_imports()
+    top_level = [e for e in entries if e[3] == 0]
+    total_ms = sum(e[2] for e in top_level) / 1000
+    streamlit_imports = {e[0] for e in profile_imports(["streamlit"])}
+    own_imports = {e[0] for e in entries} - streamlit_imports
+
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for name, self_us, cumulative_us, depth in sorted(entries, key=lambda e: e[2], reverse=True)[:args.top]:
+        print(f"{cumulative_us / 1000:14.1f} {self_us / 1000:9.1f}  {'  ' * depth}{name}")
+    print(f"\nTotal start-up import time: {total_ms:.0f} ms (budget {args.budget_ms:.0f} ms)")
+
+    own_ms = sum(e[2] for e in top_level if e[0] != "streamlit") / 1000
+    print(f"  of which app modules and their own dependencies: {own_ms:.0f} ms")
+
+    problems = [f"{m} is imported at start-up" for m in DEFERRED_MODULES if m in own_imports]
+    if total_ms > args.budget_ms:
+        problems.append(f"start-up imports take {total_ms:.0f} ms, over the {args.budget_ms:.0f} ms budget")
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    return 1 if problems and args.check else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,25 @@
+import sqlite3
+import logging
+from contextlib import contextmanager
+
+from constants import DB_PATH
+
+log = logging.getLogger(__name__)
+
+
+@contextmanager
+def open_db(db_path: str = None):
+    """
+    Yields a connection to the local planner database and closes it afterwards.
+    Connections are cheap, so callers open one per operation instead of sharing
+    them between threads. WAL mode lets several Streamlit workers read while one writes.
+    Statements run in autocommit mode; use "BEGIN IMMEDIATE" for multi-statement writes.
+    """
+    conn = sqlite3.connect(db_path or DB_PATH, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        yield conn
+    finally:
+        conn.close()
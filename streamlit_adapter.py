@@ -0,0 +1,26 @@
+"""
+Thin Streamlit layer over the UI-agnostic core.
+
+Core modules raise errors.MealPlannerError subclasses instead of writing to the page, and
+background jobs store the error's message; the app shows either with show_error().
+"""
+
+import streamlit as st
+
+from errors import MealPlannerError
+
+
+def show_error(error, fallback: str = None) -> None:
+    """
+    Shows a MealPlannerError (message, then its hint and upstream detail) or a stored error string,
+    e.g. a failed job's error. fallback is shown instead when there is no message.
+    """
+    if isinstance(error, MealPlannerError):
+        st.error(f"❌ {error.message}")
+        if error.hint:
+            st.info(error.hint)
+        if error.detail:
+            st.caption(error.detail)
+    else:
+        st.error(f"❌ {error or fallback}")
+
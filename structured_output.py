@@ -0,0 +1,208 @@
+"""
+Structured (JSON) output for Groq calls.
+
+response_format() asks each model for JSON in the strongest form it supports: a JSON Schema
+(structured outputs), plain JSON mode, or nothing for models without either. Replies are checked
+against the same schemas with precompiled validators (fastjsonschema, falling back to jsonschema),
+and check_meal_plan() pinpoints which days of a compact meal plan are broken, so only those days
+are sent back for repair instead of regenerating the whole plan.
+"""
+
+import re
+import json
+import logging
+from functools import lru_cache
+
+log = logging.getLogger(__name__)
+
+# Groq models that accept response_format {"type": "json_schema"}; the rest of GROQ_MODELS get JSON mode
+JSON_SCHEMA_MODELS = {"openai/gpt-oss-120b", "openai/gpt-oss-20b"}
+# Groq models that accept no response_format at all; they rely on the prompt alone
+NO_JSON_MODE_MODELS = {"groq/compound", "groq/compound-mini"}
+
+# One compact meal plan row: [meal, dish, grams, kcal, protein, carbs, fat] (meal_plan_schema.COMPACT_COLUMNS)
+MEAL_ROW_SCHEMA = {
+    "type": "array",
+    "minItems": 7,
+    "maxItems": 7,
+    "items": [
+        {"type": "string", "minLength": 1},
+        {"type": "string", "minLength": 1},
+        {"type": "number", "minimum": 0},
+        {"type": "number", "minimum": 0},
+        {"type": "number", "minimum": 0},
+        {"type": "number", "minimum": 0},
+        {"type": "number", "minimum": 0},
+    ],
+}
+MEAL_PLAN_DAY_SCHEMA = {"type": "array", "minItems": 3, "items": MEAL_ROW_SCHEMA}
+
+# One dish of a grocery decomposition reply; units and categories are normalized by grocery.py
+DISH_DECOMPOSITION_SCHEMA = {
+    "type": "object",
+    "required": ["dish", "ingredients"],
+    "properties": {
+        "dish": {"type": "string", "minLength": 1},
+        "serving_grams": {"type": ["number", "null"], "minimum": 0},
+        "ingredients": {
+            "type": "array",
+            "minItems": 1,
+            "items": {
+                "type": "object",
+                "required": ["name", "quantity", "unit"],
+                "properties": {
+                    "name": {"type": "string", "minLength": 1},
+                    "quantity": {"type": "number", "minimum": 0},
+                    "unit": {"type": "string"},
+                    "category": {"type": "string"},
+                },
+            },
+        },
+    },
+}
+GROCERY_DECOMPOSITION_SCHEMA = {
+    "$schema": "http://json-schema.org/draft-07/schema#",
+    "type": "object",
+    "required": ["dishes"],
+    "properties": {"dishes": {"type": "array", "items": DISH_DECOMPOSITION_SCHEMA}},
+}
+
+_DAY_START_RE = re.compile(r'"(day\d+)"\s*:\s*\[')
+
+
+@lru_cache(maxsize=16)
+def meal_plan_schema(day_keys: tuple) -> dict:
+    """Schema of a compact plan {"days": {dayN: [rows]}} with exactly day_keys. Shared; do not modify."""
+    return {
+        "$schema": "http://json-schema.org/draft-07/schema#",
+        "type": "object",
+        "required": ["days"],
+        "properties": {
+            "days": {
+                "type": "object",
+                "required": list(day_keys),
+                "properties": {key: MEAL_PLAN_DAY_SCHEMA for key in day_keys},
+            },
+        },
+    }
+
+
+def compile_validator(schema: dict):
+    """
+    Returns validate(instance) -> None if valid, else a short error message.
+    Uses fastjsonschema (compiled to Python code, much faster on repeated use) when installed.
+    """
+    try:
+        import fastjsonschema
+    except ImportError:
+        fastjsonschema = None
+
+    if fastjsonschema is not None:
+        check = fastjsonschema.compile(schema)
+
+        def validate(instance):
+            try:
+                check(instance)
+                return None
+            except fastjsonschema.JsonSchemaValueException as e:
+                return e.message
+
+        return validate
+
+    from jsonschema import Draft7Validator
+
+    validator = Draft7Validator(schema)
+
+    def validate(instance):
+        error = next(validator.iter_errors(instance), None)
+        if error is None:
+            return None
+        path = ".".join(str(p) for p in error.absolute_path)
+        return f"{path}: {error.message}" if path else error.message
+
+    return validate
+
+
+@lru_cache(maxsize=None)
+def _validator(name: str):
+    schemas = {
+        "meal_plan_day": {"$schema": "http://json-schema.org/draft-07/schema#", **MEAL_PLAN_DAY_SCHEMA},
+        "dish_decomposition": {"$schema": "http://json-schema.org/draft-07/schema#", **DISH_DECOMPOSITION_SCHEMA},
+    }
+    return compile_validator(schemas[name])
+
+
+def validate_day(rows) -> str:
+    """None if rows is a valid compact meal plan day, else the problem."""
+    return _validator("meal_plan_day")(rows)
+
+
+def validate_dish_decomposition(entry) -> str:
+    """None if entry is a valid dish decomposition, else the problem."""
+    return _validator("dish_decomposition")(entry)
+
+
+def response_format(model: str, name: str, schema: dict):
+    """The response_format to send to model: a JSON Schema, JSON mode, or None if unsupported."""
+    if model in NO_JSON_MODE_MODELS:
+        return None
+    if model in JSON_SCHEMA_MODELS:
+        return {"type": "json_schema", "json_schema": {"name": name, "schema": schema, "strict": False}}
+    return {"type": "json_object"}
+
+
+def _salvage_days(json_str: str) -> dict:
+    """
+    Splits text that is not valid JSON into per-day fragments: {day_key: fragment text}.
+    A syntax error then only costs the day it occurs in.
+    """
+    starts = list(_DAY_START_RE.finditer(json_str))
+    fragments = {}
+    for current, following in zip(starts, starts[1:] + [None]):
+        end = following.start() if following else len(json_str)
+        fragments[current.group(1)] = json_str[current.end() - 1:end].rstrip().rstrip(",}").rstrip()
+    return fragments
+
+
+def check_meal_plan(json_str: str, day_keys) -> tuple:
+    """
+    Checks a compact meal plan reply day by day.
+    Returns (valid_days, problems): valid_days maps day_key -> rows for the days that passed,
+    problems maps day_key -> (reason, fragment text) for days that are missing or invalid.
+    Returns (None, None) if json_str is valid JSON in another layout (e.g. the verbose format)
+    or contains no recognizable days.
+    """
+    try:
+        data = json.loads(json_str)
+    except json.JSONDecodeError:
+        data = None
+
+    if data is not None:
+        days = data.get("days", data.get("meal_plan")) if isinstance(data, dict) else None
+        if not isinstance(days, dict) or not any(isinstance(v, list) for v in days.values()):
+            return None, None
+        fragments = {key: json.dumps(rows, separators=(",", ":")) for key, rows in days.items()}
+    else:
+        fragments = _salvage_days(json_str)
+        if not fragments:
+            return None, None
+        days = {}
+        for key, fragment in fragments.items():
+            try:
+                days[key] = json.loads(fragment)
+            except json.JSONDecodeError as e:
+                days[key] = None
+                log.info(f"Meal plan {key} is not valid JSON: {e}")
+
+    valid, problems = {}, {}
+    for key in day_keys:
+        if key not in fragments:
+            problems[key] = ("missing", "")
+            continue
+        rows = days.get(key)
+        error = "not valid JSON" if rows is None else validate_day(rows)
+        if error:
+            problems[key] = (error, fragments[key])
+        else:
+            valid[key] = rows
+    return valid, problems
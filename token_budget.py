@@ -0,0 +1,46 @@
+"""
+Output token budgets for LLM calls.
+
+max_tokens is sized from the expected output: tokens per unit (a plan day, a dish) times the units
+requested, plus fixed overhead and headroom. The per-unit figure starts from a prior and then
+follows observed completion token usage (a high percentile of recent calls), so budgets track how
+verbose the models actually are. A reply that still runs over is continued rather than regenerated
+(see groq_api._continue_truncated), so a slightly short budget only costs the missing tail.
+"""
+
+import math
+import threading
+from collections import deque
+
+
+class OutputTokenBudget:
+    """Adaptive max_tokens for one kind of request; thread-safe, one instance per process."""
+
+    def __init__(self, prior_per_unit: float, overhead: int, headroom: float = 1.25,
+                 floor: int = 256, ceiling: int = 8000, window: int = 50, percentile: float = 0.9):
+        self.prior_per_unit = prior_per_unit
+        self.overhead = overhead
+        self.headroom = headroom
+        self.floor = floor
+        self.ceiling = ceiling
+        self.percentile = percentile
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def per_unit(self) -> float:
+        """Expected completion tokens per unit: the prior until calls have been observed."""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return self.prior_per_unit
+        return samples[int(self.percentile * (len(samples) - 1))]
+
+    def max_tokens(self, units: int) -> int:
+        estimate = (self.per_unit() * max(units, 1) + self.overhead) * self.headroom
+        return int(min(self.ceiling, max(self.floor, math.ceil(estimate))))
+
+    def observe(self, units: int, completion_tokens: int) -> None:
+        """Records the completion tokens a finished (untruncated or continued) reply used for units."""
+        if units > 0 and completion_tokens and completion_tokens > 0:
+            with self._lock:
+                self._samples.append(completion_tokens / units)
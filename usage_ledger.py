@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+"""
+Ledger of LLM usage: tokens, timing and estimated cost of every upstream call.
+
+Each call (Groq meal plans, grocery decompositions and connectivity tests, Gemini image analysis
+and evaluation) appends one row to the llm_usage table in the planner database. Rows are never
+updated, so recording is a single insert. rollup() aggregates them by hour, model, feature or user,
+and the same data backs budgets: check_budget() refuses further calls once an operation has made
+LLM_MAX_CALLS_PER_OPERATION calls (runaway fallbacks, repairs or continuations) or a user or the
+whole deployment has used its hourly token budget.
+
+The user a call is made for comes from the current_user context variable; set it with acting_user().
+
+    python usage_ledger.py --hours 24 --by hour,model,feature
+"""
+
+import time
+import logging
+import argparse
+import threading
+import contextvars
+from contextlib import contextmanager
+from functools import wraps
+
+from constants import (
+    LLM_USAGE_RETENTION_DAYS, LLM_MAX_CALLS_PER_OPERATION, LLM_USER_HOURLY_TOKEN_BUDGET, LLM_HOURLY_TOKEN_BUDGET,
+    LLM_PRICES_PER_MILLION,
+)
+from errors import BudgetExceededError
+from storage import open_db
+
+log = logging.getLogger(__name__)
+
+# Expired rows are pruned on one insert in this many
+_PRUNE_EVERY = 500
+GROUP_COLUMNS = ("hour", "provider", "model", "feature", "user_id", "status")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_usage (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    provider TEXT NOT NULL,
+    model TEXT NOT NULL,
+    feature TEXT NOT NULL,
+    user_id TEXT,
+    status TEXT NOT NULL,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    completion_tokens INTEGER NOT NULL DEFAULT 0,
+    total_tokens INTEGER NOT NULL DEFAULT 0,
+    queue_time REAL,
+    prompt_time REAL,
+    completion_time REAL,
+    latency REAL,
+    cost_usd REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_llm_usage_created ON llm_usage (created_at);
+CREATE INDEX IF NOT EXISTS idx_llm_usage_user ON llm_usage (user_id, created_at);
+"""
+
+# User the current calls are made for (a session uid, an API client id); None for batch work
+current_user = contextvars.ContextVar("llm_usage_user", default=None)
+# Shared user id for API clients that do not identify themselves; they share one hourly budget
+ANONYMOUS_USER = "anonymous"
+# Counters of the operation in progress (see metered)
+_operation = contextvars.ContextVar("llm_usage_operation", default=None)
+
+_schema_ready = False
+_writes = 0
+_lock = threading.Lock()
+
+
+def _ensure_schema(conn) -> None:
+    global _schema_ready
+    if not _schema_ready:
+        conn.executescript(_SCHEMA)
+        _schema_ready = True
+
+
+@contextmanager
+def acting_user(user_id):
+    """Attributes the calls made inside the block to user_id."""
+    token = current_user.set(user_id)
+    try:
+        yield
+    finally:
+        current_user.reset(token)
+
+
+def metered(feature: str):
+    """
+    Decorator marking one user-level operation (a meal plan, a grocery list). Calls made inside it
+    are recorded under feature and count toward its LLM_MAX_CALLS_PER_OPERATION limit.
+    Nested metered functions share the outermost operation.
+    """
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _operation.get() is not None:
+                return fn(*args, **kwargs)
+            token = _operation.set({"feature": feature, "calls": 0, "tokens": 0})
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _operation.reset(token)
+        return wrapper
+    return decorate
+
+
+def tokens_used(since: float, user_id: str = None, db_path: str = None) -> int:
+    """Total tokens recorded since a timestamp, for one user or (user_id None) for everyone."""
+    query = "SELECT COALESCE(SUM(total_tokens), 0) FROM llm_usage WHERE created_at >= ?"
+    params = [since]
+    if user_id is not None:
+        query += " AND user_id = ?"
+        params.append(user_id)
+    with open_db(db_path) as conn:
+        _ensure_schema(conn)
+        return conn.execute(query, params).fetchone()[0]
+
+
+def check_budget(db_path: str = None) -> None:
+    """Raises BudgetExceededError if the next upstream call would exceed a budget; call before each request."""
+    operation = _operation.get()
+    if operation is not None and LLM_MAX_CALLS_PER_OPERATION and operation["calls"] >= LLM_MAX_CALLS_PER_OPERATION:
+        raise BudgetExceededError(
+            f"Stopped {operation['feature'].replace('_', ' ')} after {operation['calls']} AI requests.",
+            hint="Please try again in a moment.",
+        )
+    hour_ago = time.time() - 3600
+    user_id = current_user.get()
+    if user_id is not None and LLM_USER_HOURLY_TOKEN_BUDGET and tokens_used(hour_ago, user_id, db_path) >= LLM_USER_HOURLY_TOKEN_BUDGET:
+        raise BudgetExceededError("You have reached the hourly AI usage limit.", hint="Please try again later.")
+    if LLM_HOURLY_TOKEN_BUDGET and tokens_used(hour_ago, None, db_path) >= LLM_HOURLY_TOKEN_BUDGET:
+        raise BudgetExceededError("The planner has reached its hourly AI usage limit.", hint="Please try again later.")
+
+
+def groq_usage(result_json: dict) -> dict:
+    """Usage fields of a Groq (OpenAI-compatible) chat completion."""
+    usage = (result_json or {}).get("usage") or {}
+    return {k: usage.get(k) for k in ("prompt_tokens", "completion_tokens", "total_tokens", "queue_time", "prompt_time", "completion_time")}
+
+
+def gemini_usage(result_json: dict) -> dict:
+    """Usage fields of a Gemini generateContent response."""
+    usage = (result_json or {}).get("usageMetadata") or {}
+    return {
+        "prompt_tokens": usage.get("promptTokenCount"),
+        "completion_tokens": usage.get("candidatesTokenCount"),
+        "total_tokens": usage.get("totalTokenCount"),
+    }
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    prompt_price, completion_price = LLM_PRICES_PER_MILLION.get(model, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+
+def record(provider: str, model: str, feature: str, status: str, usage: dict = None,
+           latency: float = None, db_path: str = None) -> None:
+    """
+    Appends one call to the ledger. feature is overridden by the enclosing metered operation, if any.
+    Never raises: a ledger failure must not fail the call it describes.
+    """
+    usage = usage or {}
+    prompt_tokens = int(usage.get("prompt_tokens") or 0)
+    completion_tokens = int(usage.get("completion_tokens") or 0)
+    total_tokens = int(usage.get("total_tokens") or prompt_tokens + completion_tokens)
+    operation = _operation.get()
+    if operation is not None:
+        operation["calls"] += 1
+        operation["tokens"] += total_tokens
+        feature = operation["feature"]
+
+    global _writes
+    try:
+        now = time.time()
+        with open_db(db_path) as conn:
+            _ensure_schema(conn)
+            conn.execute(
+                "INSERT INTO llm_usage (created_at, provider, model, feature, user_id, status, prompt_tokens, "
+                "completion_tokens, total_tokens, queue_time, prompt_time, completion_time, latency, cost_usd) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (now, provider, model, feature, current_user.get(), status, prompt_tokens, completion_tokens,
+                 total_tokens, usage.get("queue_time"), usage.get("prompt_time"), usage.get("completion_time"),
+                 latency, estimate_cost(model, prompt_tokens, completion_tokens)),
+            )
+            with _lock:
+                _writes += 1
+                prune = _writes % _PRUNE_EVERY == 0
+            if prune:
+                conn.execute("DELETE FROM llm_usage WHERE created_at < ?", (now - LLM_USAGE_RETENTION_DAYS * 86400,))
+    except Exception as e:
+        log.warning(f"Could not record LLM usage for {provider}/{model}: {e}")
+
+
+def rollup(since: float, until: float = None, by=("hour", "model", "feature"), db_path: str = None) -> list:
+    """
+    Aggregates calls between since and until (timestamps) by the given GROUP_COLUMNS.
+    Returns dicts with the group columns plus calls, errors, prompt_tokens, completion_tokens,
+    total_tokens, avg_latency and cost_usd, ordered by the group columns.
+    """
+    unknown = set(by) - set(GROUP_COLUMNS)
+    if unknown:
+        raise ValueError(f"Cannot group by {sorted(unknown)}; choose from {GROUP_COLUMNS}")
+    expressions = {column: "CAST(created_at / 3600 AS INTEGER) * 3600" if column == "hour" else column for column in by}
+    select = ", ".join(f"{expr} AS {column}" for column, expr in expressions.items())
+    group = ", ".join(by)
+    query = (
+        f"SELECT {select + ', ' if select else ''}COUNT(*) AS calls, SUM(status != 'ok') AS errors, "
+        "SUM(prompt_tokens) AS prompt_tokens, SUM(completion_tokens) AS completion_tokens, "
+        "SUM(total_tokens) AS total_tokens, AVG(latency) AS avg_latency, SUM(cost_usd) AS cost_usd "
+        "FROM llm_usage WHERE created_at >= ? AND created_at < ?"
+        f"{' GROUP BY ' + group + ' ORDER BY ' + group if group else ''}"
+    )
+    with open_db(db_path) as conn:
+        _ensure_schema(conn)
+        rows = conn.execute(query, (since, until if until is not None else time.time() + 1)).fetchall()
+    return [dict(row) for row in rows]
+
+
+def format_report(rows: list, by) -> str:
+    """Plain-text table of rollup() rows."""
+    headers = [*by, "calls", "errors", "prompt_tok", "completion_tok", "avg_latency_s", "cost_usd"]
+    lines = []
+    for row in rows:
+        groups = [
+            time.strftime("%Y-%m-%d %H:00", time.localtime(row["hour"])) if column == "hour" else str(row[column])
+            for column in by
+        ]
+        lines.append([
+            *groups, str(row["calls"]), str(row["errors"]), str(row["prompt_tokens"]), str(row["completion_tokens"]),
+            f"{row['avg_latency']:.2f}" if row["avg_latency"] is not None else "-", f"{row['cost_usd']:.4f}",
+        ])
+    widths = [max(len(h), *(len(line[i]) for line in lines)) if lines else len(h) for i, h in enumerate(headers)]
+    table = [headers] + lines
+    return "\n".join("  ".join(cell.ljust(width) for cell, width in zip(line, widths)) for line in table)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report LLM token usage, latency and cost.")
+    parser.add_argument("--hours", type=float, default=24, help="Report window ending now (default 24)")
+    parser.add_argument("--by", default="hour,model,feature", help=f"Comma-separated grouping from {','.join(GROUP_COLUMNS)}")
+    parser.add_argument("--db", default=None, help="Planner database (default: MEAL_PLANNER_DB)")
+    args = parser.parse_args()
+
+    by = [column.strip() for column in args.by.split(",") if column.strip()]
+    rows = rollup(time.time() - args.hours * 3600, by=by, db_path=args.db)
+    print(format_report(rows, by))
+    total = rollup(time.time() - args.hours * 3600, by=(), db_path=args.db)[0]
+    print(f"\nTotal: {total['calls']} calls, {total['total_tokens'] or 0} tokens, ${total['cost_usd'] or 0:.4f} estimated")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+USDA FoodData Central lookups shared by the Groq and Gemini modules.
+
+Lookups resolve in two cached stages, both in the shared cache (shared_cache.py) so a dish
+resolved by one worker is reused by every other:
+
+1. dish name -> FDC id: a full-text search, done once per normalized dish name and remembered
+   for USDA_CACHE_TTL_SECONDS. Dishes without a good match are remembered for
+   USDA_NEGATIVE_CACHE_TTL_SECONDS.
+2. FDC id -> nutrients: kept for USDA_FOOD_CACHE_TTL_SECONDS. Search hits seed it, and ids whose
+   entry expired are fetched together through the multi-id /foods endpoint.
+
+Nutrients are read by FDC nutrient id in a single pass over each record (nutrient_table) and
+converted to the units of USDA_NUTRIENTS (extract_nutrients), so USDA's "G", "KCAL" and "kJ"
+units compare correctly.
+
+fetch_nutrition_data_bulk() looks up many dishes at once, so validating a week costs one /foods
+request for the ids not cached instead of a search per dish. A circuit breaker stops calling
+USDA after repeated failures, so an outage costs callers nothing but the fallback to the AI estimate.
+"""
+
+import logging
+
+import requests
+
+from constants import (
+    USDA_API_KEY, USDA_BASE_URL, USDA_FOODS_URL, USDA_CACHE_TTL_SECONDS, USDA_NEGATIVE_CACHE_TTL_SECONDS,
+    USDA_FOOD_CACHE_TTL_SECONDS, USDA_FOODS_BATCH_SIZE, USDA_BREAKER_FAILURE_THRESHOLD, USDA_BREAKER_RESET_SECONDS,
+    USDA_NUTRIENTS,
+)
+from circuit_breaker import CircuitBreaker
+from errors import CircuitOpenError
+from shared_cache import cached_call, cached_many
+
+log = logging.getLogger(__name__)
+
+# Minimum fuzzy name match (0-100) for a search hit to count as the requested food
+MIN_MATCH_SCORE = 65
+# FDC nutrient id -> legacy nutrient number; /foods filters by number and abridged records carry only the number
+NUTRIENT_NUMBERS = {
+    1008: "208",  # Energy (kcal)
+    2047: "957",  # Energy (Atwater General Factors)
+    2048: "958",  # Energy (Atwater Specific Factors)
+    1062: "268",  # Energy (kJ)
+    1003: "203",  # Protein
+    1004: "204",  # Total lipid (fat)
+    1005: "205",  # Carbohydrate, by difference
+}
+_IDS_BY_NUMBER = {number: nutrient_id for nutrient_id, number in NUTRIENT_NUMBERS.items()}
+_TRACKED_IDS = {nutrient_id for nutrient_ids, _ in USDA_NUTRIENTS.values() for nutrient_id in nutrient_ids}
+_NUTRIENT_FILTER = ",".join(sorted(NUTRIENT_NUMBERS[i] for i in _TRACKED_IDS if i in NUTRIENT_NUMBERS))
+# Convertible units, each family as unit -> size in a common base
+_UNIT_FACTORS = (
+    {"g": 1.0, "mg": 1e-3, "ug": 1e-6, "\u00b5g": 1e-6, "mcg": 1e-6},
+    {"kcal": 1.0, "kj": 1 / 4.184},
+)
+
+_breaker = CircuitBreaker(
+    "USDA FoodData Central", USDA_BREAKER_FAILURE_THRESHOLD, USDA_BREAKER_RESET_SECONDS,
+    failure_exceptions=(requests.exceptions.RequestException,),
+)
+
+
+def _normalize_query(food_name) -> str:
+    return " ".join(str(food_name).lower().split())
+
+
+def fetch_nutrition_data_from_usda(food_name: str) -> dict:
+    """
+    Fetches nutrition data for a given food name from the USDA FoodData Central API.
+    Returns {"calories", "protein", "carbs", "fat"} or None if not found or on error.
+    """
+    return fetch_nutrition_data_bulk([food_name]).get(food_name)
+
+
+def fetch_nutrition_data_bulk(food_names: list) -> dict:
+    """
+    Nutrition data for many food names at once: {food_name: {"calories", "protein", "carbs", "fat"} or None}.
+    Unresolved names cost one search each; nutrients of all resolved ids come from the cache or one
+    /foods request per USDA_FOODS_BATCH_SIZE ids.
+    """
+    results = {name: None for name in food_names}
+    resolved = {}
+    for name in dict.fromkeys(food_names):
+        match = resolve_fdc_id(name)
+        if match:
+            resolved[name] = match["fdc_id"]
+    if not resolved:
+        return results
+
+    try:
+        foods = cached_many("usda_nutrients", list(resolved.values()), USDA_FOOD_CACHE_TTL_SECONDS, _fetch_foods)
+    except CircuitOpenError:
+        return results
+    except Exception as e:
+        log.error(f"USDA fetch error: {str(e)}")
+        return results
+
+    for name, fdc_id in resolved.items():
+        food = foods.get(fdc_id)
+        if food:
+            results[name] = _nutrition_from_food(food)
+    return results
+
+
+def resolve_fdc_id(food_name: str) -> dict:
+    """The USDA food chosen for food_name, {"fdc_id", "score", "description"}, or None if there is no good match or on error."""
+    query = _normalize_query(food_name)
+    if not query:
+        return None
+    try:
+        return cached_call(
+            "usda_fdc_id", (query,), USDA_CACHE_TTL_SECONDS, lambda: _breaker.call(_search_usda, food_name),
+            miss_ttl_seconds=USDA_NEGATIVE_CACHE_TTL_SECONDS,
+        )
+    except CircuitOpenError:
+        return None
+    except Exception as e:
+        log.error(f"USDA fetch error: {str(e)}")
+        return None
+
+
+def _search_usda(food_name: str) -> dict:
+    """Best USDA match for food_name, or None if there is no good match; raises on request failures."""
+    from fuzzywuzzy import fuzz  # deferred: only USDA lookups need fuzzy matching
+
+    params = {
+        "api_key": USDA_API_KEY,
+        "query": food_name,
+        "pageSize": 3,  # Get top 3 for better matching
+        "dataType": ["Survey (FNDDS)"]  # Focus on standard reference data
+    }
+
+    response = requests.get(USDA_BASE_URL, params=params, timeout=15)
+    response.raise_for_status()
+
+    best_match = None
+    best_score = 0
+
+    for food in response.json().get("foods", []):
+        # Use fuzzy matching to find best name match
+        score = fuzz.ratio(food_name.lower(), food["description"].lower())
+        if score > best_score:
+            best_match = food
+            best_score = score
+
+    if best_score < MIN_MATCH_SCORE:
+        return None
+
+    # The search hit already carries the nutrients: seed stage 2 so this id needs no /foods call
+    food = _compact_food(best_match)
+    cached_many("usda_nutrients", [food["fdc_id"]], USDA_FOOD_CACHE_TTL_SECONDS, lambda ids: {food["fdc_id"]: food})
+    return {"fdc_id": food["fdc_id"], "score": best_score, "description": food["description"]}
+
+
+def _fetch_foods(fdc_ids: list) -> dict:
+    """Fetches foods by FDC id through /foods, USDA_FOODS_BATCH_SIZE ids per request: {fdc_id: compact food}."""
+    foods = {}
+    for start in range(0, len(fdc_ids), USDA_FOODS_BATCH_SIZE):
+        batch = fdc_ids[start:start + USDA_FOODS_BATCH_SIZE]
+        log.info(f"Fetching {len(batch)} USDA foods by id")
+        params = {
+            "api_key": USDA_API_KEY,
+            "fdcIds": ",".join(str(fdc_id) for fdc_id in batch),
+            "format": "full",
+            "nutrients": _NUTRIENT_FILTER,
+        }
+        for record in _breaker.call(_get_json, USDA_FOODS_URL, params):
+            food = _compact_food(record)
+            foods[food["fdc_id"]] = food
+    return foods
+
+
+def _get_json(url: str, params: dict):
+    response = requests.get(url, params=params, timeout=15)
+    response.raise_for_status()
+    return response.json()
+
+
+def nutrient_table(record: dict) -> dict:
+    """
+    {nutrient id: (value, unit)} for the tracked nutrients of a food, built in one pass over its
+    foodNutrients. Accepts search hits ({"nutrientId", "unitName", "value"}), /foods "full" records
+    ({"nutrient": {"id", "unitName"}, "amount"}) and "abridged" ones ({"number", "unitName", "amount"}).
+    """
+    table = {}
+    for item in record.get("foodNutrients", []):
+        nutrient = item.get("nutrient") or {}
+        nutrient_id = item.get("nutrientId", nutrient.get("id"))
+        if nutrient_id is None:
+            nutrient_id = _IDS_BY_NUMBER.get(str(item.get("nutrientNumber", nutrient.get("number", item.get("number")))))
+        value = item.get("value", item.get("amount"))
+        if nutrient_id in _TRACKED_IDS and value is not None and nutrient_id not in table:
+            table[nutrient_id] = (float(value), str(item.get("unitName", nutrient.get("unitName", ""))))
+    return table
+
+
+def convert_unit(value: float, unit: str, target_unit: str) -> float:
+    """value in unit expressed in target_unit (mass or energy units), or None if they are not comparable."""
+    unit, target_unit = unit.lower(), target_unit.lower()
+    for factors in _UNIT_FACTORS:
+        if unit in factors and target_unit in factors:
+            return value * factors[unit] / factors[target_unit]
+    return None
+
+
+def extract_nutrients(table: dict, nutrients: dict = None) -> dict:
+    """
+    {name: value} for each nutrient in nutrients (default USDA_NUTRIENTS: name -> (ids by preference, unit)),
+    taking the first id the table has in a convertible unit; names without one map to None.
+    """
+    values = {}
+    for name, (nutrient_ids, unit) in (nutrients or USDA_NUTRIENTS).items():
+        values[name] = next(
+            (converted for nutrient_id in nutrient_ids if nutrient_id in table
+             for converted in [convert_unit(*table[nutrient_id], unit)] if converted is not None),
+            None,
+        )
+    return values
+
+
+def _compact_food(record: dict) -> dict:
+    """Keeps the id, description and tracked nutrients ({"<id>": [value, unit]}) of a search hit or /foods record."""
+    table = nutrient_table(record)
+    return {
+        "fdc_id": int(record["fdcId"]),
+        "description": record.get("description", ""),
+        "nutrients": {str(nutrient_id): [value, unit] for nutrient_id, (value, unit) in table.items()},
+    }
+
+
+def _nutrition_from_food(food: dict) -> dict:
+    table = {int(nutrient_id): tuple(entry) for nutrient_id, entry in food["nutrients"].items()}
+    nutrients = extract_nutrients(table)
+
+    # Every nutrient must be reported; only energy has to be non-zero (chicken has no carbs, fruit no fat)
+    if any(v is None for v in nutrients.values()) or not nutrients.get("calories"):
+        return None
+    return {name: round(value, 2) for name, value in nutrients.items()}